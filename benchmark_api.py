@@ -0,0 +1,431 @@
+#!/usr/bin/env python3
+"""
+Benchmark de la API de reconocimiento facial
+No necesita red: genera frames JPEG sintéticos (los rostros de persona*.png
+pegados sobre fondos aleatorios) y una galería sintética del tamaño indicado.
+
+- Carga: /recognize, /verify y /recognize_batch a una concurrencia dada, con el
+  test client de Flask (en proceso) o contra un servidor local (--url).
+  Reporta throughput, latencias p50/p95/p99 y memoria (RSS).
+- Detección en resolución reducida (face_preprocessing.py): latencia, rostros
+  encontrados, IoU de las cajas y similitud de los embeddings contra la
+  detección a resolución completa, para cada DETECTION_MAX_SIDE.
+- Micro-benchmarks: matching contra la galería, galería cuantizada int8
+  frente a float32 (face_quantization.py), prototipos por identidad
+  frente a la galería completa (face_prototypes.py), compute_statistics y el
+  reporte de calidad de la galería completa (face_quality.py).
+
+Los resultados se escriben en JSON para poder comparar entre versiones.
+
+Uso:
+    python benchmark_api.py --gallery-size 10000 --requests 200 --concurrency 8
+    python benchmark_api.py --url http://localhost:5000 --endpoints recognize
+    python benchmark_api.py --micro-only --output resultados.json
+"""
+
+import io
+import sys
+import json
+import time
+import argparse
+import platform
+import contextlib
+import urllib.request
+import numpy as np
+import cv2
+from datetime import datetime
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Tuple
+
+from face_index import synthetic_gallery
+
+FACE_IMAGES = sorted(Path(".").glob("persona*.png"))
+
+
+def rss_mb() -> float:
+    """Memoria residente actual del proceso en MB (None si no se puede medir)"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+    except ImportError:
+        return None
+
+
+def percentiles(latencies: List[float]) -> Dict:
+    """p50/p95/p99 y promedio en milisegundos"""
+    if not latencies:
+        return {}
+    ms = np.asarray(latencies) * 1000
+    return {
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p95_ms': float(np.percentile(ms, 95)),
+        'p99_ms': float(np.percentile(ms, 99)),
+        'mean_ms': float(ms.mean())
+    }
+
+
+def synthetic_frame(width: int, height: int, rng: np.random.Generator,
+                    face_scale: float = 0.35, quality: int = 80) -> bytes:
+    """Frame JPEG con un rostro de persona*.png sobre un fondo aleatorio"""
+    frame = rng.integers(0, 255, size=(height, width, 3), dtype=np.uint8)
+    frame = cv2.GaussianBlur(frame, (31, 31), 0)
+
+    if FACE_IMAGES:
+        face = cv2.imread(str(FACE_IMAGES[rng.integers(len(FACE_IMAGES))]))
+        side = int(min(width, height) * face_scale)
+        face = cv2.resize(face, (side * face.shape[1] // face.shape[0], side))
+        x = int(rng.integers(0, max(1, width - face.shape[1])))
+        y = int(rng.integers(0, max(1, height - face.shape[0])))
+        frame[y:y + face.shape[0], x:x + face.shape[1]] = face[:height - y, :width - x]
+
+    ok, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return buffer.tobytes()
+
+
+class TestClientTarget:
+    """Requests en proceso con el test client de Flask"""
+
+    def __init__(self, gallery_size: int, identities_per: int = 5):
+        import face_recognition_api as api
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            api.warm_up()
+        num_identities = max(1, gallery_size // identities_per)
+        api.gallery, _ = synthetic_gallery(num_identities, identities_per)
+        self.api = api
+        self.client = api.app.test_client()
+
+    def post(self, path: str, **kwargs) -> Tuple[int, Dict]:
+        response = self.client.post(path, **kwargs)
+        return response.status_code, response.get_json(silent=True)
+
+
+class HttpTarget:
+    """Requests contra un servidor ya iniciado"""
+
+    def __init__(self, url: str):
+        self.url = url.rstrip('/')
+
+    def post(self, path: str, data=None, content_type=None, json_body=None) -> Tuple[int, Dict]:
+        if json_body is not None:
+            data = json.dumps(json_body).encode()
+            content_type = 'application/json'
+        req = urllib.request.Request(self.url + path, data=data, method='POST',
+                                     headers={'Content-Type': content_type})
+        try:
+            with urllib.request.urlopen(req) as response:
+                return response.status, json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            return e.code, None
+
+
+def multipart(fields: Dict[str, bytes]) -> Tuple[bytes, str]:
+    """Cuerpo multipart/form-data con un archivo JPEG por campo"""
+    boundary = 'benchmark-boundary-7f3a'
+    body = io.BytesIO()
+    for name, content in fields.items():
+        body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; '
+                   f'filename="{name}.jpg"\r\nContent-Type: image/jpeg\r\n\r\n'.encode())
+        body.write(content)
+        body.write(b'\r\n')
+    body.write(f'--{boundary}--\r\n'.encode())
+    return body.getvalue(), f'multipart/form-data; boundary={boundary}'
+
+
+def make_request(endpoint: str, frames: List[bytes], batch_images: int) -> Callable:
+    """Función que envía un request al endpoint usando frames rotativos"""
+    def send(target, i: int):
+        frame = frames[i % len(frames)]
+        if endpoint == 'recognize':
+            return target.post('/recognize', data=frame, content_type='image/jpeg')
+        if endpoint == 'verify':
+            body, ctype = multipart({'image1': frame, 'image2': frames[(i + 1) % len(frames)]})
+            return target.post('/verify', data=body, content_type=ctype)
+        if endpoint == 'recognize_batch':
+            body, ctype = multipart({
+                f'cam{j}': frames[(i + j) % len(frames)] for j in range(batch_images)
+            })
+            return target.post('/recognize_batch', data=body, content_type=ctype)
+        raise ValueError(f"Endpoint desconocido: {endpoint}")
+    return send
+
+
+def run_load(target, send: Callable, num_requests: int, concurrency: int) -> Dict:
+    """Envía num_requests requests con `concurrency` hilos y mide latencias"""
+    latencies, errors = [], 0
+
+    def one(i):
+        t0 = time.perf_counter()
+        status, body = send(target, i)
+        return time.perf_counter() - t0, status == 200 and bool(body and body.get('success'))
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for latency, ok in pool.map(one, range(num_requests)):
+            latencies.append(latency)
+            errors += not ok
+    wall = time.perf_counter() - t0
+
+    return dict(
+        requests=num_requests,
+        concurrency=concurrency,
+        errors=errors,
+        throughput_rps=num_requests / wall,
+        wall_s=wall,
+        rss_mb=rss_mb(),
+        **percentiles(latencies)
+    )
+
+
+def micro_matching(gallery_sizes: List[int], probes: int = 200, batch: int = 16,
+                   top_k: int = 5) -> List[Dict]:
+    """Latencia del matching contra galerías de distintos tamaños"""
+    results = []
+    for size in gallery_sizes:
+        gallery, queries = synthetic_gallery(max(1, size // 5), 5)
+        queries = np.resize(queries, (probes, gallery.dimension))
+
+        t0 = time.perf_counter()
+        for q in queries:
+            gallery.search(q, top_k=top_k)
+        single_ms = (time.perf_counter() - t0) * 1000 / probes
+
+        t0 = time.perf_counter()
+        for i in range(0, probes, batch):
+            gallery.search_batch(queries[i:i + batch], top_k=top_k)
+        batch_ms = (time.perf_counter() - t0) * 1000 / probes
+
+        results.append({
+            'gallery_size': gallery.num_embeddings,
+            'single_ms_per_probe': single_ms,
+            f'batch{batch}_ms_per_probe': batch_ms,
+            'gallery_mb': gallery.nbytes / 2**20
+        })
+    return results
+
+
+def micro_precision(gallery_sizes: List[int], precisions: List[str], probes: int = 512) -> List[Dict]:
+    """Memoria, throughput y coincidencia del ranking de la galería cuantizada contra float32"""
+    from face_quantization import benchmark
+
+    results = []
+    for size in gallery_sizes:
+        gallery, queries = synthetic_gallery(max(1, size // 5), 5)
+        queries = np.resize(queries, (probes, gallery.dimension))
+        for row in benchmark(gallery, queries, precisions):
+            results.append(dict(gallery_size=gallery.num_embeddings, **row))
+    return results
+
+
+def micro_prototypes(num_identities: List[int], per_identity: int = 25,
+                     max_prototypes: List[int] = (1, 4)) -> List[Dict]:
+    """Precisión y latencia con prototipos por identidad contra la galería completa"""
+    from face_prototypes import benchmark, synthetic_identities
+
+    results = []
+    for size in num_identities:
+        gallery, queries, labels = synthetic_identities(size, per_identity)
+        for row in benchmark(gallery, queries[:1000], labels[:1000], max_prototypes=max_prototypes):
+            results.append(dict(identities=size, **row))
+    return results
+
+
+def micro_statistics(sizes: List[int], dimension: int = 512) -> List[Dict]:
+    """Tiempo de FaceTrainer.compute_statistics para distintos números de fotos"""
+    from train_model_python import FaceTrainer
+
+    rng = np.random.default_rng(0)
+    results = []
+    for n in sizes:
+        # Sin __init__: no hace falta crear directorios para medir las estadísticas
+        trainer = FaceTrainer.__new__(FaceTrainer)
+        trainer.person_name = 'benchmark'
+        trainer.embeddings = list(rng.normal(size=(n, dimension)))
+        trainer.valid_photos = []
+
+        t0 = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            trainer.compute_statistics()
+        results.append({'num_embeddings': n, 'seconds': time.perf_counter() - t0})
+    return results
+
+
+def micro_quality(gallery_sizes: List[int]) -> List[Dict]:
+    """Tiempo del reporte de calidad (intra/inter, outliers, duplicados) de la galería"""
+    from face_quality import gallery_report
+
+    results = []
+    for size in gallery_sizes:
+        gallery, _ = synthetic_gallery(max(1, size // 5), 5)
+        t0 = time.perf_counter()
+        report = gallery_report(gallery)
+        results.append({
+            'gallery_size': gallery.num_embeddings,
+            'seconds': time.perf_counter() - t0,
+            'inter_pairs': report['inter']['pairs']
+        })
+    return results
+
+
+def box_iou(a: Dict, b: Dict) -> float:
+    """IoU entre dos facial_area de DeepFace"""
+    x1, y1 = max(a['x'], b['x']), max(a['y'], b['y'])
+    x2 = min(a['x'] + a['w'], b['x'] + b['w'])
+    y2 = min(a['y'] + a['h'], b['y'] + b['h'])
+    inter = max(0, x2 - x1) * max(0, y2 - y1)
+    return inter / (a['w'] * a['h'] + b['w'] * b['h'] - inter)
+
+
+def detection_tradeoff(width: int, height: int, max_sides: List[int], frames: int = 8,
+                       face_scales: Tuple[float, ...] = (0.12, 0.35)) -> List[Dict]:
+    """
+    Latencia vs. precisión de la detección en resolución reducida
+    La referencia es la detección a resolución completa (max_side=0): para cada
+    max_side se mide el tiempo de detección + alineación, la fracción de rostros
+    de referencia que se vuelven a encontrar, el IoU de sus cajas y la similitud
+    coseno entre los embeddings de ambos caminos
+    """
+    from face_inference import FaceEmbedder
+    from face_preprocessing import FacePreprocessor
+
+    embedder = FaceEmbedder()
+    rng = np.random.default_rng(1)
+    images = [
+        cv2.imdecode(np.frombuffer(synthetic_frame(width, height, rng, face_scale=scale, quality=90),
+                                   dtype=np.uint8), cv2.IMREAD_COLOR)
+        for scale in face_scales for _ in range(frames)
+    ]
+
+    def run(max_side: int):
+        preprocessor = FacePreprocessor("opencv", max_side)
+        latencies, faces = [], []
+        for img in images:
+            t0 = time.perf_counter()
+            try:
+                found = preprocessor.detect(img)
+            except ValueError:
+                found = []
+            latencies.append(time.perf_counter() - t0)
+            faces.append(found[0] if found else None)
+        return latencies, faces
+
+    def embed(face_objs):
+        batch = embedder.forward(embedder.prepare([f['face'] for f in face_objs]))
+        return batch / np.linalg.norm(batch, axis=1, keepdims=True)
+
+    run(0)  # Warm-up del detector
+    _, reference = run(0)
+    expected = [i for i, face in enumerate(reference) if face is not None]
+    reference_embeddings = dict(zip(expected, embed([reference[i] for i in expected]))) if expected else {}
+
+    results = []
+    for max_side in [0] + [side for side in max_sides if side]:
+        latencies, faces = run(max_side)
+        matched = [i for i in expected if faces[i] is not None
+                   and box_iou(faces[i]['facial_area'], reference[i]['facial_area']) > 0.5]
+        similarities = []
+        if matched:
+            embeddings = embed([faces[i] for i in matched])
+            similarities = [float(e @ reference_embeddings[i]) for i, e in zip(matched, embeddings)]
+        results.append({
+            'resolution': f"{width}x{height}",
+            'max_side': max_side,
+            **percentiles(latencies),
+            'recall': len(matched) / len(expected) if expected else None,
+            'mean_iou': float(np.mean([box_iou(faces[i]['facial_area'], reference[i]['facial_area'])
+                                       for i in matched])) if matched else None,
+            'min_similarity': min(similarities) if similarities else None,
+            'mean_similarity': float(np.mean(similarities)) if similarities else None
+        })
+    return results
+
+
+def print_table(title: str, rows: List[Dict]) -> None:
+    print(f"\n📊 {title}")
+    for row in rows:
+        print("   " + "  ".join(
+            f"{k}={v:.3f}" if isinstance(v, float) else f"{k}={v}" for k, v in row.items()
+        ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la API de reconocimiento facial")
+    parser.add_argument('--url', default=None, help="Servidor a probar (por defecto: test client en proceso)")
+    parser.add_argument('--endpoints', nargs='+', default=['recognize', 'verify', 'recognize_batch'])
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--gallery-size', type=int, default=10000)
+    parser.add_argument('--resolution', default='1280x720', help="Resolución de los frames sintéticos")
+    parser.add_argument('--frames', type=int, default=16, help="Frames distintos que se rotan")
+    parser.add_argument('--batch-images', type=int, default=4, help="Imágenes por request de /recognize_batch")
+    parser.add_argument('--detection-sides', type=int, nargs='+', default=[1280, 960, 640, 480],
+                        help="Valores de DETECTION_MAX_SIDE a comparar contra la resolución completa")
+    parser.add_argument('--matching-sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--precision-sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--precisions', nargs='+', default=['int8'],
+                        help="Precisiones de la galería a comparar contra float32")
+    parser.add_argument('--prototype-identities', type=int, nargs='+', default=[1000, 4000],
+                        help="Identidades (25 fotos cada una) para comparar prototipos contra la galería completa")
+    parser.add_argument('--statistics-sizes', type=int, nargs='+', default=[50, 200, 1000])
+    parser.add_argument('--quality-sizes', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--micro-only', action='store_true', help="Solo micro-benchmarks (sin modelo)")
+    parser.add_argument('--output', type=Path, default=Path('benchmark_results.json'))
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.resolution.lower().split('x'))
+    results = {
+        'timestamp': datetime.now().isoformat(),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'config': {k: (str(v) if isinstance(v, Path) else v) for k, v in vars(args).items()},
+        'load': {},
+        'micro': {}
+    }
+
+    if not args.micro_only:
+        rng = np.random.default_rng(0)
+        frames = [synthetic_frame(width, height, rng) for _ in range(args.frames)]
+        print(f"🖼️  {len(frames)} frames sintéticos {width}x{height} "
+              f"(~{np.mean([len(f) for f in frames]) / 1024:.0f} KB JPEG)")
+
+        target = HttpTarget(args.url) if args.url else TestClientTarget(args.gallery_size)
+        for endpoint in args.endpoints:
+            send = make_request(endpoint, frames, args.batch_images)
+            send(target, 0)  # Warm-up del endpoint
+            results['load'][endpoint] = run_load(target, send, args.requests, args.concurrency)
+        print_table("Carga", [dict(endpoint=k, **v) for k, v in results['load'].items()])
+
+        results['detection'] = detection_tradeoff(width, height, args.detection_sides)
+        print_table("Detección en resolución reducida (vs. resolución completa)", results['detection'])
+
+    results['micro']['matching'] = micro_matching(args.matching_sizes)
+    print_table("Matching contra la galería", results['micro']['matching'])
+
+    results['micro']['precision'] = micro_precision(args.precision_sizes, args.precisions)
+    print_table("Galería cuantizada (vs. float32)", results['micro']['precision'])
+
+    results['micro']['prototypes'] = micro_prototypes(args.prototype_identities)
+    print_table("Prototipos por identidad (vs. galería completa)", results['micro']['prototypes'])
+
+    results['micro']['compute_statistics'] = micro_statistics(args.statistics_sizes)
+    print_table("compute_statistics", results['micro']['compute_statistics'])
+
+    results['micro']['quality_report'] = micro_quality(args.quality_sizes)
+    print_table("Reporte de calidad de la galería", results['micro']['quality_report'])
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f"\n💾 Resultados guardados en {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Caches de la API
+- FrameCache: resultados para frames casi idénticos. Una cámara fija envía
+  muchos frames prácticamente iguales: cada frame se resume con un hash
+  perceptual (dHash de 64 bits) y si un frame reciente tiene un hash a pocos
+  bits de distancia se reutiliza su resultado sin detectar ni calcular embeddings.
+- EmbeddingCache: embeddings calculados recientemente, por handle (embedding_id
+  de las respuestas) y por hash exacto de la imagen, para que /verify no
+  vuelva a detectar ni a pasar por el modelo rostros ya vistos.
+"""
+
+import time
+import uuid
+import hashlib
+import threading
+import numpy as np
+import cv2
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Tuple
+
+
+def dhash(img: np.ndarray, size: int = 8) -> int:
+    """
+    Hash perceptual por diferencias (dHash) de una imagen BGR
+    Compara el brillo de píxeles vecinos en una miniatura de (size+1)×size:
+    es robusto a ruido del sensor y compresión JPEG, y cuesta ~1 ms
+    """
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    small = cv2.resize(gray, (size + 1, size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def image_digest(img: np.ndarray) -> str:
+    """Hash exacto (blake2b de 128 bits) de los píxeles decodificados de una imagen"""
+    digest = hashlib.blake2b(str(img.shape).encode(), digest_size=16)
+    digest.update(np.ascontiguousarray(img).data)
+    return digest.hexdigest()
+
+
+class FrameCache:
+    """
+    Cache LRU con TTL de resultados de reconocimiento por hash perceptual
+
+    - max_entries: frames recordados (0 desactiva el cache)
+    - ttl: segundos que un resultado sigue siendo válido
+    - max_distance: bits distintos (de 64) para considerar dos frames iguales
+    Las entradas de distintos parámetros (top_k, multi_face...) no se mezclan.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: float = 10.0, max_distance: int = 4):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.entries: OrderedDict = OrderedDict()  # (params, hash) → (timestamp, resultado)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def get(self, frame_hash: int, params: Hashable = None) -> Optional[Dict]:
+        """Resultado de un frame reciente con hash cercano, o None"""
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        with self.lock:
+            best_key, best_distance = None, self.max_distance + 1
+            for key, (timestamp, _) in list(self.entries.items()):
+                if now - timestamp > self.ttl:
+                    del self.entries[key]
+                    continue
+                if key[0] != params:
+                    continue
+                distance = bin(key[1] ^ frame_hash).count('1')
+                if distance < best_distance:
+                    best_key, best_distance = key, distance
+
+            if best_key is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(best_key)
+            self.hits += 1
+            return self.entries[best_key][1]
+
+    def put(self, frame_hash: int, result: Dict, params: Hashable = None) -> None:
+        if not self.enabled:
+            return
+        with self.lock:
+            self.entries[(params, frame_hash)] = (time.monotonic(), result)
+            self.entries.move_to_end((params, frame_hash))
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Vacía el cache (p. ej. al recargar la galería)"""
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            'enabled': self.enabled,
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else None,
+            'max_entries': self.max_entries,
+            'ttl': self.ttl,
+            'max_distance': self.max_distance
+        }
+
+
+class EmbeddingCache:
+    """
+    Cache LRU con TTL de embeddings de rostros ya calculados
+
+    - max_entries: embeddings recordados (0 desactiva el cache)
+    - ttl: segundos que un embedding sigue disponible
+    Cada rostro recibe un handle opaco (embedding_id). Además, los rostros de
+    una imagen se indexan por su hash exacto y los parámetros de detección,
+    así la misma imagen enviada otra vez no se vuelve a procesar.
+    """
+
+    def __init__(self, max_entries: int = 4096, ttl: float = 600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries: OrderedDict = OrderedDict()  # handle → (timestamp, embedding, facial_area)
+        self.images: OrderedDict = OrderedDict()  # (params, hash) → (timestamp, handles)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def _evict(self, now: float) -> None:
+        while self.entries and (len(self.entries) > self.max_entries
+                                or now - next(iter(self.entries.values()))[0] > self.ttl):
+            self.entries.popitem(last=False)
+        while self.images and (len(self.images) > self.max_entries
+                               or now - next(iter(self.images.values()))[0] > self.ttl):
+            self.images.popitem(last=False)
+
+    def put(self, embeddings: np.ndarray, facial_areas: List[Dict],
+            image_hash: str = None, params: Hashable = None) -> List[Optional[str]]:
+        """
+        Guarda los embeddings (normalizados) de los rostros de una imagen
+        Retorna sus handles; con image_hash también quedan indexados por imagen
+        """
+        if not self.enabled:
+            return [None] * len(embeddings)
+        now = time.monotonic()
+        handles = [uuid.uuid4().hex[:16] for _ in range(len(embeddings))]
+        with self.lock:
+            for handle, embedding, area in zip(handles, embeddings, facial_areas):
+                self.entries[handle] = (now, np.array(embedding, dtype=np.float32), area)
+            if image_hash is not None:
+                self.images[(params, image_hash)] = (now, handles)
+                self.images.move_to_end((params, image_hash))
+            self._evict(now)
+        return handles
+
+    def get(self, handle: str) -> Optional[Tuple[np.ndarray, Dict]]:
+        """(embedding, facial_area) de un handle, o None si no existe o expiró"""
+        if not self.enabled:
+            return None
+        with self.lock:
+            entry = self.entries.get(handle)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                return None
+            self.entries.move_to_end(handle)
+            return entry[1], entry[2]
+
+    def get_image(self, image_hash: str, params: Hashable = None) -> Optional[List[Tuple[str, np.ndarray, Dict]]]:
+        """Rostros (handle, embedding, facial_area) de una imagen ya procesada, o None"""
+        if not self.enabled:
+            return None
+        with self.lock:
+            entry = self.images.get((params, image_hash))
+            now = time.monotonic()
+            faces = None
+            if entry is not None and now - entry[0] <= self.ttl:
+                stored = [(h, self.entries.get(h)) for h in entry[1]]
+                if all(e is not None for _, e in stored):
+                    faces = [(h, e[1], e[2]) for h, e in stored]
+                    self.images.move_to_end((params, image_hash))
+                    for h in entry[1]:
+                        self.entries.move_to_end(h)
+            if faces is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return faces
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            'enabled': self.enabled,
+            'embeddings': len(self.entries),
+            'images': len(self.images),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else None,
+            'max_entries': self.max_entries,
+            'ttl': self.ttl
+        }
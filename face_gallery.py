@@ -0,0 +1,471 @@
+#!/usr/bin/env python3
+"""
+Galería de identidades para reconocimiento facial
+Mantiene todos los embeddings de la lista de requisitoriados en una sola
+matriz contigua L2-normalizada para comparar cada rostro con un único
+producto matriz-vector
+"""
+
+import json
+import hashlib
+import numpy as np
+from pathlib import Path
+from typing import List, Dict, Optional
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """Normaliza cada fila a norma L2 unitaria (float32 contiguo)"""
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix[None, :]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def read_identities(data: Dict) -> List[Dict]:
+    """
+    Devuelve la lista de identidades de un archivo de embeddings
+    Acepta el formato multi-identidad ({"identities": [...]}) y el formato
+    antiguo de una sola persona ({"name": ..., "embeddings": [...]})
+    """
+    if 'identities' in data:
+        return data['identities']
+    return [{
+        'name': data['name'],
+        'embeddings': data['embeddings'],
+        'valid_photos': data.get('valid_photos', [])
+    }]
+
+
+class FaceGallery:
+    """
+    Galería inmutable de identidades
+
+    - matrix: (n, d) float32, filas L2-normalizadas y agrupadas por identidad
+    - labels: (n,) int32, índice de identidad de cada fila
+    - names: nombre de cada identidad
+    - offsets: fila inicial de cada identidad dentro de matrix
+
+    Con deltas aplicados (ver with_identities) las filas viven en dos bloques:
+    la matriz base, que no se copia (puede ser el memmap compartido), y un
+    bloque pequeño con las identidades agregadas o reemplazadas. matrix solo
+    se arma entera cuando alguien la pide (reporte de calidad, compactación).
+    El índice, la copia cuantizada y los prototipos cubren solo la base (ver
+    base_fingerprint): las identidades del bloque extra se comparan siempre en
+    float32, así una recarga con deltas los conserva
+    """
+
+    def __init__(self, names: List[str], matrix: np.ndarray, counts: List[int],
+                 model: str = None, embedding_size: int = None):
+        """
+        Construye la galería sobre una matriz ya normalizada (puede ser un
+        memmap de solo lectura: no se copia)
+        """
+        if len(names) != len(counts):
+            raise ValueError("names y counts deben tener la misma longitud")
+        if not len(matrix):
+            raise ValueError("La galería no contiene embeddings")
+
+        counts = np.asarray(counts, dtype=np.int64)
+        if counts.sum() != len(matrix):
+            raise ValueError("La suma de counts no coincide con las filas de la matriz")
+
+        self.base = matrix
+        self.base_names = list(names)
+        self.base_counts = counts
+        self.base_offsets = np.concatenate(([0], np.cumsum(counts)[:-1])).astype(np.int64)
+        self.base_positions = {name: i for i, name in enumerate(self.base_names)}
+        self.base_labels = np.repeat(np.arange(len(self.base_names), dtype=np.int32), counts)
+        self.model = model
+        self.embedding_size = embedding_size or matrix.shape[1]
+        self._set_overlay(np.arange(len(self.base_names)),
+                          np.empty((0, matrix.shape[1]), dtype=np.float32), [], [])
+
+        # Índice aproximado opcional (ver face_index.py)
+        self.index = None
+        self.nprobe = 16
+
+        # Copia cuantizada opcional para la primera pasada (ver face_quantization.py)
+        self.quantized = None
+        self.rerank = 32
+
+        # Prototipos por identidad opcionales (ver face_prototypes.py): cerca del umbral
+        # (± prototype_margin) se recalcula con todos los embeddings
+        self.prototypes = None
+        self.prototype_threshold = 0.4
+        self.prototype_margin = 0.1
+
+        # Posición en el log de deltas del store (ver face_store.py):
+        # base_seq = deltas ya incluidos en la matriz base, delta_seq = último delta aplicado,
+        # base_timestamp = timestamp de los metadatos de la base (cambia con cada entrenamiento completo)
+        self.base_seq = 0
+        self.delta_seq = 0
+        self.base_timestamp = None
+
+        # Versión de la galería en la API: se asigna al publicarla y no cambia después
+        self.version = 0
+
+    def _set_overlay(self, live: np.ndarray, extra: np.ndarray,
+                     extra_names: List[str], extra_counts: List[int]) -> None:
+        """
+        Fija qué identidades de la base siguen vivas (live, en orden) y el
+        bloque extra que va detrás; recalcula la vista pública
+        (names, counts, offsets, labels) sin tocar las filas de la base
+        """
+        self.live = live
+        self.extra = extra
+        self.extra_counts = np.asarray(extra_counts, dtype=np.int64)
+        self.extra_offsets = np.concatenate(([0], np.cumsum(self.extra_counts)[:-1])).astype(np.int64)
+        self.overlay = len(live) != len(self.base_names) or len(extra_names) > 0
+
+        self.names = [self.base_names[i] for i in live] + list(extra_names)
+        self.counts = np.concatenate((self.base_counts[live], self.extra_counts)).astype(np.int64)
+        if not self.counts.sum():
+            raise ValueError("La galería no contiene embeddings")
+        self.offsets = np.concatenate(([0], np.cumsum(self.counts)[:-1])).astype(np.int64)
+        self.labels = np.repeat(np.arange(len(self.names), dtype=np.int32), self.counts)
+        self.positions = {name: i for i, name in enumerate(self.names)}
+
+        # Dónde está cada identidad pública: bloque (base o extra) y fila inicial dentro de él
+        self.in_extra = np.concatenate((np.zeros(len(live), dtype=bool),
+                                        np.ones(len(extra_names), dtype=bool)))
+        self.sources = np.concatenate((self.base_offsets[live], self.extra_offsets)).astype(np.int64)
+        self.base_to_public = np.full(len(self.base_names), -1, dtype=np.int64)
+        self.base_to_public[live] = np.arange(len(live))
+        self._matrix = None if self.overlay else self.base
+
+    @classmethod
+    def from_embeddings(cls, names: List[str], embeddings: List[np.ndarray],
+                        model: str = None, embedding_size: int = None) -> 'FaceGallery':
+        """Construye la galería normalizando los embeddings de cada identidad"""
+        if len(names) != len(embeddings):
+            raise ValueError("names y embeddings deben tener la misma longitud")
+
+        blocks = [normalize_rows(np.asarray(e, dtype=np.float32)) for e in embeddings]
+        kept = [(n, b) for n, b in zip(names, blocks) if b.size]
+        if not kept:
+            raise ValueError("La galería no contiene embeddings")
+
+        return cls(
+            names=[n for n, _ in kept],
+            matrix=np.ascontiguousarray(np.vstack([b for _, b in kept])),
+            counts=[len(b) for _, b in kept],
+            model=model,
+            embedding_size=embedding_size
+        )
+
+    @classmethod
+    def from_json(cls, path: Path) -> 'FaceGallery':
+        """Construye la galería desde un archivo JSON de embeddings"""
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+
+        identities = read_identities(data)
+        return cls.from_embeddings(
+            names=[ident['name'] for ident in identities],
+            embeddings=[ident['embeddings'] for ident in identities],
+            model=data.get('model'),
+            embedding_size=data.get('embedding_size')
+        )
+
+    def with_identities(self, updates: Dict[str, Optional[np.ndarray]]) -> 'FaceGallery':
+        """
+        Nueva galería con algunas identidades cambiadas, sin tocar esta
+        updates: nombre → embeddings (reemplaza o agrega la identidad) o None (la elimina)
+
+        La matriz base se comparte tal cual: las identidades quitadas solo se
+        marcan como muertas y las nuevas van al bloque extra, así que el costo
+        depende del tamaño de los deltas y no del de la galería. El índice, la
+        copia cuantizada y los prototipos de la base siguen valiendo
+        """
+        dead = np.zeros(len(self.base_names), dtype=bool)
+        for name in updates:
+            if name in self.base_positions:
+                dead[self.base_positions[name]] = True
+        live = self.live[~dead[self.live]]
+
+        kept = [i for i in range(len(self.live), self.num_identities) if self.names[i] not in updates]
+        added = [(name, normalize_rows(e)) for name, e in updates.items()
+                 if e is not None and len(e)]
+        blocks = [self._rows(i) for i in kept] + [b for _, b in added]
+        extra = (np.ascontiguousarray(np.vstack(blocks), dtype=np.float32) if blocks
+                 else np.empty((0, self.dimension), dtype=np.float32))
+
+        gallery = object.__new__(FaceGallery)
+        gallery.__dict__.update(self.__dict__)
+        gallery._set_overlay(live, extra,
+                             [self.names[i] for i in kept] + [n for n, _ in added],
+                             [int(self.counts[i]) for i in kept] + [len(b) for _, b in added])
+        gallery.version = 0
+        return gallery
+
+    def base_view(self) -> 'FaceGallery':
+        """La galería base sin deltas (comparte la matriz; sin índice, copia cuantizada ni prototipos)"""
+        gallery = object.__new__(FaceGallery)
+        gallery.__dict__.update(self.__dict__)
+        gallery._set_overlay(np.arange(len(self.base_names)), self.extra[:0], [], [])
+        gallery.index = None
+        gallery.quantized = None
+        gallery.prototypes = None
+        gallery.version = 0
+        return gallery
+
+    def copy(self) -> 'FaceGallery':
+        """Copia contigua en RAM (sin índice, copia cuantizada ni prototipos)"""
+        gallery = FaceGallery(self.names, np.array(self.matrix, dtype=np.float32), self.counts,
+                              model=self.model, embedding_size=self.embedding_size)
+        gallery.base_seq = self.base_seq
+        gallery.delta_seq = self.delta_seq
+        gallery.base_timestamp = self.base_timestamp
+        return gallery
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """
+        Matriz (n, d) en el orden de names. Sin deltas es la base tal cual;
+        con deltas se arma una vez (base viva + bloque extra) y se guarda
+        """
+        if self._matrix is None:
+            alive = np.zeros(len(self.base_names), dtype=bool)
+            alive[self.live] = True
+            self._matrix = np.ascontiguousarray(np.vstack((
+                self.base[np.repeat(alive, self.base_counts)], self.extra
+            )), dtype=np.float32)
+        return self._matrix
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes de embeddings referenciados (base completa + bloque extra)"""
+        return int(self.base.nbytes + self.extra.nbytes)
+
+    @property
+    def num_identities(self) -> int:
+        return len(self.names)
+
+    @property
+    def num_embeddings(self) -> int:
+        return int(self.counts.sum())
+
+    @property
+    def dimension(self) -> int:
+        return self.base.shape[1]
+
+    def _rows(self, identity: int) -> np.ndarray:
+        """Filas de una identidad pública, como vista de su bloque (sin copiar)"""
+        block = self.extra if self.in_extra[identity] else self.base
+        start = int(self.sources[identity])
+        return block[start:start + int(self.counts[identity])]
+
+    def take_rows(self, rows: np.ndarray) -> np.ndarray:
+        """Filas públicas sueltas (índices sobre matrix) sin armar la matriz completa"""
+        if not self.overlay:
+            return np.asarray(self.base[rows], dtype=np.float32)
+        identities = self.labels[rows]
+        source = self.sources[identities] + (rows - self.offsets[identities])
+        extra = self.in_extra[identities]
+        out = np.empty((len(rows), self.dimension), dtype=np.float32)
+        out[~extra] = self.base[source[~extra]]
+        out[extra] = self.extra[source[extra]]
+        return out
+
+    @staticmethod
+    def _fingerprint(names: List[str], counts: np.ndarray, dimension: int, take_rows) -> str:
+        num_embeddings = int(counts.sum())
+        step = max(1, num_embeddings // 1024)
+        h = hashlib.sha1()
+        h.update(np.asarray((num_embeddings, dimension), dtype=np.int64).tobytes())
+        h.update(counts.tobytes())
+        h.update('\n'.join(names).encode('utf-8'))
+        h.update(np.ascontiguousarray(take_rows(np.arange(0, num_embeddings, step))).tobytes())
+        return h.hexdigest()
+
+    def fingerprint(self) -> str:
+        """Huella barata de la galería (con deltas incluidos)"""
+        return self._fingerprint(self.names, self.counts, self.dimension, self.take_rows)
+
+    def base_fingerprint(self) -> str:
+        """
+        Huella de la matriz base: valida el índice, la copia cuantizada y los
+        prototipos guardados en disco, que cubren solo la base
+        """
+        return self._fingerprint(self.base_names, self.base_counts, self.dimension,
+                                 lambda rows: np.asarray(self.base[rows], dtype=np.float32))
+
+    def attach_index(self, index, nprobe: int = 16) -> None:
+        """Usa un índice IVF para preseleccionar identidades en search_batch"""
+        self.index = index
+        self.nprobe = nprobe
+
+    def attach_quantized(self, quantized, rerank: int = 32) -> None:
+        """Recorre la copia cuantizada en search_batch y re-rankea `rerank` identidades con float32"""
+        self.quantized = quantized
+        self.rerank = rerank
+
+    def attach_prototypes(self, prototypes, threshold: float, margin: float = 0.1) -> None:
+        """Compara contra los prototipos en search_batch; recalcula si la mejor similitud queda en threshold ± margin"""
+        self.prototypes = prototypes
+        self.prototype_threshold = threshold
+        self.prototype_margin = margin
+
+    def identity_scores(self, probes: np.ndarray):
+        """
+        Similitud coseno de cada probe contra cada identidad
+        Retorna (max, promedio), ambas de forma (m, num_identities)
+        """
+        queries = normalize_rows(probes)
+        scores = queries @ self.base.T  # (m, n) en un solo producto
+        max_scores = np.maximum.reduceat(scores, self.base_offsets, axis=1)
+        avg_scores = np.add.reduceat(scores, self.base_offsets, axis=1) / self.base_counts
+        return self.with_overlay(queries, max_scores, avg_scores)
+
+    def with_overlay(self, queries: np.ndarray, base_max: np.ndarray, base_avg: np.ndarray = None):
+        """
+        Puntajes por identidad pública a partir de los de cada identidad de la
+        base (exactos o de un acelerador): descarta las identidades muertas y
+        agrega las del bloque extra, calculadas de forma exacta
+        """
+        if not self.overlay:
+            return base_max, base_avg
+        max_parts = [base_max[:, self.live]]
+        avg_parts = [base_avg[:, self.live]] if base_avg is not None else None
+        if len(self.extra):
+            scores = queries @ self.extra.T
+            max_parts.append(np.maximum.reduceat(scores, self.extra_offsets, axis=1))
+            if avg_parts is not None:
+                avg_parts.append(np.add.reduceat(scores, self.extra_offsets, axis=1) / self.extra_counts)
+        return np.hstack(max_parts), np.hstack(avg_parts) if avg_parts is not None else None
+
+    def rescore(self, probe: np.ndarray, identities: np.ndarray):
+        """Similitud exacta (max, promedio) de un probe normalizado contra algunas identidades"""
+        scores = np.concatenate([self._rows(i) for i in identities]) @ probe
+        starts = np.concatenate(([0], np.cumsum(self.counts[identities])[:-1]))
+        max_scores = np.maximum.reduceat(scores, starts)
+        avg_scores = np.add.reduceat(scores, starts) / self.counts[identities]
+        return max_scores, avg_scores
+
+    def search_approximate(self, probe: np.ndarray, top_k: int = 5) -> List[Dict]:
+        """
+        Top-k usando el índice IVF: preselecciona filas cercanas y
+        recalcula de forma exacta solo las identidades preseleccionadas
+        """
+        top_k = max(1, top_k)
+        query = normalize_rows(probe)[0]
+        rows, _ = self.index.search(query, k=max(10 * top_k, 50), nprobe=self.nprobe)
+        identities = self.base_to_public[self.base_labels[rows]]  # El índice cubre la base
+        if self.overlay:
+            identities = np.concatenate((identities[identities >= 0],
+                                         np.arange(len(self.live), self.num_identities)))
+        identities = np.unique(identities)
+        if identities.size == 0:
+            return []
+
+        max_scores, avg_scores = self.rescore(query, identities)
+        order = np.argsort(-max_scores)[:top_k]
+        return [self.candidate(identities[i], max_scores[i], avg_scores[i]) for i in order]
+
+    def search_quantized(self, probes: np.ndarray, top_k: int = 5) -> List[List[Dict]]:
+        """
+        Top-k usando la copia cuantizada: preselecciona las identidades con
+        mayor similitud aproximada y las recalcula de forma exacta en float32
+        """
+        top_k = max(1, top_k)
+        queries = normalize_rows(probes)
+        base_max = np.maximum.reduceat(self.quantized.scores(queries), self.base_offsets, axis=1)
+        approx_max, _ = self.with_overlay(queries, base_max)  # La copia cuantizada cubre la base
+        k = min(max(top_k, self.rerank), self.num_identities)
+
+        results = []
+        for query, row in zip(queries, approx_max):
+            if k < self.num_identities:
+                identities = np.argpartition(-row, k - 1)[:k]
+            else:
+                identities = np.arange(self.num_identities)
+            max_scores, avg_scores = self.rescore(query, identities)
+            order = np.argsort(-max_scores)[:top_k]
+            results.append([self.candidate(identities[i], max_scores[i], avg_scores[i]) for i in order])
+        return results
+
+    def search_prototypes(self, probes: np.ndarray, top_k: int = 5) -> List[List[Dict]]:
+        """
+        Top-k usando los prototipos; si la mejor similitud queda cerca del
+        umbral, las `rerank` identidades mejor puntuadas se recalculan con
+        todos sus embeddings
+        """
+        top_k = max(1, top_k)
+        queries = normalize_rows(probes)
+        proto_max, proto_avg = self.with_overlay(queries, *self.prototypes.identity_scores(queries))
+        k = min(max(top_k, self.rerank), self.num_identities)
+
+        results = []
+        fallbacks = 0
+        for query, row_max, row_avg in zip(queries, proto_max, proto_avg):
+            if k < self.num_identities:
+                identities = np.argpartition(-row_max, k - 1)[:k]
+            else:
+                identities = np.arange(self.num_identities)
+            max_scores, avg_scores = row_max[identities], row_avg[identities]
+            if abs(max_scores.max() - self.prototype_threshold) <= self.prototype_margin:
+                max_scores, avg_scores = self.rescore(query, identities)
+                fallbacks += 1
+            order = np.argsort(-max_scores)[:top_k]
+            results.append([self.candidate(identities[i], max_scores[i], avg_scores[i]) for i in order])
+        self.prototypes.record(len(queries), fallbacks)
+        return results
+
+    def search_batch(self, probes: np.ndarray, top_k: int = 5) -> List[List[Dict]]:
+        """Top-k identidades para cada probe, ordenadas por similitud máxima"""
+        if self.index is not None:
+            return [self.search_approximate(p, top_k) for p in normalize_rows(probes)]
+        if self.prototypes is not None:
+            return self.search_prototypes(probes, top_k)
+        if self.quantized is not None:
+            return self.search_quantized(probes, top_k)
+
+        max_scores, avg_scores = self.identity_scores(probes)
+        k = max(1, min(top_k, self.num_identities))
+
+        results = []
+        for row_max, row_avg in zip(max_scores, avg_scores):
+            if k < self.num_identities:
+                top = np.argpartition(-row_max, k - 1)[:k]
+            else:
+                top = np.arange(self.num_identities)
+            top = top[np.argsort(-row_max[top])]
+            results.append([self.candidate(i, row_max[i], row_avg[i]) for i in top])
+        return results
+
+    def search(self, probe: np.ndarray, top_k: int = 5) -> List[Dict]:
+        """Top-k identidades para un solo embedding"""
+        return self.search_batch(probe, top_k)[0]
+
+    def candidate(self, identity: int, max_similarity: float,
+                  avg_similarity: Optional[float] = None) -> Dict:
+        """Representación serializable de un candidato"""
+        return {
+            'name': self.names[identity],
+            'similarity': float(max_similarity),
+            'avg_similarity': float(avg_similarity) if avg_similarity is not None else None,
+            'num_embeddings': int(self.counts[identity])
+        }
+
+    def identity_embeddings(self, name: str, index: Optional[int] = None) -> np.ndarray:
+        """
+        Filas normalizadas de una identidad (todas o solo la número index)
+        Lanza KeyError si la identidad o el embedding no existen
+        """
+        if name not in self.positions:
+            raise KeyError(f"Identidad desconocida: {name}")
+        rows = self._rows(self.positions[name])
+        if index is None:
+            return rows
+        if not 0 <= index < len(rows):
+            raise KeyError(f"{name} tiene {len(rows)} embeddings, no existe el número {index}")
+        return rows[index:index + 1]
+
+    def describe(self) -> List[Dict]:
+        """Resumen de las identidades cargadas"""
+        return [
+            {'name': name, 'num_embeddings': int(count)}
+            for name, count in zip(self.names, self.counts)
+        ]
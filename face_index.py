@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Índice aproximado (IVF) para galerías grandes de requisitoriados
+Agrupa los embeddings en listas invertidas alrededor de centroides k-means
+para que cada búsqueda solo revise las listas más cercanas al rostro.
+El índice se construye offline y se guarda en public/trained-faces/face_index/
+como archivos .npy que la API abre con memory-map.
+
+Uso:
+    python face_index.py build --nlist 1024
+    python face_index.py benchmark --synthetic 200000 --nprobe 1 4 16 64
+"""
+
+import json
+import time
+import argparse
+import numpy as np
+from pathlib import Path
+from typing import List, Tuple
+
+from face_gallery import FaceGallery, normalize_rows
+from face_store import load_gallery, atomic_save_json, atomic_save_npy, STORE_FILE
+
+INDEX_DIR = Path("public/trained-faces/face_index")
+CHUNK_SIZE = 8192  # Filas por bloque al asignar vectores a centroides
+
+
+def assign_to_centroids(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Centroide más cercano (producto punto máximo) de cada vector, por bloques"""
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), CHUNK_SIZE):
+        block = vectors[start:start + CHUNK_SIZE]
+        assignments[start:start + CHUNK_SIZE] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+def spherical_kmeans(vectors: np.ndarray, k: int, iterations: int = 20,
+                     sample_size: int = None, seed: int = 0) -> np.ndarray:
+    """K-means sobre la esfera unitaria (similitud coseno)"""
+    rng = np.random.default_rng(seed)
+    if sample_size and len(vectors) > sample_size:
+        vectors = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = assign_to_centroids(vectors, centroids)
+        counts = np.bincount(assignments, minlength=k)
+
+        # Suma por centroide ordenando por asignación (mucho más rápido que np.add.at)
+        order = np.argsort(assignments, kind='stable')
+        filled = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[filled]
+        sums = np.zeros_like(centroids)
+        sums[filled] = np.add.reduceat(vectors[order], starts, axis=0)
+
+        # Reiniciar centroides vacíos con vectores aleatorios
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+class IVFIndex:
+    """
+    Índice de listas invertidas sobre embeddings L2-normalizados
+
+    - centroids: (nlist, d) centroides de las listas
+    - vectors: (n, d) embeddings reordenados por lista
+    - ids: (n,) fila original de cada vector en la galería
+    - list_offsets: (nlist + 1,) inicio de cada lista dentro de vectors
+    """
+
+    FILES = ('centroids', 'vectors', 'ids', 'list_offsets')
+
+    def __init__(self, centroids, vectors, ids, list_offsets, meta=None):
+        self.centroids = centroids
+        self.vectors = vectors
+        self.ids = ids
+        self.list_offsets = list_offsets
+        self.meta = meta or {}
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, nlist: int = None, iterations: int = 20,
+              seed: int = 0) -> 'IVFIndex':
+        """Construye el índice para una matriz ya normalizada"""
+        n = len(matrix)
+        if nlist is None:
+            nlist = int(4 * np.sqrt(n))  # Regla habitual para IVF
+        nlist = max(1, min(nlist, n))
+
+        centroids = spherical_kmeans(matrix, nlist, iterations=iterations,
+                                     sample_size=256 * nlist, seed=seed)
+        assignments = assign_to_centroids(matrix, centroids)
+
+        order = np.argsort(assignments, kind='stable')
+        counts = np.bincount(assignments, minlength=nlist)
+        list_offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+
+        return cls(
+            centroids=centroids.astype(np.float32),
+            vectors=np.ascontiguousarray(matrix[order], dtype=np.float32),
+            ids=order.astype(np.int64),
+            list_offsets=list_offsets,
+            meta={'nlist': nlist, 'num_vectors': n, 'dimension': int(matrix.shape[1])}
+        )
+
+    def search(self, query: np.ndarray, k: int, nprobe: int = 16) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Busca los k vectores más parecidos a un query normalizado
+        Retorna (filas originales, similitudes) ordenadas de mayor a menor
+        """
+        nprobe = max(1, min(nprobe, self.nlist))
+        coarse = self.centroids @ query
+        lists = np.argpartition(-coarse, nprobe - 1)[:nprobe]
+
+        rows = np.concatenate([
+            np.arange(self.list_offsets[l], self.list_offsets[l + 1]) for l in lists
+        ])
+        if rows.size == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        scores = self.vectors[rows] @ query
+        k = min(k, len(rows))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return np.asarray(self.ids[rows[top]]), scores[top]
+
+    def save(self, directory: Path = INDEX_DIR) -> Path:
+        """
+        Guarda el índice como archivos .npy + meta.json, cada uno de forma atómica
+        meta.json se quita primero y se escribe al final: una API que recarga a
+        mitad de la escritura no ve el índice, en vez de mezclar arrays nuevos
+        con el fingerprint anterior
+        """
+        directory.mkdir(parents=True, exist_ok=True)
+        (directory / "meta.json").unlink(missing_ok=True)
+        for name in self.FILES:
+            atomic_save_npy(directory / f"{name}.npy", getattr(self, name))
+        atomic_save_json(directory / "meta.json", self.meta)
+        return directory
+
+    @classmethod
+    def load(cls, directory: Path = INDEX_DIR, mmap: bool = True) -> 'IVFIndex':
+        """Abre el índice; con mmap los vectores no se copian a memoria"""
+        mode = 'r' if mmap else None
+        arrays = {name: np.load(directory / f"{name}.npy", mmap_mode=mode)
+                  for name in cls.FILES}
+        with open(directory / "meta.json", 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        # Los centroides se leen en cada búsqueda: mejor tenerlos en RAM
+        arrays['centroids'] = np.ascontiguousarray(arrays['centroids'])
+        arrays['list_offsets'] = np.asarray(arrays['list_offsets'])
+        return cls(meta=meta, **arrays)
+
+
+def build_index(gallery: FaceGallery, nlist: int = None, iterations: int = 20,
+                directory: Path = INDEX_DIR) -> IVFIndex:
+    """Construye y guarda el índice de la matriz base de una galería (los deltas se comparan en float32)"""
+    index = IVFIndex.build(gallery.base, nlist=nlist, iterations=iterations)
+    index.meta['gallery_fingerprint'] = gallery.base_fingerprint()
+    index.save(directory)
+    return index
+
+
+def load_index(gallery: FaceGallery, directory: Path = INDEX_DIR):
+    """Abre el índice si existe y corresponde a la base de la galería; si no, retorna None"""
+    if not (directory / "meta.json").exists():
+        return None
+    index = IVFIndex.load(directory)
+    if index.meta.get('gallery_fingerprint') != gallery.base_fingerprint():
+        print(f"⚠️  El índice en {directory} no corresponde a la galería actual, se ignora")
+        return None
+    return index
+
+
+def synthetic_gallery(num_identities: int, per_identity: int, dimension: int = 512,
+                      seed: int = 0) -> Tuple[FaceGallery, np.ndarray]:
+    """
+    Galería sintética: cada identidad es un centro aleatorio con ruido
+    Retorna la galería y un query ruidoso por identidad
+    """
+    rng = np.random.default_rng(seed)
+    centers = normalize_rows(rng.normal(size=(num_identities, dimension)))
+    embeddings = [c + 0.6 * normalize_rows(rng.normal(size=(per_identity, dimension)))
+                  for c in centers]
+    queries = centers + 0.6 * normalize_rows(rng.normal(size=(num_identities, dimension)))
+    names = [f"persona_{i}" for i in range(num_identities)]
+    return FaceGallery.from_embeddings(names, embeddings), normalize_rows(queries)
+
+
+def benchmark(gallery: FaceGallery, queries: np.ndarray, nprobes: List[int],
+              k: int = 1, nlist: int = None) -> List[dict]:
+    """Recall@k y latencia del índice frente a la búsqueda exacta"""
+    t0 = time.perf_counter()
+    index = IVFIndex.build(gallery.matrix, nlist=nlist)
+    build_time = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    exact = []
+    for q in queries:
+        scores = gallery.matrix @ q
+        exact.append(set(np.argpartition(-scores, k - 1)[:k].tolist()))
+    exact_ms = (time.perf_counter() - t0) * 1000 / len(queries)
+
+    results = [{'method': 'exact', 'recall': 1.0, 'latency_ms': exact_ms}]
+    for nprobe in nprobes:
+        t0 = time.perf_counter()
+        found = [index.search(q, k, nprobe)[0] for q in queries]
+        latency_ms = (time.perf_counter() - t0) * 1000 / len(queries)
+        recall = np.mean([len(exact[i] & set(f.tolist())) / k for i, f in enumerate(found)])
+        results.append({'method': f'ivf nlist={index.nlist} nprobe={nprobe}',
+                        'recall': float(recall), 'latency_ms': latency_ms})
+
+    print(f"\n📊 Benchmark ({gallery.num_embeddings} embeddings, "
+          f"{len(queries)} queries, recall@{k}, build {build_time:.1f}s)")
+    for r in results:
+        print(f"   {r['method']:<32} recall={r['recall']:.3f}  {r['latency_ms']:.3f} ms/query")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Índice IVF de la galería de rostros")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    build_cmd = sub.add_parser('build', help="Construir el índice desde la galería")
+    build_cmd.add_argument('--embeddings', type=Path, default=STORE_FILE)
+    build_cmd.add_argument('--output', type=Path, default=INDEX_DIR)
+    build_cmd.add_argument('--nlist', type=int, default=None)
+    build_cmd.add_argument('--iterations', type=int, default=20)
+
+    bench_cmd = sub.add_parser('benchmark', help="Comparar recall/latencia contra búsqueda exacta")
+    bench_cmd.add_argument('--embeddings', type=Path, default=None)
+    bench_cmd.add_argument('--synthetic', type=int, default=100000,
+                           help="Número de embeddings sintéticos (si no se indica --embeddings)")
+    bench_cmd.add_argument('--queries', type=int, default=200)
+    bench_cmd.add_argument('--nlist', type=int, default=None)
+    bench_cmd.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 16, 64])
+    bench_cmd.add_argument('-k', type=int, default=1)
+
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        gallery = load_gallery(args.embeddings)
+        t0 = time.perf_counter()
+        index = build_index(gallery, nlist=args.nlist, iterations=args.iterations,
+                            directory=args.output)
+        print(f"✅ Índice construido en {time.perf_counter() - t0:.1f}s: "
+              f"{index.nlist} listas, {gallery.num_embeddings} embeddings → {args.output}")
+    else:
+        if args.embeddings:
+            gallery = load_gallery(args.embeddings)
+            rng = np.random.default_rng(0)
+            rows = rng.choice(gallery.num_embeddings, min(args.queries, gallery.num_embeddings),
+                              replace=False)
+            queries = normalize_rows(gallery.matrix[rows] + 0.05 * rng.normal(size=(len(rows), gallery.dimension)))
+        else:
+            per_identity = 5
+            gallery, queries = synthetic_gallery(max(1, args.synthetic // per_identity), per_identity)
+            queries = queries[:args.queries]
+        benchmark(gallery, queries, args.nprobe, k=args.k, nlist=args.nlist)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Inferencia de embeddings con micro-batching
+La detección de rostros se hace en el hilo de cada request; los rostros
+recortados se encolan y un hilo de inferencia los agrupa durante unos
+milisegundos (o hasta completar un lote) para hacer una sola pasada de
+Facenet512 por lote en vez de una por request.
+
+DeepFace (y con él TensorFlow) se importa recién al construir el modelo o
+detectar el primer rostro, para que el proceso arranque rápido.
+"""
+
+import math
+import time
+import queue
+import threading
+import numpy as np
+from concurrent.futures import Future
+from typing import List, Dict, Optional, Tuple
+
+
+# DeepFace comparte una sola instancia de cada detector en todo el proceso y
+# algunos (p. ej. el CascadeClassifier de opencv) fallan con un segfault si
+# dos hilos detectan a la vez: toda detección del proceso pasa por este lock.
+# Para detectar en paralelo hay que usar varios procesos.
+DETECTOR_LOCK = threading.Lock()
+
+
+def detect_faces(img: np.ndarray, detector_backend: str, align: bool = True,
+                 enforce_detection: bool = True) -> List[Dict]:
+    """Detecta y alinea los rostros de una imagen BGR (lanza ValueError si no hay rostros)"""
+    from deepface import DeepFace
+
+    with DETECTOR_LOCK:
+        return DeepFace.extract_faces(
+            img_path=img,
+            detector_backend=detector_backend,
+            enforce_detection=enforce_detection,
+            align=align
+        )
+
+
+def bordered_region(img: np.ndarray, x1: int, y1: int, x2: int, y2: int) -> np.ndarray:
+    """Región [y1:y2, x1:x2] de la imagen; lo que cae fuera se rellena con negro"""
+    height, width = img.shape[:2]
+    region = np.zeros((y2 - y1, x2 - x1) + img.shape[2:], dtype=img.dtype)
+    cx1, cy1, cx2, cy2 = max(x1, 0), max(y1, 0), min(x2, width), min(y2, height)
+    if cx1 < cx2 and cy1 < cy2:
+        region[cy1 - y1:cy2 - y1, cx1 - x1:cx2 - x1] = img[cy1:cy2, cx1:cx2]
+    return region
+
+
+def find_eyes(face: np.ndarray, detector_backend: str) -> Tuple[Optional[Tuple], Optional[Tuple]]:
+    """
+    Ojos (izquierdo, derecho) dentro de un recorte BGR del rostro
+    Usa el detector de ojos del backend (opencv y ssd) o, si el backend da los
+    ojos como parte de la detección, el de opencv
+    """
+    from deepface.detectors import DetectorWrapper
+
+    with DETECTOR_LOCK:
+        detector = DetectorWrapper.build_model(detector_backend)
+        if not hasattr(detector, 'find_eyes'):
+            detector = detector.model['opencv_module'] if detector_backend == 'ssd' \
+                else DetectorWrapper.build_model('opencv')
+        return detector.find_eyes(img=face)
+
+
+def align_box(img: np.ndarray, box: Dict, detector_backend: str, align: bool = True) -> Dict:
+    """
+    Rostro alineado (formato extract_faces) a partir de una caja ya conocida, sin detectar
+
+    Repite los pasos de DeepFace después de la detección: borde negro del 50%,
+    ojos dentro de la caja, rotación de la imagen completa alrededor de su
+    centro y recorte de la caja rotada. La rotación se calcula solo para los
+    píxeles del recorte, con la misma matriz que PIL, así el costo depende del
+    tamaño del rostro y no del frame.
+
+    box: {"x", "y", "w", "h"} y opcionalmente "left_eye", "right_eye", "confidence"
+    """
+    from PIL import Image
+    from deepface.detectors.DetectorWrapper import rotate_facial_area
+
+    height, width = img.shape[:2]
+    x, y, w, h = (int(round(float(box[key]))) for key in ('x', 'y', 'w', 'h'))
+    if w <= 0 or h <= 0 or x + w <= 0 or y + h <= 0 or x >= width or y >= height:
+        raise ValueError(f"Caja fuera de la imagen: {box}")
+
+    left_eye, right_eye = box.get('left_eye'), box.get('right_eye')
+    if align and (left_eye is None or right_eye is None):
+        left_eye, right_eye = find_eyes(bordered_region(img, x, y, x + w, y + h), detector_backend)
+        if left_eye is not None and right_eye is not None:
+            left_eye = (x + int(left_eye[0]), y + int(left_eye[1]))
+            right_eye = (x + int(right_eye[0]), y + int(right_eye[1]))
+
+    if not align or left_eye is None or right_eye is None:
+        face = bordered_region(img, x, y, x + w, y + h)
+        angle = 0.0
+    else:
+        # Coordenadas en la imagen con borde (como DetectorWrapper.detect_faces)
+        border_x, border_y = int(0.5 * width), int(0.5 * height)
+        full_w, full_h = width + 2 * border_x, height + 2 * border_y
+        angle = float(np.degrees(np.arctan2(left_eye[1] - right_eye[1], left_eye[0] - right_eye[0])))
+        bx, by = x + border_x, y + border_y
+        x1, y1, x2, y2 = rotate_facial_area((bx, by, bx + w, by + h), angle, (full_h, full_w))
+
+        # Matriz inversa de Image.rotate(angle) alrededor del centro de la imagen con borde
+        radians = -math.radians(angle % 360.0)
+        a, b = round(math.cos(radians), 15), round(math.sin(radians), 15)
+        d, e = round(-math.sin(radians), 15), round(math.cos(radians), 15)
+        cx, cy = full_w / 2, full_h / 2
+        c = a * -cx + b * -cy + cx
+        f = d * -cx + e * -cy + cy
+
+        # Píxeles de origen que necesita el recorte (con margen para el muestreo)
+        corners = [(a * u + b * v + c, d * u + e * v + f) for u in (x1, x2) for v in (y1, y2)]
+        sx1 = max(int(math.floor(min(p[0] for p in corners))) - 2, 0)
+        sy1 = max(int(math.floor(min(p[1] for p in corners))) - 2, 0)
+        sx2 = min(int(math.ceil(max(p[0] for p in corners))) + 2, full_w)
+        sy2 = min(int(math.ceil(max(p[1] for p in corners))) + 2, full_h)
+        source = bordered_region(img, sx1 - border_x, sy1 - border_y, sx2 - border_x, sy2 - border_y)
+
+        matrix = (a, b, a * x1 + b * y1 + c - sx1, d, e, d * x1 + e * y1 + f - sy1)
+        face = np.array(Image.fromarray(source).transform(
+            (x2 - x1, y2 - y1), Image.Transform.AFFINE, matrix, Image.Resampling.NEAREST
+        ))
+
+    return {
+        'face': face[:, :, ::-1] / 255,
+        'facial_area': {
+            'x': x, 'y': y, 'w': w, 'h': h,
+            'left_eye': left_eye,
+            'right_eye': right_eye
+        },
+        'confidence': float(box.get('confidence', 0))
+    }
+
+
+class FaceEmbedder:
+    """
+    Modelo de embeddings con el mismo preprocesamiento que DeepFace.represent
+
+    - backend: cómo se ejecuta el modelo (ver face_backends.py): keras, tf_function, savedmodel u onnx
+    - intra_threads / inter_threads: hilos de TensorFlow u ONNX Runtime (0 = valor por defecto)
+    - buckets: tamaños de lote fijos a los que se rellena cada pasada
+    """
+
+    def __init__(self, model_name: str = "Facenet512", backend: str = "keras",
+                 intra_threads: int = 0, inter_threads: int = 0, buckets=None):
+        from deepface.modules import preprocessing
+        from face_backends import load_backend, BATCH_BUCKETS
+
+        self.preprocessing = preprocessing
+        self.model_name = model_name
+        self.backend = load_backend(backend, model_name, buckets or BATCH_BUCKETS,
+                                    intra_threads=intra_threads, inter_threads=inter_threads)
+        self.target_size = self.backend.input_shape
+        self.output_size = self.backend.output_size
+        self.parity = None  # Resultado de check_parity (None = sin chequear o keras)
+
+    def prepare(self, faces: List[np.ndarray]) -> np.ndarray:
+        """
+        Convierte rostros de extract_faces (RGB, [0, 1]) en un lote (m, H, W, 3)
+        listo para el modelo: RGB→BGR, resize con padding y normalización base
+        """
+        prepared = []
+        for face in faces:
+            img = self.preprocessing.resize_image(
+                img=face[:, :, ::-1],
+                target_size=(self.target_size[1], self.target_size[0])
+            )
+            prepared.append(self.preprocessing.normalize_input(img=img, normalization="base"))
+        return np.concatenate(prepared, axis=0)
+
+    def forward(self, batch: np.ndarray) -> np.ndarray:
+        """Pasadas del modelo para todo el lote (en lotes de tamaño fijo), retorna (m, d) float32"""
+        return self.backend.forward(batch)
+
+    def check_parity(self) -> Optional[Dict]:
+        """
+        Compara el backend contra keras (face_backends.check_parity); si la
+        diferencia supera la tolerancia, pasa a usar keras
+        """
+        from face_backends import check_parity, load_backend
+
+        if self.backend.name == 'keras':
+            return None
+        self.parity = check_parity(self.backend, self.model_name)
+        if not self.parity['ok']:
+            print(f"⚠️  El backend {self.backend.name} difiere de keras "
+                  f"(|Δ| máx {self.parity['max_abs_diff']:.2e} > {self.parity['tolerance']:.0e}): se usa keras")
+            self.backend = load_backend('keras', self.model_name)
+        return self.parity
+
+    def warm_up(self, batch_sizes=None, check_parity: bool = True) -> None:
+        """
+        Ejecuta el modelo con entradas vacías (todos los tamaños de lote fijos)
+        antes del primer request y, salvo check_parity=False, compara el backend contra keras
+        """
+        self.backend.warm_up(batch_sizes)
+        if check_parity:
+            self.check_parity()
+
+
+class BatchingEmbedder:
+    """
+    Cola de inferencia compartida por todos los hilos de Flask
+
+    - max_batch_size: rostros máximos por pasada del modelo
+    - max_wait_ms: tiempo máximo que se espera a otros requests para llenar el lote
+    - workers: hilos de inferencia (normalmente 1 por proceso)
+    - metrics: registro opcional (face_metrics.Metrics) para tamaño de lote y tiempo del modelo
+    """
+
+    def __init__(self, embedder: FaceEmbedder, max_batch_size: int = 32,
+                 max_wait_ms: float = 5.0, workers: int = 1, metrics=None):
+        self.embedder = embedder
+        self.metrics = metrics
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.requests = queue.Queue()
+        self.threads = [
+            threading.Thread(target=self._run, name=f"inference-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, batch: np.ndarray, timings: Optional[Dict[str, float]] = None) -> Future:
+        """
+        Encola un lote preparado; el Future se resuelve con sus embeddings (m, d).
+        timings: tiempos del request que lo envía (model_forward se suma ahí)
+        """
+        future = Future()
+        self.requests.put((batch, future, timings))
+        return future
+
+    def embed(self, faces: List[np.ndarray]) -> np.ndarray:
+        """Embeddings (m, d) de rostros de extract_faces, esperando al hilo de inferencia"""
+        if not faces:
+            return np.empty((0, self.embedder.output_size), dtype=np.float32)
+        timings = self.metrics.request_timings() if self.metrics is not None else None
+        return self.submit(self.embedder.prepare(faces), timings).result()
+
+    def represent(self, img: np.ndarray, detector_backend: str, align: bool = True) -> List[Dict]:
+        """Equivalente a DeepFace.represent, con todos los rostros en un solo lote"""
+        face_objs = detect_faces(img, detector_backend, align=align)
+        embeddings = self.embed([obj['face'] for obj in face_objs])
+        return [
+            {
+                'embedding': embedding,
+                'facial_area': obj['facial_area'],
+                'face_confidence': obj['confidence']
+            }
+            for obj, embedding in zip(face_objs, embeddings)
+        ]
+
+    def _collect(self) -> List:
+        """Espera un request y junta los que lleguen antes de max_wait o de llenar el lote"""
+        pending = [self.requests.get()]
+        size = len(pending[0][0])
+        deadline = time.perf_counter() + self.max_wait
+
+        while size < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = self.requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            pending.append(item)
+            size += len(item[0])
+        return pending
+
+    def _run(self) -> None:
+        while True:
+            pending = self._collect()
+            try:
+                t0 = time.perf_counter()
+                batch = np.concatenate([b for b, _, _ in pending], axis=0)
+                embeddings = np.concatenate([
+                    self.embedder.forward(batch[i:i + self.max_batch_size])
+                    for i in range(0, len(batch), self.max_batch_size)
+                ])
+                if self.metrics is not None:
+                    elapsed = time.perf_counter() - t0
+                    self.metrics.observe('batch_size', len(batch))
+                    self.metrics.observe('stage_seconds', elapsed, stage='model_forward')
+                    for _, _, timings in pending:
+                        self.metrics.add_timing(timings, 'model_forward', elapsed)
+            except Exception as e:
+                for _, future, _ in pending:
+                    future.set_exception(e)
+                continue
+
+            start = 0
+            for b, future, _ in pending:
+                future.set_result(embeddings[start:start + len(b)])
+                start += len(b)
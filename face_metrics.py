@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Métricas de la API en formato de texto Prometheus
+Contadores e histogramas en memoria, sin dependencias externas.
+Cada etapa del pipeline (decodificación, detección, embedding, matching...)
+se mide con `metrics.stage(nombre)`; si las métricas están desactivadas y el
+request no pidió `timings`, la etapa no mide nada.
+"""
+
+import time
+import bisect
+import threading
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Optional, Tuple
+
+# Límites de los buckets en segundos (1 ms .. 10 s)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+NO_STAGE = nullcontext()
+
+
+class Histogram:
+    """Histograma acumulado al estilo Prometheus"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def format_value(value: float) -> str:
+    """Valor exacto de un contador: entero sin decimales, float con repr (nunca notación recortada)"""
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def format_labels(labels: Tuple, extra: str = None) -> str:
+    """Etiquetas {k="v",...} para una línea de Prometheus"""
+    parts = [f'{k}="{v}"' for k, v in labels]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+class Metrics:
+    """
+    Registro de métricas del proceso
+
+    - inc(nombre, valor, **labels): contador
+    - observe(nombre, valor, **labels): histograma
+    - stage(nombre): context manager que mide una etapa del pipeline
+    - begin_request() / timings(): tiempos por etapa del request actual
+    - bind(fn) / request_timings(): llevan los tiempos del request a trabajo
+      que corre en otro hilo (pool de detección, hilo de inferencia)
+    """
+
+    def __init__(self, enabled: bool = True, prefix: str = "face_api",
+                 buckets=DEFAULT_BUCKETS):
+        self.enabled = enabled
+        self.prefix = prefix
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.counters: Dict[str, Dict[Tuple, float]] = {}
+        self.histograms: Dict[str, Dict[Tuple, Histogram]] = {}
+        self.help: Dict[str, str] = {}
+        self.metric_buckets: Dict[str, Tuple] = {}
+        self.local = threading.local()
+
+    def describe(self, name: str, text: str, buckets=None) -> None:
+        """Texto HELP de una métrica y, para histogramas, buckets propios"""
+        self.help[name] = text
+        if buckets is not None:
+            self.metric_buckets[name] = tuple(buckets)
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        if not self.enabled:
+            return
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        if not self.enabled:
+            return
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = Histogram(self.metric_buckets.get(name, self.buckets))
+            series[key].observe(value)
+
+    def begin_request(self, collect_timings: bool = False) -> None:
+        """Inicia el registro de tiempos por etapa del request de este hilo"""
+        self.local.timings = {} if (self.enabled or collect_timings) else None
+
+    def timings(self) -> Optional[Dict[str, float]]:
+        """Tiempos (ms) por etapa del request de este hilo"""
+        timings = getattr(self.local, 'timings', None)
+        if timings is None:
+            return None
+        return {stage: round(seconds * 1000, 3) for stage, seconds in timings.items()}
+
+    def request_timings(self) -> Optional[Dict[str, float]]:
+        """Tiempos (s) del request de este hilo, para pasarlos a trabajo que corre en otro hilo"""
+        return getattr(self.local, 'timings', None)
+
+    def add_timing(self, timings: Optional[Dict[str, float]], name: str, seconds: float) -> None:
+        """Suma una etapa a los tiempos de un request (puede llamarse desde cualquier hilo)"""
+        if timings is not None:
+            with self.lock:
+                timings[name] = timings.get(name, 0.0) + seconds
+
+    def bind(self, fn):
+        """
+        fn para ejecutar en otro hilo (p. ej. un pool): sus etapas se suman a
+        los tiempos del request que la creó y no quedan en el hilo que la ejecuta
+        """
+        timings = self.request_timings()
+
+        def run(*args, **kwargs):
+            previous = getattr(self.local, 'timings', None)
+            self.local.timings = timings
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.local.timings = previous
+        return run
+
+    def stage(self, name: str):
+        """Mide una etapa del pipeline (histograma + tiempos del request)"""
+        if not self.enabled and getattr(self.local, 'timings', None) is None:
+            return NO_STAGE
+        return self._stage(name)
+
+    @contextmanager
+    def _stage(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - t0
+            self.observe('stage_seconds', elapsed, stage=name)
+            self.add_timing(getattr(self.local, 'timings', None), name, elapsed)
+
+    def render(self) -> str:
+        """Todas las métricas en formato de texto Prometheus"""
+        lines = []
+        with self.lock:
+            for name, series in sorted(self.counters.items()):
+                full = f"{self.prefix}_{name}"
+                if name in self.help:
+                    lines.append(f"# HELP {full} {self.help[name]}")
+                lines.append(f"# TYPE {full} counter")
+                for labels, value in sorted(series.items()):
+                    lines.append(f"{full}{format_labels(labels)} {format_value(value)}")
+
+            for name, series in sorted(self.histograms.items()):
+                full = f"{self.prefix}_{name}"
+                if name in self.help:
+                    lines.append(f"# HELP {full} {self.help[name]}")
+                lines.append(f"# TYPE {full} histogram")
+                for labels, hist in sorted(series.items()):
+                    cumulative = 0
+                    for bound, count in zip(hist.buckets, hist.counts):
+                        cumulative += count
+                        le = 'le="%g"' % bound
+                        lines.append(f"{full}_bucket{format_labels(labels, le)} {cumulative}")
+                    inf = 'le="+Inf"'
+                    lines.append(f"{full}_bucket{format_labels(labels, inf)} {hist.count}")
+                    lines.append(f"{full}_sum{format_labels(labels)} {hist.sum:.6f}")
+                    lines.append(f"{full}_count{format_labels(labels)} {hist.count}")
+        return '\n'.join(lines) + '\n'
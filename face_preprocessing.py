@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Preprocesamiento de detección compartido por la API y el entrenamiento
+El costo del detector crece con la cantidad de píxeles, pero Facenet512 solo
+necesita el rostro a 160×160. Se detecta en una copia reducida del frame (y
+opcionalmente solo dentro de la región de interés de la cámara), las cajas se
+escalan a la imagen original y el rostro se alinea y recorta desde la imagen
+a resolución completa (face_inference.align_box).
+
+Regiones de interés (JSON), coordenadas normalizadas a [0, 1]:
+
+    {
+      "camara-1": {"x": 0.25, "y": 0.0, "w": 0.5, "h": 1.0},
+      "camara-2": [[0.1, 0.2], [0.9, 0.2], [0.9, 0.95], [0.1, 0.95]]
+    }
+"""
+
+import json
+import numpy as np
+import cv2
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from face_inference import detect_faces, align_box
+
+
+def load_roi_masks(path: Path) -> Dict[str, np.ndarray]:
+    """Polígonos normalizados (n, 2) por ID de cámara; {} si el archivo no existe"""
+    if path is None or not Path(path).exists():
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    masks = {}
+    for camera_id, region in data.items():
+        if isinstance(region, dict):
+            x, y, w, h = (float(region[key]) for key in ('x', 'y', 'w', 'h'))
+            region = [[x, y], [x + w, y], [x + w, y + h], [x, y + h]]
+        polygon = np.asarray(region, dtype=np.float32).reshape(-1, 2)
+        if len(polygon) < 3:
+            raise ValueError(f"Región de interés inválida para {camera_id}: se necesitan 3 puntos o más")
+        masks[str(camera_id)] = np.clip(polygon, 0.0, 1.0)
+    return masks
+
+
+class FacePreprocessor:
+    """
+    Detección en resolución reducida + recorte a resolución completa
+
+    - detector_backend: detector de DeepFace
+    - max_side: lado mayor (px) de la copia donde se detecta (0 = resolución original)
+    - roi_masks: polígonos normalizados por cámara (ver load_roi_masks)
+
+    Con max_side=0 y sin región de interés es exactamente DeepFace.extract_faces.
+    """
+
+    def __init__(self, detector_backend: str = "opencv", max_side: int = 0,
+                 roi_masks: Dict[str, np.ndarray] = None):
+        self.detector_backend = detector_backend
+        self.max_side = max_side
+        self.roi_masks = roi_masks or {}
+
+    def roi_polygon(self, camera_id: Optional[str], shape) -> Optional[np.ndarray]:
+        """Polígono de la cámara en píxeles de una imagen de tamaño shape, o None"""
+        polygon = self.roi_masks.get(str(camera_id)) if camera_id is not None else None
+        if polygon is None:
+            return None
+        height, width = shape[:2]
+        return np.round(polygon * [width, height]).astype(np.int32)
+
+    def detect(self, img: np.ndarray, camera_id: str = None, align: bool = True) -> List[Dict]:
+        """
+        Rostros de un frame BGR en formato extract_faces (lanza ValueError si no hay rostros)
+        facial_area y los ojos quedan en coordenadas de la imagen original
+        """
+        polygon = self.roi_polygon(camera_id, img.shape)
+        region, offset_x, offset_y = img, 0, 0
+        if polygon is not None:
+            # Solo el rectángulo que contiene la región; lo que queda fuera del polígono va en negro
+            x, y, w, h = cv2.boundingRect(polygon)
+            if w == 0 or h == 0:
+                raise ValueError(f"La región de interés de {camera_id} está vacía")
+            region = img[y:y + h, x:x + w].copy()
+            mask = np.zeros(region.shape[:2], dtype=np.uint8)
+            cv2.fillPoly(mask, [polygon - [x, y]], 255)
+            region[mask == 0] = 0
+            offset_x, offset_y = x, y
+
+        longest = max(region.shape[:2])
+        scale = self.max_side / longest if self.max_side and longest > self.max_side else 1.0
+        if scale == 1.0 and polygon is None:
+            return detect_faces(img, self.detector_backend, align=align)
+
+        small = region if scale == 1.0 else cv2.resize(
+            region, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA
+        )
+        # Sin alinear: DeepFace no agrega borde ni rota el frame, solo se quieren las cajas
+        detections = detect_faces(small, self.detector_backend, align=False)
+
+        faces = []
+        for detection in detections:
+            area = detection['facial_area']
+            box = {
+                'x': offset_x + area['x'] / scale,
+                'y': offset_y + area['y'] / scale,
+                'w': area['w'] / scale,
+                'h': area['h'] / scale,
+                'confidence': detection['confidence']
+            }
+            if polygon is not None:
+                center = (float(box['x'] + box['w'] / 2), float(box['y'] + box['h'] / 2))
+                if cv2.pointPolygonTest(polygon, center, False) < 0:
+                    continue
+            # Los ojos se buscan de nuevo en el recorte a resolución completa
+            faces.append(align_box(img, box, self.detector_backend, align=align))
+
+        if not faces:
+            raise ValueError("No se detectó ningún rostro dentro de la región de interés")
+        return faces
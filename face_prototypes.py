@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Prototipos por identidad para comparar contra menos filas
+Cada foto de entrenamiento es una fila de la galería, y muchas son casi
+iguales (ráfagas de la webcam, la misma foto repetida). Este paso agrupa los
+embeddings de cada identidad en unos pocos prototipos:
+
+1. Los embeddings casi duplicados (similitud >= --duplicate-threshold) se
+   unen al primero que se conservó.
+2. Si quedan más de --max-prototypes, se agrupan con k-means esférico.
+3. Cada prototipo es la media de sus embeddings: la dirección se usa para la
+   similitud máxima y la media sin normalizar (norma × miembros) permite
+   calcular avg_similarity exacta sobre todos los embeddings originales.
+
+Como el índice IVF, los prototipos se construyen offline, se guardan en
+public/trained-faces/face_prototypes/ con la huella de la galería y la API
+los abre al cargarla. Si la mejor similitud queda cerca del umbral
+(± PROTOTYPE_MARGIN), las identidades preseleccionadas se recalculan con
+todos sus embeddings.
+
+Uso:
+    python face_prototypes.py build --max-prototypes 4
+    python face_prototypes.py benchmark --synthetic 2000 --per-identity 25
+    python face_prototypes.py benchmark --embeddings public/trained-faces/face_embeddings.npy
+"""
+
+import json
+import time
+import argparse
+import threading
+import numpy as np
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from face_gallery import FaceGallery, normalize_rows
+from face_index import spherical_kmeans, assign_to_centroids
+from face_store import load_gallery, atomic_save_npy, atomic_save_json, STORE_FILE
+
+PROTOTYPES_DIR = Path("public/trained-faces/face_prototypes")
+MAX_PROTOTYPES = 4  # Prototipos máximos por identidad
+DUPLICATE_THRESHOLD = 0.98  # Similitud a partir de la cual dos embeddings se consideran el mismo
+
+
+def identity_prototypes(rows: np.ndarray, max_prototypes: int = MAX_PROTOTYPES,
+                        duplicate_threshold: float = DUPLICATE_THRESHOLD,
+                        seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Prototipos de los embeddings normalizados de una identidad
+    Retorna (medias sin normalizar (p, d), miembros de cada prototipo (p,))
+    """
+    # 1. Casi duplicados: cada embedding se une al primer conservado que se le parece
+    similar = rows @ rows.T >= duplicate_threshold
+    covered = np.zeros(len(rows), dtype=bool)
+    kept = []
+    for i in range(len(rows)):
+        if not covered[i]:
+            kept.append(i)
+            covered |= similar[i]
+    centers = rows[kept]
+
+    # 2. Demasiados distintos: k-means esférico sobre los conservados
+    if len(centers) > max_prototypes:
+        centers = spherical_kmeans(centers, max_prototypes, iterations=10, seed=seed)
+
+    # 3. Media de los embeddings asignados a cada prototipo
+    assignments = assign_to_centroids(rows, centers)
+    members = np.bincount(assignments, minlength=len(centers))
+    used = np.flatnonzero(members)
+    one_hot = np.arange(len(centers))[:, None] == assignments  # (p, n): más rápido que np.add.at
+    means = (one_hot[used].astype(np.float32) @ rows) / members[used, None]
+    return means, members[used]
+
+
+class Prototypes:
+    """
+    Prototipos de toda la galería, en el mismo orden de identidades
+
+    - gallery: FaceGallery cuyas filas son las direcciones de los prototipos
+    - weights: (p,) miembros × norma de la media de cada prototipo; con ellos
+      la suma ponderada de similitudes es la suma sobre todos los embeddings
+    - totals: (num_identities,) embeddings originales de cada identidad
+    """
+
+    FILES = ('matrix', 'counts', 'weights', 'totals')
+
+    def __init__(self, gallery: FaceGallery, weights: np.ndarray, totals: np.ndarray, meta: Dict = None):
+        self.gallery = gallery
+        self.weights = np.asarray(weights, dtype=np.float32)
+        self.totals = np.asarray(totals, dtype=np.float32)
+        self.meta = meta or {}
+        self.searches = 0
+        self.fallbacks = 0
+        self.lock = threading.Lock()
+
+    @property
+    def num_prototypes(self) -> int:
+        return self.gallery.num_embeddings
+
+    @classmethod
+    def build(cls, gallery: FaceGallery, max_prototypes: int = MAX_PROTOTYPES,
+              duplicate_threshold: float = DUPLICATE_THRESHOLD) -> 'Prototypes':
+        blocks, weights, counts = [], [], []
+        for start, count in zip(gallery.offsets, gallery.counts):
+            rows = np.asarray(gallery.matrix[start:start + count], dtype=np.float32)
+            means, members = identity_prototypes(rows, max_prototypes, duplicate_threshold)
+            norms = np.linalg.norm(means, axis=1)
+            blocks.append(means)
+            weights.append(members * norms)
+            counts.append(len(means))
+
+        prototypes = FaceGallery(gallery.names, normalize_rows(np.vstack(blocks)), counts,
+                                 model=gallery.model, embedding_size=gallery.embedding_size)
+        return cls(prototypes, np.concatenate(weights), gallery.counts, meta={
+            'max_prototypes': max_prototypes,
+            'duplicate_threshold': duplicate_threshold,
+            'num_prototypes': prototypes.num_embeddings,
+            'num_embeddings': gallery.num_embeddings
+        })
+
+    def identity_scores(self, queries: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(max, promedio) de queries normalizados contra cada identidad, ambas (m, num_identities)"""
+        scores = queries @ self.gallery.matrix.T
+        max_scores = np.maximum.reduceat(scores, self.gallery.offsets, axis=1)
+        avg_scores = np.add.reduceat(scores * self.weights, self.gallery.offsets, axis=1) / self.totals
+        return max_scores, avg_scores
+
+    def record(self, searches: int, fallbacks: int) -> None:
+        with self.lock:
+            self.searches += searches
+            self.fallbacks += fallbacks
+
+    def stats(self) -> Dict:
+        return {
+            'num_prototypes': self.num_prototypes,
+            'num_embeddings': int(self.totals.sum()),
+            'searches': self.searches,
+            'fallback_rate': self.fallbacks / self.searches if self.searches else None
+        }
+
+    def save(self, directory: Path = PROTOTYPES_DIR) -> Path:
+        directory.mkdir(parents=True, exist_ok=True)
+        arrays = {'matrix': self.gallery.matrix, 'counts': self.gallery.counts,
+                  'weights': self.weights, 'totals': self.totals}
+        for name in self.FILES:
+            atomic_save_npy(directory / f"{name}.npy", np.asarray(arrays[name]))
+        # Los metadatos al final: confirman que los .npy ya están completos
+        atomic_save_json(directory / "meta.json", self.meta)
+        return directory
+
+    @classmethod
+    def load(cls, directory: Path, gallery: FaceGallery, meta: Dict) -> 'Prototypes':
+        arrays = {name: np.load(directory / f"{name}.npy") for name in cls.FILES}
+        prototypes = FaceGallery(gallery.names, arrays['matrix'], arrays['counts'],
+                                 model=gallery.model, embedding_size=gallery.embedding_size)
+        return cls(prototypes, arrays['weights'], arrays['totals'], meta)
+
+
+def build_prototypes(gallery: FaceGallery, max_prototypes: int = MAX_PROTOTYPES,
+                     duplicate_threshold: float = DUPLICATE_THRESHOLD,
+                     directory: Path = PROTOTYPES_DIR) -> Prototypes:
+    """Construye y guarda los prototipos de la base de una galería (los deltas se comparan en float32)"""
+    prototypes = Prototypes.build(gallery.base_view(), max_prototypes, duplicate_threshold)
+    prototypes.meta['gallery_fingerprint'] = gallery.base_fingerprint()
+    prototypes.save(directory)
+    return prototypes
+
+
+def load_prototypes(gallery: FaceGallery, directory: Path = PROTOTYPES_DIR):
+    """Abre los prototipos si existen y corresponden a la galería; si no, retorna None"""
+    meta_file = directory / "meta.json"
+    if not meta_file.exists():
+        return None
+    with open(meta_file, 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    if meta.get('gallery_fingerprint') != gallery.base_fingerprint():
+        print(f"⚠️  Los prototipos en {directory} no corresponden a la galería actual, se ignoran")
+        return None
+    return Prototypes.load(directory, gallery.base_view(), meta)
+
+
+def benchmark(gallery: FaceGallery, queries: np.ndarray, labels: np.ndarray,
+              threshold: float = 0.4, margins: List[float] = (0.0, 0.1), max_prototypes: List[int] = (1, 2, 4, 8),
+              duplicate_threshold: float = DUPLICATE_THRESHOLD, top_k: int = 5,
+              batch: int = 16) -> List[Dict]:
+    """
+    Precisión y latencia con prototipos frente a la galería completa
+    labels: identidad correcta de cada query (índice en gallery.names, -1 = persona no registrada)
+    Acierto: identidad correcta por encima del umbral, o ningún match para los no registrados
+    """
+    def run(g):
+        t0 = time.perf_counter()
+        found = []
+        for i in range(0, len(queries), batch):
+            found.extend(g.search_batch(queries[i:i + batch], top_k=top_k))
+        return found, (time.perf_counter() - t0) * 1000 / len(queries)
+
+    def summarize(found, reference=None):
+        best = [f[0] for f in found]
+        row = {
+            'accuracy': float(np.mean([
+                b['similarity'] <= threshold if l < 0 else (b['similarity'] > threshold and b['name'] == gallery.names[l])
+                for b, l in zip(best, labels)
+            ])),
+            'match_rate': float(np.mean([b['similarity'] > threshold for b in best]))
+        }
+        if reference is not None:
+            # Top-1 solo de personas registradas: para los desconocidos el mejor candidato es ruido
+            row['top1_agreement'] = float(np.mean([b['name'] == r[0]['name']
+                                                   for b, r, l in zip(best, reference, labels) if l >= 0]))
+            row['decision_agreement'] = float(np.mean([
+                (b['similarity'] > threshold) == (r[0]['similarity'] > threshold)
+                for b, r in zip(best, reference)
+            ]))
+        return row
+
+    base = gallery.copy()  # Copia en RAM sin índice ni prototipos
+    reference, base_ms = run(base)
+    results = [dict({'method': 'completa', 'rows': base.num_embeddings, 'ms_per_probe': base_ms,
+                     'top1_agreement': 1.0, 'decision_agreement': 1.0, 'fallback_rate': 0.0},
+                    **summarize(reference))]
+
+    for p in max_prototypes:
+        t0 = time.perf_counter()
+        built = Prototypes.build(base, p, duplicate_threshold)
+        build_s = time.perf_counter() - t0
+        for margin in margins:
+            prototypes = Prototypes(built.gallery, built.weights, built.totals, built.meta)
+            g = base.with_identities({})
+            g.attach_prototypes(prototypes, threshold, margin)
+            found, ms = run(g)
+            results.append(dict({'method': f'≤{p} ± {margin}', 'rows': prototypes.num_prototypes,
+                                 'ms_per_probe': ms, 'build_s': build_s,
+                                 'fallback_rate': prototypes.stats()['fallback_rate']},
+                                **summarize(found, reference)))
+
+    print(f"\n📊 Prototipos ({gallery.num_identities} identidades, {gallery.num_embeddings} embeddings, "
+          f"{len(queries)} queries, umbral {threshold}; método = máx. prototipos ± margen de recálculo)")
+    for r in results:
+        print(f"   {r['method']:<12} filas={r['rows']:<8} {r['ms_per_probe']:.3f} ms/probe  "
+              f"acierto={r['accuracy']:.4f}  top1={r['top1_agreement']:.4f}  "
+              f"decisión={r['decision_agreement']:.4f}  recalculadas={r['fallback_rate']:.1%}"
+              + (f"  construcción={r['build_s']:.1f}s" if 'build_s' in r else ""))
+    return results
+
+
+def synthetic_identities(num_identities: int, per_identity: int, dimension: int = 512,
+                         seed: int = 0) -> Tuple[FaceGallery, np.ndarray, np.ndarray]:
+    """
+    Galería sintética con fotos parecidas entre sí: cada identidad tiene unas
+    pocas "sesiones" (poses/iluminación) y varias fotos casi iguales por sesión
+    Retorna la galería, queries ruidosos y la identidad de cada query; una
+    cuarta parte son personas no registradas (identidad -1)
+    """
+    rng = np.random.default_rng(seed)
+    centers = normalize_rows(rng.normal(size=(num_identities, dimension)))
+    embeddings = []
+    for c in centers:
+        sessions = normalize_rows(c + 0.5 * normalize_rows(rng.normal(size=(3, dimension))))
+        rows = sessions[rng.integers(0, 3, per_identity)]
+        embeddings.append(rows + 0.15 * normalize_rows(rng.normal(size=(per_identity, dimension))))
+    labels = rng.integers(0, num_identities, 4 * num_identities)
+    queries = centers[labels] + 1.6 * normalize_rows(rng.normal(size=(len(labels), dimension)))
+    strangers = rng.random(len(labels)) < 0.25
+    queries[strangers] = rng.normal(size=(int(strangers.sum()), dimension))
+    labels[strangers] = -1
+    names = [f"persona_{i}" for i in range(num_identities)]
+    return FaceGallery.from_embeddings(names, embeddings), normalize_rows(queries), labels
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prototipos por identidad de la galería de rostros")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    build_cmd = sub.add_parser('build', help="Construir los prototipos desde la galería")
+    build_cmd.add_argument('--embeddings', type=Path, default=STORE_FILE)
+    build_cmd.add_argument('--output', type=Path, default=PROTOTYPES_DIR)
+    build_cmd.add_argument('--max-prototypes', type=int, default=MAX_PROTOTYPES)
+    build_cmd.add_argument('--duplicate-threshold', type=float, default=DUPLICATE_THRESHOLD)
+
+    bench_cmd = sub.add_parser('benchmark', help="Comparar precisión/latencia contra la galería completa")
+    bench_cmd.add_argument('--embeddings', type=Path, default=None)
+    bench_cmd.add_argument('--synthetic', type=int, default=2000, help="Identidades sintéticas")
+    bench_cmd.add_argument('--per-identity', type=int, default=25)
+    bench_cmd.add_argument('--queries', type=int, default=2000)
+    bench_cmd.add_argument('--max-prototypes', type=int, nargs='+', default=[1, 2, 4, 8])
+    bench_cmd.add_argument('--duplicate-threshold', type=float, default=DUPLICATE_THRESHOLD)
+    bench_cmd.add_argument('--threshold', type=float, default=0.4)
+    bench_cmd.add_argument('--margin', type=float, nargs='+', default=[0.0, 0.1])
+
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        gallery = load_gallery(args.embeddings)
+        t0 = time.perf_counter()
+        prototypes = build_prototypes(gallery, args.max_prototypes, args.duplicate_threshold, args.output)
+        print(f"✅ Prototipos construidos en {time.perf_counter() - t0:.1f}s: "
+              f"{gallery.num_embeddings} embeddings → {prototypes.num_prototypes} prototipos → {args.output}")
+        return
+
+    if args.embeddings:
+        gallery = load_gallery(args.embeddings)
+        # Queries: embeddings de la galería con ruido, etiquetados con su identidad
+        rng = np.random.default_rng(0)
+        rows = rng.choice(gallery.num_embeddings, min(args.queries, gallery.num_embeddings), replace=False)
+        queries = normalize_rows(gallery.matrix[rows] + 0.05 * rng.normal(size=(len(rows), gallery.dimension)))
+        labels = gallery.labels[rows]
+    else:
+        gallery, queries, labels = synthetic_identities(args.synthetic, args.per_identity)
+        queries, labels = queries[:args.queries], labels[:args.queries]
+    benchmark(gallery, queries, labels, threshold=args.threshold, margins=args.margin,
+              max_prototypes=args.max_prototypes, duplicate_threshold=args.duplicate_threshold)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Estadísticas de calidad de la galería de embeddings
+Todas las similitudes se calculan como productos de matrices por bloques
+sobre embeddings L2-normalizados: la memoria usada es O(bloque²) aunque la
+galería tenga cientos de miles de fotos.
+
+- intra: similitudes entre fotos de la misma identidad
+- inter: similitudes entre fotos de identidades distintas (muestreadas en galerías grandes)
+- outliers: fotos poco parecidas al centroide de su identidad (sin contarse a sí mismas)
+- near-duplicates: pares de fotos casi idénticas, dentro de una identidad o entre identidades
+- identidades confundibles: pares de identidades con centroides muy cercanos
+
+Uso:
+    python face_quality.py --output quality_report.json
+    python face_quality.py --embeddings public/trained-faces/face_embeddings.npy --inter-sample 50000
+"""
+
+import json
+import time
+import argparse
+import numpy as np
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from face_gallery import FaceGallery, normalize_rows
+from face_store import load_gallery, merge_identity_meta, read_deltas, read_meta, STORE_FILE
+
+BLOCK_SIZE = 2048  # Filas por bloque de la matriz de Gram
+HISTOGRAM_BINS = 400  # Bins en [-1, 1] para percentiles (resolución 0.005)
+OUTLIER_THRESHOLD = 0.5  # Similitud mínima de una foto con el centroide de su identidad
+DUPLICATE_THRESHOLD = 0.97  # Similitud a partir de la cual dos fotos se consideran casi idénticas
+CONFUSION_THRESHOLD = 0.6  # Similitud entre centroides de identidades distintas que se reporta
+INTER_SAMPLE = 20000  # Filas máximas para la distribución inter-identidad (O(n²))
+MAX_PAIRS = 1000  # Pares máximos reportados por lista
+
+
+class PairStats:
+    """Acumulador de una distribución de similitudes (media, desviación, extremos, percentiles)"""
+
+    def __init__(self, bins: int = HISTOGRAM_BINS):
+        self.count = 0
+        self.sum = 0.0
+        self.sumsq = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+        self.histogram = np.zeros(bins, dtype=np.int64)
+
+    def add(self, values: np.ndarray) -> None:
+        if values.size == 0:
+            return
+        values = values.astype(np.float64, copy=False)
+        self.count += values.size
+        self.sum += values.sum()
+        self.sumsq += np.square(values).sum()
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        bins = len(self.histogram)
+        idx = np.clip(((values + 1) * (bins / 2)).astype(np.int64), 0, bins - 1)
+        self.histogram += np.bincount(idx, minlength=bins)
+
+    def percentile(self, q: float) -> float:
+        """Percentil aproximado (centro del bin) a partir del histograma"""
+        cumulative = np.cumsum(self.histogram)
+        i = int(np.searchsorted(cumulative, q / 100 * self.count))
+        return -1 + (i + 0.5) * 2 / len(self.histogram)
+
+    def summary(self) -> Dict:
+        if self.count == 0:
+            return {'pairs': 0}
+        mean = self.sum / self.count
+        return {
+            'pairs': int(self.count),
+            'mean': float(mean),
+            'std': float(np.sqrt(max(0.0, self.sumsq / self.count - mean ** 2))),
+            'min': float(self.min),
+            'max': float(self.max),
+            'p5': self.percentile(5),
+            'p50': self.percentile(50),
+            'p95': self.percentile(95)
+        }
+
+
+def similarity_blocks(a: np.ndarray, b: np.ndarray = None, block_size: int = BLOCK_SIZE):
+    """
+    Recorre la matriz de similitudes por bloques
+    Sin b: triángulo superior de a·aᵀ (cada par una vez). Con b: a·bᵀ completa.
+    Genera (fila inicial, columna inicial, bloque de similitudes, máscara de pares válidos)
+    """
+    same = b is None
+    b = a if same else b
+    for i in range(0, len(a), block_size):
+        rows = np.asarray(a[i:i + block_size], dtype=np.float32)
+        for j in range(i if same else 0, len(b), block_size):
+            scores = rows @ np.asarray(b[j:j + block_size], dtype=np.float32).T
+            if same and i == j:
+                mask = np.triu(np.ones(scores.shape, dtype=bool), k=1)
+            else:
+                mask = None
+            yield i, j, scores, mask
+
+
+def collect_pairs(pairs: List, i: int, j: int, scores: np.ndarray, mask: np.ndarray,
+                  threshold: float, max_pairs: int) -> None:
+    """Agrega a `pairs` los pares (fila, columna, similitud) del bloque por encima del umbral"""
+    hits = scores >= threshold
+    if mask is not None:
+        hits &= mask
+    for r, c in zip(*np.nonzero(hits)):
+        if len(pairs) >= max_pairs:
+            return
+        pairs.append((i + int(r), j + int(c), float(scores[r, c])))
+
+
+def identity_statistics(block: np.ndarray, photos: Optional[List[str]] = None,
+                        outlier_threshold: float = OUTLIER_THRESHOLD,
+                        duplicate_threshold: float = DUPLICATE_THRESHOLD,
+                        block_size: int = BLOCK_SIZE, intra: PairStats = None) -> Dict:
+    """
+    Estadísticas de las fotos de una sola identidad
+    block: (m, d) embeddings normalizados; photos: ruta de cada fila (opcional)
+    intra: acumulador compartido para la distribución global (opcional)
+    """
+    stats = PairStats()
+    duplicates = []
+    for i, j, scores, mask in similarity_blocks(block, block_size=block_size):
+        values = scores[mask] if mask is not None else scores.ravel()
+        stats.add(values)
+        if intra is not None:
+            intra.add(values)
+        collect_pairs(duplicates, i, j, scores, mask, duplicate_threshold, MAX_PAIRS)
+
+    # Similitud con el centroide de las demás fotos (leave-one-out):
+    # x·(S - x) / |S - x|, con |S - x|² = |S|² - 2 x·S + 1
+    total = block.sum(axis=0, dtype=np.float64)
+    dots = np.asarray(block, dtype=np.float64) @ total
+    norms = np.sqrt(np.maximum(total @ total - 2 * dots + 1, 1e-12))
+    centroid_sims = (dots - 1) / norms if len(block) > 1 else np.full(len(block), np.nan)
+
+    def photo(row):
+        return photos[row] if photos is not None else row
+
+    outlier_rows = np.flatnonzero(centroid_sims < outlier_threshold)
+    return {
+        'count': int(len(block)),
+        'intra': stats.summary(),
+        'centroid_similarity': {
+            'min': float(np.nanmin(centroid_sims)) if len(block) > 1 else None,
+            'mean': float(np.nanmean(centroid_sims)) if len(block) > 1 else None
+        },
+        'outliers': [
+            {'photo': photo(int(r)), 'centroid_similarity': float(centroid_sims[r])}
+            for r in outlier_rows[np.argsort(centroid_sims[outlier_rows])]
+        ],
+        'near_duplicates': [
+            {'photo_a': photo(a), 'photo_b': photo(b), 'similarity': s}
+            for a, b, s in duplicates
+        ]
+    }
+
+
+def gallery_report(gallery: FaceGallery, photos: Dict[str, List[str]] = None,
+                   outlier_threshold: float = OUTLIER_THRESHOLD,
+                   duplicate_threshold: float = DUPLICATE_THRESHOLD,
+                   confusion_threshold: float = CONFUSION_THRESHOLD,
+                   inter_sample: int = INTER_SAMPLE, block_size: int = BLOCK_SIZE,
+                   seed: int = 0) -> Dict:
+    """Reporte completo de calidad de la galería (serializable a JSON)"""
+    photos = photos or {}
+    t0 = time.perf_counter()
+
+    # Por identidad: distribución intra, outliers y duplicados
+    intra = PairStats()
+    identities = []
+    for name, start, count in zip(gallery.names, gallery.offsets, gallery.counts):
+        block = gallery.matrix[start:start + count]
+        report = identity_statistics(block, photos.get(name), outlier_threshold,
+                                     duplicate_threshold, block_size, intra)
+        identities.append(dict(name=name, **report))
+
+    # Entre identidades: distribución inter y duplicados con distinto nombre
+    rows = np.arange(gallery.num_embeddings)
+    sampled = gallery.num_embeddings > inter_sample
+    if sampled:
+        rows = np.sort(np.random.default_rng(seed).choice(rows, inter_sample, replace=False))
+    matrix = gallery.matrix[rows] if sampled else gallery.matrix
+    labels = gallery.labels[rows]
+
+    inter = PairStats()
+    cross_duplicates = []
+    for i, j, scores, mask in similarity_blocks(matrix, block_size=block_size):
+        other = labels[i:i + block_size, None] != labels[None, j:j + block_size]
+        if mask is not None:
+            other &= mask
+        inter.add(scores[other])
+        collect_pairs(cross_duplicates, i, j, scores, other, duplicate_threshold, MAX_PAIRS)
+
+    def describe_row(row):
+        identity = int(gallery.labels[row])
+        name = gallery.names[identity]
+        index = int(row - gallery.offsets[identity])
+        return {'name': name, 'photo': photos[name][index] if name in photos else index}
+
+    # Identidades confundibles: centroides más cercanos
+    centroids = normalize_rows(np.add.reduceat(gallery.matrix, gallery.offsets, axis=0))
+    nearest = np.full(gallery.num_identities, -1, dtype=np.int64)
+    nearest_sim = np.full(gallery.num_identities, -np.inf, dtype=np.float32)
+    confusable = []
+    for i, j, scores, mask in similarity_blocks(centroids, centroids, block_size=block_size):
+        # Excluir la diagonal (cada identidad consigo misma)
+        diagonal = np.arange(max(i, j), min(i + len(scores), j + scores.shape[1]))
+        scores[diagonal - i, diagonal - j] = -np.inf
+        best = scores.argmax(axis=1)
+        best_sim = scores[np.arange(len(scores)), best]
+        improved = best_sim > nearest_sim[i:i + len(scores)]
+        nearest[i:i + len(scores)][improved] = best[improved] + j
+        nearest_sim[i:i + len(scores)][improved] = best_sim[improved]
+        # Cada par de identidades se reporta una sola vez (fila < columna)
+        upper = np.arange(i, i + len(scores))[:, None] < np.arange(j, j + scores.shape[1])[None, :]
+        collect_pairs(confusable, i, j, scores, upper, confusion_threshold, MAX_PAIRS)
+
+    for identity, report in enumerate(identities):
+        if nearest[identity] >= 0:
+            report['nearest_identity'] = gallery.names[nearest[identity]]
+            report['nearest_similarity'] = float(nearest_sim[identity])
+
+    return {
+        'num_identities': gallery.num_identities,
+        'num_embeddings': gallery.num_embeddings,
+        'dimension': gallery.dimension,
+        'thresholds': {
+            'outlier': outlier_threshold,
+            'duplicate': duplicate_threshold,
+            'confusion': confusion_threshold
+        },
+        'intra': intra.summary(),
+        'inter': dict(inter.summary(), sampled_rows=int(len(rows)) if sampled else None),
+        'num_outliers': sum(len(r['outliers']) for r in identities),
+        'num_near_duplicates': sum(len(r['near_duplicates']) for r in identities),
+        'cross_identity_duplicates': [
+            {'a': describe_row(rows[a]), 'b': describe_row(rows[b]), 'similarity': s}
+            for a, b, s in cross_duplicates
+        ],
+        'confusable_identities': sorted(
+            ({'a': gallery.names[a], 'b': gallery.names[b], 'similarity': s} for a, b, s in confusable),
+            key=lambda p: -p['similarity']
+        ),
+        'identities': identities,
+        'seconds': time.perf_counter() - t0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reporte de calidad de la galería de rostros")
+    parser.add_argument('--embeddings', type=Path, default=STORE_FILE)
+    parser.add_argument('--output', type=Path, default=Path('quality_report.json'))
+    parser.add_argument('--outlier-threshold', type=float, default=OUTLIER_THRESHOLD)
+    parser.add_argument('--duplicate-threshold', type=float, default=DUPLICATE_THRESHOLD)
+    parser.add_argument('--confusion-threshold', type=float, default=CONFUSION_THRESHOLD)
+    parser.add_argument('--inter-sample', type=int, default=INTER_SAMPLE,
+                        help="Filas máximas para la distribución inter-identidad")
+    parser.add_argument('--block-size', type=int, default=BLOCK_SIZE)
+    args = parser.parse_args()
+
+    gallery = load_gallery(args.embeddings)
+
+    # Rutas de las fotos desde los metadatos de la base más los mismos deltas que
+    # aplicó load_gallery; solo se usan si corresponden una a una con las filas
+    photos = {}
+    store_file = args.embeddings.with_suffix('.npy')
+    meta = read_meta(store_file)
+    if meta.get('timestamp') == gallery.base_timestamp:
+        entries = [e for e in read_deltas(store_file, after_seq=gallery.base_seq)
+                   if e['seq'] <= gallery.delta_seq]
+        identity_meta = merge_identity_meta(meta.get('identities', []), entries)
+        for name, count in zip(gallery.names, gallery.counts):
+            valid = identity_meta.get(name, {}).get('valid_photos')
+            if valid and len(valid) == count:
+                photos[name] = valid
+
+    report = gallery_report(gallery, photos, args.outlier_threshold, args.duplicate_threshold,
+                            args.confusion_threshold, args.inter_sample, args.block_size)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    print(f"📊 Calidad de la galería ({report['num_identities']} identidades, "
+          f"{report['num_embeddings']} embeddings, {report['seconds']:.1f}s)")
+    print(f"   Intra-identidad: media {report['intra'].get('mean', 0):.3f}, p5 {report['intra'].get('p5', 0):.3f}")
+    print(f"   Inter-identidad: media {report['inter'].get('mean', 0):.3f}, p95 {report['inter'].get('p95', 0):.3f}")
+    print(f"   Outliers: {report['num_outliers']}")
+    print(f"   Casi duplicados: {report['num_near_duplicates']} "
+          f"(+{len(report['cross_identity_duplicates'])} entre identidades distintas)")
+    print(f"   Identidades confundibles: {len(report['confusable_identities'])}")
+    print(f"💾 Reporte guardado en {args.output}")
+
+
+if __name__ == "__main__":
+    main()
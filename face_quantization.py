@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Galería cuantizada (int8) para listas grandes de requisitoriados
+Cada búsqueda recorre la matriz completa: con float32 son 2 KB por embedding
+de 512 dimensiones. La copia int8 (con una escala por vector) ocupa la cuarta
+parte y es la que se recorre en la primera pasada; las identidades mejor
+puntuadas se recalculan de forma exacta con la matriz float32
+(FaceGallery.rescore), que queda en el memory-map y solo se lee en las pocas
+filas que se re-rankean.
+
+Es un cambio de throughput por memoria, no una aceleración: NumPy no tiene
+producto int8 con BLAS (el producto entero es ~8 veces más lento que sgemm),
+así que cada bloque se convierte a float32 antes de multiplicar. float16 se
+descartó: la conversión cuesta el doble que en int8 y ahorra la mitad de memoria.
+
+La copia se guarda en public/trained-faces/face_quantized/ junto con la huella
+de la galería: los workers de face_server.py la abren con memory-map y
+comparten las mismas páginas en lugar de cuantizar cada uno la suya.
+
+Uso:
+    python face_quantization.py benchmark --synthetic 200000
+    python face_quantization.py benchmark --embeddings public/trained-faces/face_embeddings.npy
+"""
+
+import json
+import time
+import argparse
+import numpy as np
+from pathlib import Path
+from typing import Dict, List
+
+from face_store import atomic_save_npy, atomic_save_json
+
+QUANTIZED_DIR = Path("public/trained-faces/face_quantized")
+PRECISIONS = ('float32', 'int8')
+CHUNK_SIZE = 4096  # Filas que se convierten a float32 por bloque (caben en la caché L2/L3)
+
+
+class QuantizedMatrix:
+    """
+    Copia cuantizada de una matriz de embeddings L2-normalizados
+
+    - precision: 'int8'
+    - data: (n, d) int8 con |valor| <= 127
+    - scales: (n,) float32, escala de cada fila (fila ≈ data * scale)
+    """
+
+    def __init__(self, precision: str, data: np.ndarray, scales: np.ndarray):
+        if precision not in PRECISIONS[1:]:
+            raise ValueError(f"Precisión desconocida: {precision} (opciones: {', '.join(PRECISIONS[1:])})")
+        self.precision = precision
+        self.data = data
+        self.scales = scales
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, precision: str) -> 'QuantizedMatrix':
+        """Cuantiza por bloques (una matriz en memory-map no se copia entera a float32)"""
+        if precision not in PRECISIONS[1:]:
+            raise ValueError(f"Precisión desconocida: {precision} (opciones: {', '.join(PRECISIONS[1:])})")
+        data = np.empty(matrix.shape, dtype=np.int8)
+        scales = np.empty(len(matrix), dtype=np.float32)
+        for start in range(0, len(matrix), CHUNK_SIZE):
+            block = np.asarray(matrix[start:start + CHUNK_SIZE], dtype=np.float32)
+            scale = np.abs(block).max(axis=1) / 127.0
+            scale[scale == 0] = 1.0
+            data[start:start + CHUNK_SIZE] = np.rint(block / scale[:, None])
+            scales[start:start + CHUNK_SIZE] = scale
+        return cls(precision, data, scales)
+
+    def save(self, directory: Path = QUANTIZED_DIR, fingerprint: str = None) -> Path:
+        """Guarda la copia como .npy + meta.json (la huella indica de qué galería es)"""
+        directory.mkdir(parents=True, exist_ok=True)
+        atomic_save_npy(directory / f"{self.precision}.npy", self.data)
+        atomic_save_npy(directory / f"{self.precision}.scales.npy", self.scales)
+        # Los metadatos al final: confirman que los .npy ya están completos
+        atomic_save_json(directory / f"{self.precision}.meta.json", {
+            'precision': self.precision,
+            'shape': list(self.data.shape),
+            'gallery_fingerprint': fingerprint
+        })
+        return directory
+
+    @classmethod
+    def load(cls, directory: Path, precision: str, mmap: bool = True) -> 'QuantizedMatrix':
+        mode = 'r' if mmap else None
+        data = np.load(directory / f"{precision}.npy", mmap_mode=mode)
+        # Las escalas se leen enteras en cada búsqueda: mejor tenerlas en RAM
+        scales = np.load(directory / f"{precision}.scales.npy")
+        return cls(precision, data, scales)
+
+    @property
+    def nbytes(self) -> int:
+        return self.data.nbytes + self.scales.nbytes
+
+    def scores(self, queries: np.ndarray) -> np.ndarray:
+        """
+        Similitud aproximada (m, n) de queries normalizados contra todas las filas
+        Cada bloque se convierte a float32 en un buffer reutilizado y se multiplica con BLAS
+        """
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        out = np.empty((len(queries), len(self.data)), dtype=np.float32)
+        buffer = np.empty((min(CHUNK_SIZE, len(self.data)), self.data.shape[1]), dtype=np.float32)
+        for start in range(0, len(self.data), CHUNK_SIZE):
+            end = min(start + CHUNK_SIZE, len(self.data))
+            block = buffer[:end - start]
+            np.copyto(block, self.data[start:end], casting='unsafe')
+            out[:, start:end] = queries @ block.T
+        out *= self.scales
+        return out
+
+
+def load_quantized(gallery, precision: str, directory: Path = QUANTIZED_DIR) -> QuantizedMatrix:
+    """
+    Copia cuantizada de la matriz base de la galería: la abre con memory-map
+    si la guardada en disco corresponde a esa base; si no, la construye y la
+    guarda. Las identidades agregadas por deltas se comparan en float32
+    (FaceGallery.with_overlay), así una recarga incremental no la reconstruye
+    """
+    fingerprint = gallery.base_fingerprint()
+    meta_file = directory / f"{precision}.meta.json"
+    if meta_file.exists():
+        with open(meta_file, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('gallery_fingerprint') == fingerprint:
+            try:
+                quantized = QuantizedMatrix.load(directory, precision)
+                if quantized.data.shape == gallery.base.shape:
+                    return quantized
+            except (OSError, ValueError):
+                pass  # Otro proceso la está reescribiendo: se construye de nuevo
+
+    quantized = QuantizedMatrix.build(gallery.base, precision)
+    try:
+        quantized.save(directory, fingerprint)
+    except OSError as e:
+        print(f"⚠️  No se pudo guardar la galería {precision} en {directory}: {e}")
+    return quantized
+
+
+def ranking_agreement(reference: List[List[Dict]], results: List[List[Dict]]) -> Dict:
+    """Coincidencia del top-1 y solapamiento del top-k contra la búsqueda float32"""
+    top1 = np.mean([r[0]['name'] == q[0]['name'] for r, q in zip(reference, results)])
+    overlap = np.mean([
+        len({c['name'] for c in r} & {c['name'] for c in q}) / len(r)
+        for r, q in zip(reference, results)
+    ])
+    similarity_error = max(
+        abs(a['similarity'] - b['similarity'])
+        for r, q in zip(reference, results) for a, b in zip(r, q) if a['name'] == b['name']
+    )
+    return {'top1_agreement': float(top1), 'topk_overlap': float(overlap),
+            'max_similarity_error': float(similarity_error)}
+
+
+def benchmark(gallery, queries: np.ndarray, precisions: List[str], top_k: int = 5,
+              batch: int = 16, rerank: int = 32) -> List[Dict]:
+    """Memoria, throughput y coincidencia del ranking de cada precisión frente a float32"""
+    def run(g):
+        t0 = time.perf_counter()
+        found = []
+        for i in range(0, len(queries), batch):
+            found.extend(g.search_batch(queries[i:i + batch], top_k=top_k))
+        return found, len(queries) / (time.perf_counter() - t0)
+
+    base = gallery.copy()  # Copia en RAM: no medir lecturas del memory-map
+    reference, base_qps = run(base)
+    results = [{'precision': 'float32', 'matrix_mb': base.matrix.nbytes / 2**20,
+                'probes_per_s': base_qps, 'top1_agreement': 1.0, 'topk_overlap': 1.0,
+                'max_similarity_error': 0.0}]
+
+    for precision in precisions:
+        if precision == 'float32':
+            continue
+        t0 = time.perf_counter()
+        quantized = QuantizedMatrix.build(base.matrix, precision)
+        build_s = time.perf_counter() - t0
+        g = base.with_identities({})
+        g.attach_quantized(quantized, rerank=rerank)
+        found, qps = run(g)
+        results.append(dict({'precision': precision, 'matrix_mb': quantized.nbytes / 2**20,
+                             'probes_per_s': qps, 'build_s': build_s},
+                            **ranking_agreement(reference, found)))
+
+    print(f"\n📊 Precisión de la galería ({gallery.num_embeddings} embeddings, "
+          f"{len(queries)} queries, top-{top_k}, lotes de {batch}, re-rank de {rerank})")
+    for r in results:
+        print(f"   {r['precision']:<8} {r['matrix_mb']:8.1f} MB  {r['probes_per_s']:8.0f} probes/s  "
+              f"top1={r['top1_agreement']:.4f}  top{top_k}={r['topk_overlap']:.4f}  "
+              f"Δsim={r['max_similarity_error']:.2e}")
+    return results
+
+
+def main():
+    from face_index import synthetic_gallery
+    from face_gallery import normalize_rows
+    from face_store import load_gallery
+
+    parser = argparse.ArgumentParser(description="Galería cuantizada (int8)")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    bench_cmd = sub.add_parser('benchmark', help="Comparar memoria/throughput/ranking contra float32")
+    bench_cmd.add_argument('--embeddings', type=Path, default=None)
+    bench_cmd.add_argument('--synthetic', type=int, default=100000,
+                           help="Número de embeddings sintéticos (si no se indica --embeddings)")
+    bench_cmd.add_argument('--queries', type=int, default=512)
+    bench_cmd.add_argument('--precision', nargs='+', default=['int8'], choices=PRECISIONS)
+    bench_cmd.add_argument('--rerank', type=int, default=32)
+    bench_cmd.add_argument('-k', type=int, default=5)
+
+    args = parser.parse_args()
+
+    if args.embeddings:
+        gallery = load_gallery(args.embeddings)
+        rng = np.random.default_rng(0)
+        rows = rng.choice(gallery.num_embeddings, min(args.queries, gallery.num_embeddings),
+                          replace=False)
+        queries = normalize_rows(gallery.matrix[rows] + 0.05 * rng.normal(size=(len(rows), gallery.dimension)))
+    else:
+        per_identity = 5
+        gallery, queries = synthetic_gallery(max(1, args.synthetic // per_identity), per_identity)
+        queries = np.resize(queries, (args.queries, gallery.dimension))
+    benchmark(gallery, queries, args.precision, top_k=args.k, rerank=args.rerank)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,105 +7,814 @@ Proporciona endpoints para reconocimiento en tiempo real desde el frontend
 import os
 import json
 import base64
+import time
+import threading
 import numpy as np
-from io import BytesIO
-from PIL import Image
 from pathlib import Path
-from flask import Flask, request, jsonify
+from functools import wraps
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, g, has_request_context, request, jsonify
 from flask_cors import CORS
-from deepface import DeepFace
-from scipy.spatial.distance import cosine
 import cv2
 
+from face_index import load_index
+from face_quantization import load_quantized, PRECISIONS, QUANTIZED_DIR
+from face_prototypes import load_prototypes
+from face_inference import FaceEmbedder, BatchingEmbedder, detect_faces, align_box
+from face_backends import batch_buckets
+from face_store import load_gallery, refresh_gallery, compact_store, store_exists, StoreWatcher
+from face_metrics import Metrics
+from face_cache import FrameCache, EmbeddingCache, dhash, image_digest
+from face_gallery import normalize_rows
+from face_tracking import SessionRegistry
+from face_preprocessing import FacePreprocessor, load_roi_masks
+
 app = Flask(__name__)
 CORS(app)  # Permitir CORS para desarrollo
 
 # Configuración
 MODEL_NAME = "Facenet512"
 DETECTOR_BACKEND = "opencv"
-EMBEDDINGS_FILE = Path("public/trained-faces/face_embeddings.json")
+DETECTION_MAX_SIDE = 960  # Lado mayor (px) de la copia reducida donde se detecta (0 = resolución original, igual que en el entrenamiento)
+ROI_MASKS_FILE = Path("roi_masks.json")  # Regiones de interés por cámara (opcional, ver face_preprocessing.py)
+STORE_FILE = Path("public/trained-faces/face_embeddings.npy")  # Matriz float32 + .meta.json
+EMBEDDINGS_FILE = Path("public/trained-faces/face_embeddings.json")  # Formato anterior (se convierte)
 THRESHOLD = 0.4  # Umbral de similitud (ajustable)
+TOP_K = 5  # Candidatos retornados por rostro
+INDEX_DIR = Path("public/trained-faces/face_index")  # Índice IVF (python face_index.py build)
+INDEX_NPROBE = 16  # Listas revisadas por búsqueda (más = mejor recall, más lento)
+INDEX_MIN_EMBEDDINGS = 50000  # Debajo de este tamaño la búsqueda exacta es más rápida
+GALLERY_PRECISION = "float32"  # Matriz recorrida en cada búsqueda: float32 o int8 (1/4 de memoria, menos throughput)
+QUANTIZED_RERANK = 32  # Identidades recalculadas en float32 tras la pasada cuantizada
+PROTOTYPES_DIR = Path("public/trained-faces/face_prototypes")  # Prototipos por identidad (python face_prototypes.py build)
+PROTOTYPE_MARGIN = 0.1  # Si la mejor similitud queda a menos de esto del umbral se recalcula con todos los embeddings
+BATCH_MAX_SIZE = 32  # Rostros máximos por pasada de Facenet512
+BATCH_MAX_WAIT_MS = 5  # Espera máxima para juntar requests concurrentes en un lote
+INFERENCE_WORKERS = 1  # Hilos de inferencia que consumen la cola
+INFERENCE_BACKEND = "tf_function"  # keras (eager), tf_function, savedmodel u onnx (ver face_backends.py)
+INFERENCE_THREADS = 0  # Hilos intra-op de TensorFlow / ONNX Runtime (0 = todos los núcleos)
+INFERENCE_INTER_THREADS = 1  # Hilos inter-op (el modelo es una cadena de capas: 1 basta)
+MAX_FACES_PER_FRAME = 10  # Rostros máximos por frame con multi_face
+MIN_FACE_SIZE = 40  # Lado mínimo (px) de un rostro para reconocerlo con multi_face
+BATCH_MAX_IMAGES = 64  # Imágenes máximas por request en /recognize_batch
+DETECTION_WORKERS = 4  # Hilos de detección para /recognize_batch
+WARMUP_IMAGE_SIZE = 640  # Lado de la imagen vacía usada para preparar el detector
+DELTA_COMPACT_THRESHOLD = 20  # Deltas pendientes que disparan la compactación en segundo plano
+GALLERY_WATCH_INTERVAL = 2.0  # Segundos entre revisiones de public/trained-faces/ para recargar sola la galería (0 = solo con /reload)
+RELOAD_WAIT_TIMEOUT = 60.0  # Segundos máximos que espera /reload?wait=true
+FRAME_CACHE_SIZE = 256  # Frames recientes cuyo resultado se reutiliza (0 desactiva el cache)
+FRAME_CACHE_TTL = 10.0  # Segundos que un resultado cacheado sigue siendo válido
+FRAME_CACHE_MAX_DISTANCE = 4  # Bits distintos (de 64) del hash perceptual para considerar iguales dos frames
+EMBEDDING_CACHE_SIZE = 4096  # Embeddings recientes reutilizables por /verify (0 desactiva el cache)
+EMBEDDING_CACHE_TTL = 600.0  # Segundos que un embedding_id sigue disponible
+VERIFY_DISTANCE_THRESHOLD = 0.30  # Distancia coseno máxima en /verify (valor de DeepFace para Facenet512)
+VERIFY_MAX_OPERANDS = 64  # Operandos máximos por lado en /verify N a M
+STREAM_SESSION_TTL = 60.0  # Segundos sin frames antes de cerrar una sesión de streaming
+STREAM_MAX_SESSIONS = 64  # Cámaras simultáneas
+TRACK_IOU_THRESHOLD = 0.3  # IoU mínimo entre cajas de frames consecutivos para seguir un rostro
+TRACK_MAX_AGE = 1.5  # Segundos sin ver un rostro antes de olvidar su track
+TRACK_REEMBED_INTERVAL = 3.0  # Segundos entre embeddings de confirmación de un track
+METRICS_ENABLED = True  # Métricas por etapa en /metrics (costo despreciable si se desactiva)
+RAW_IMAGE_TYPES = ('image/jpeg', 'image/png', 'image/webp', 'application/octet-stream')
+
+# Galería de identidades entrenadas
+gallery = None  # Versión publicada: se reemplaza con una sola asignación, nunca se modifica
+gallery_load_lock = threading.Lock()  # Serializa las cargas (los requests nunca lo toman)
+stale_accelerators = []  # Índice / prototipos en disco que no corresponden a la base actual
+compaction_lock = threading.Lock()
+
+# Recargas en segundo plano: las peticiones que llegan durante una recarga se agrupan en la siguiente
+reload_condition = threading.Condition()
+reload_state = {'running': False, 'requested': 0, 'completed': 0, 'full': False, 'success': None,
+                'version': None}
+gallery_watcher = None
+
+# Coordinación entre procesos cuando la API corre con face_server.py (None = un solo proceso)
+cluster = None
+
+# Resultados de frames recientes para cámaras fijas (ver face_cache.py)
+frame_cache = FrameCache(FRAME_CACHE_SIZE, FRAME_CACHE_TTL, FRAME_CACHE_MAX_DISTANCE)
+
+# Embeddings recientes por embedding_id y por hash exacto de la imagen (ver face_cache.py)
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_TTL)
+
+# Detección en resolución reducida y regiones de interés por cámara (ver face_preprocessing.py)
+preprocessor = FacePreprocessor(DETECTOR_BACKEND, DETECTION_MAX_SIDE, load_roi_masks(ROI_MASKS_FILE))
+
+# Sesiones de streaming por cámara con seguimiento de rostros (ver face_tracking.py)
+stream_sessions = SessionRegistry(
+    ttl=STREAM_SESSION_TTL,
+    max_sessions=STREAM_MAX_SESSIONS,
+    iou_threshold=TRACK_IOU_THRESHOLD,
+    max_age=TRACK_MAX_AGE,
+    reembed_interval=TRACK_REEMBED_INTERVAL
+)
+
+# Métricas (GET /metrics en formato Prometheus)
+metrics = Metrics(enabled=METRICS_ENABLED)
+metrics.describe('requests_total', 'Requests atendidos por endpoint y código HTTP')
+metrics.describe('request_seconds', 'Duración total de los requests por endpoint')
+metrics.describe('stage_seconds', 'Duración de cada etapa del pipeline de reconocimiento')
+metrics.describe('errors_total', 'Errores internos por endpoint')
+metrics.describe('frames_total', 'Frames procesados')
+metrics.describe('frame_cache_total', 'Consultas al cache de frames casi idénticos (hit/miss)')
+metrics.describe('gallery_reloads_total', 'Recargas de la galería en segundo plano (ok/error)')
+metrics.describe('gallery_reload_seconds', 'Duración de la construcción de una nueva versión de la galería')
+metrics.describe('embedding_cache_total', 'Imágenes de /verify resueltas desde el cache de embeddings (hit/miss)')
+metrics.describe('stream_frames_total', 'Frames de streaming procesados o descartados por estar ocupada la sesión')
+metrics.describe('stream_embeddings_total', 'Embeddings de tracks (new: track nuevo, refresh: confirmación)')
+metrics.describe('faces_detected_total', 'Rostros detectados y reconocidos')
+metrics.describe('no_face_frames_total', 'Frames sin ningún rostro reconocible')
+metrics.describe('batch_size', 'Rostros por pasada del modelo', buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+
+# Estado de arranque: el servidor responde /health desde el inicio (liveness),
+# pero los endpoints de reconocimiento esperan a que termine el warm-up (readiness)
+startup = {
+    'state': 'starting',  # starting → warming → ready | failed
+    'phases': {},  # Duración (s) de cada fase
+    'error': None,
+    'started_at': time.time(),
+    'ready_at': None
+}
+
+# Cola de inferencia compartida (se crea con el primer request)
+embedder = None
+embedder_lock = threading.Lock()
+
+# Hilos de detección para /recognize_batch y /verify (el detector de DeepFace se serializa con DETECTOR_LOCK)
+detection_pool = ThreadPoolExecutor(max_workers=DETECTION_WORKERS, thread_name_prefix='detection')
+
+
+def get_embedder():
+    """Retorna la cola de inferencia con micro-batching, creándola si hace falta"""
+    global embedder
+
+    if embedder is None:
+        with embedder_lock:
+            if embedder is None:
+                embedder = BatchingEmbedder(
+                    FaceEmbedder(MODEL_NAME, backend=INFERENCE_BACKEND, intra_threads=INFERENCE_THREADS,
+                                 inter_threads=INFERENCE_INTER_THREADS, buckets=batch_buckets(BATCH_MAX_SIZE)),
+                    max_batch_size=BATCH_MAX_SIZE,
+                    max_wait_ms=BATCH_MAX_WAIT_MS,
+                    workers=INFERENCE_WORKERS,
+                    metrics=metrics
+                )
+    return embedder
+
+
+@contextmanager
+def startup_phase(name):
+    """Mide la duración de una fase del arranque"""
+    t0 = time.perf_counter()
+    yield
+    startup['phases'][name] = round(time.perf_counter() - t0, 3)
+    print(f"   ⏱️  {name}: {startup['phases'][name]:.2f}s")
+
 
-# Cargar embeddings entrenados
-trained_embeddings = None
-person_name = None
+def warm_up():
+    """
+    Carga galería, modelo y detector y los ejecuta con entradas vacías,
+    para que el primer request real no pague la construcción del grafo
+    """
+    startup['state'] = 'warming'
+    print("\n🔥 Preparando modelo y detector...")
+
+    try:
+        with startup_phase('load_gallery'):
+            load_trained_embeddings(version=cluster.current_generation() if cluster is not None else None)
+
+        with startup_phase('import_deepface'):
+            import deepface.DeepFace  # noqa: F401 (importa TensorFlow)
+
+        with startup_phase('build_model'):
+            model = get_embedder().embedder
+
+        with startup_phase('warm_model'):
+            model.warm_up()  # Todos los tamaños de lote fijos (un grafo por tamaño)
+
+        with startup_phase('warm_detector'):
+            dummy = np.zeros((WARMUP_IMAGE_SIZE, WARMUP_IMAGE_SIZE, 3), dtype=np.uint8)
+            detect_faces(dummy, DETECTOR_BACKEND, enforce_detection=False)
+
+        startup['ready_at'] = time.time()
+        startup['state'] = 'ready'
+        print(f"✅ Servidor listo en {startup['ready_at'] - startup['started_at']:.1f}s")
+        start_gallery_watcher()
+    except Exception as e:
+        startup['state'] = 'failed'
+        startup['error'] = str(e)
+        print(f"❌ Error en el warm-up: {e}")
 
 
-def load_trained_embeddings():
-    """Carga los embeddings entrenados desde el archivo JSON"""
-    global trained_embeddings, person_name
+def require_ready(view):
+    """Responde 503 mientras el modelo no esté listo"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if startup['state'] != 'ready':
+            return jsonify({
+                'success': False,
+                'error': 'El servidor aún no está listo',
+                'state': startup['state']
+            }), 503
+        return view(*args, **kwargs)
+    return wrapper
 
-    if not EMBEDDINGS_FILE.exists():
-        print(f"⚠️  No se encontró {EMBEDDINGS_FILE}")
+
+def load_trained_embeddings(incremental=False, version=None):
+    """
+    Carga la galería de identidades desde el store binario (memory-map)
+    Con incremental=True solo aplica los deltas nuevos sobre la galería actual
+    (ver face_store.refresh_gallery); si hay una nueva base, la recarga completa.
+
+    La nueva versión se construye completa (incluido el índice) y se publica
+    con una sola asignación: los requests en curso terminan con la versión que
+    tomaron al empezar (ver current_gallery) y ninguno espera a la carga.
+    version: número de la nueva versión (por defecto la actual + 1); con
+    face_server.py es la generación del supervisor, igual en todos los workers
+    """
+    if not store_exists(STORE_FILE, EMBEDDINGS_FILE):
+        print(f"⚠️  No se encontró {STORE_FILE} ni {EMBEDDINGS_FILE}")
         return False
 
+    with gallery_load_lock:
+        return swap_gallery(incremental, version)
+
+
+def swap_gallery(incremental, version=None):
+    """Construye la nueva versión de la galería y la publica (con gallery_load_lock tomado)"""
+    global gallery, stale_accelerators
+
     try:
-        with open(EMBEDDINGS_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        if incremental and gallery is not None:
+            new_gallery = refresh_gallery(gallery, STORE_FILE, EMBEDDINGS_FILE)
+            if new_gallery is gallery:
+                print("✅ Galería sin cambios")
+                return True
+        else:
+            new_gallery = load_gallery(STORE_FILE, EMBEDDINGS_FILE)
+
+        # Índice, prototipos y copia cuantizada cubren la matriz base: con solo deltas
+        # nuevos (misma base) la galería los conserva y no se vuelven a abrir
+        if GALLERY_PRECISION not in PRECISIONS:
+            raise ValueError(f"GALLERY_PRECISION desconocida: {GALLERY_PRECISION} "
+                             f"(opciones: {', '.join(PRECISIONS)}; float16 ya no se admite)")
+        if gallery is None or new_gallery.base is not gallery.base:
+            stale = []
+            if new_gallery.num_embeddings >= INDEX_MIN_EMBEDDINGS:
+                index = load_index(new_gallery, INDEX_DIR)
+                if index is not None:
+                    new_gallery.attach_index(index, nprobe=INDEX_NPROBE)
+                elif (INDEX_DIR / "meta.json").exists():
+                    stale.append('index')
+            if new_gallery.index is None:
+                prototypes = load_prototypes(new_gallery, PROTOTYPES_DIR)
+                if prototypes is not None:
+                    new_gallery.attach_prototypes(prototypes, THRESHOLD, margin=PROTOTYPE_MARGIN)
+                elif (PROTOTYPES_DIR / "meta.json").exists():
+                    stale.append('prototypes')
+            stale_accelerators = stale
+        if GALLERY_PRECISION != 'float32' and new_gallery.index is None and new_gallery.prototypes is None \
+                and new_gallery.quantized is None:
+            new_gallery.attach_quantized(load_quantized(new_gallery, GALLERY_PRECISION, QUANTIZED_DIR),
+                                         rerank=QUANTIZED_RERANK)
 
-        trained_embeddings = np.array(data['embeddings'])
-        person_name = data['name']
+        new_gallery.version = version or (gallery.version if gallery is not None else 0) + 1
+        gallery = new_gallery
+        frame_cache.clear()
 
-        print(f"✅ Embeddings cargados: {person_name}")
-        print(f"   Embeddings: {len(trained_embeddings)}")
-        print(f"   Modelo: {data.get('model', 'N/A')}")
-        print(f"   Dimensión: {data.get('embedding_size', 'N/A')}")
+        print(f"✅ Galería cargada (versión {gallery.version}): {gallery.num_identities} identidades")
+        print(f"   Embeddings: {gallery.num_embeddings}")
+        print(f"   Modelo: {gallery.model or 'N/A'}")
+        print(f"   Dimensión: {gallery.embedding_size}")
+        print(f"   Deltas: {gallery.delta_seq - gallery.base_seq} pendientes de compactar")
+        print(f"   Índice IVF: {gallery.index.nlist if gallery.index else 'no'}")
+        print(f"   Prototipos: {gallery.prototypes.num_prototypes if gallery.prototypes else 'no'}")
+        print(f"   Precisión: {gallery.quantized.precision if gallery.quantized else 'float32'}")
+        if stale_accelerators:
+            print(f"   ⚠️  Desactualizados (se busca sin ellos hasta reconstruirlos): {', '.join(stale_accelerators)}")
 
+        maybe_compact()
         return True
     except Exception as e:
         print(f"❌ Error cargando embeddings: {e}")
         return False
 
 
+def schedule_reload(full=False, version=None):
+    """
+    Pide una recarga al hilo de recargas sin bloquear
+    Retorna el número de petición, para esperarla con wait_reload
+    """
+    with reload_condition:
+        reload_state['requested'] += 1
+        reload_state['full'] = reload_state['full'] or full
+        if version is not None:
+            reload_state['version'] = max(version, reload_state['version'] or 0)
+        ticket = reload_state['requested']
+        if not reload_state['running']:
+            reload_state['running'] = True
+            threading.Thread(target=run_reloads, name='gallery-reload', daemon=True).start()
+        return ticket
+
+
+def run_reloads():
+    """Hilo de recargas: construye cada versión nueva fuera del camino de los requests"""
+    while True:
+        with reload_condition:
+            if reload_state['completed'] >= reload_state['requested']:
+                reload_state['running'] = False
+                return
+            target, full, version = reload_state['requested'], reload_state['full'], reload_state['version']
+            reload_state['full'] = False
+            reload_state['version'] = None
+
+        t0 = time.perf_counter()
+        success = load_trained_embeddings(incremental=not full, version=version)
+        metrics.observe('gallery_reload_seconds', time.perf_counter() - t0)
+        metrics.inc('gallery_reloads_total', result='ok' if success else 'error')
+
+        with reload_condition:
+            reload_state['completed'] = target
+            reload_state['success'] = success
+            reload_condition.notify_all()
+
+
+def wait_reload(ticket, timeout):
+    """Espera a que termine la recarga número ticket; retorna (terminó, éxito)"""
+    with reload_condition:
+        done = reload_condition.wait_for(lambda: reload_state['completed'] >= ticket, timeout)
+        return done, reload_state['success'] if done else None
+
+
+def start_gallery_watcher():
+    """Recarga la galería sola cuando cambian los archivos de public/trained-faces/"""
+    global gallery_watcher
+    if GALLERY_WATCH_INTERVAL <= 0 or gallery_watcher is not None or cluster is not None:
+        return  # Con face_server.py el supervisor revisa los archivos por todos los workers
+    gallery_watcher = StoreWatcher(schedule_reload, STORE_FILE, EMBEDDINGS_FILE, GALLERY_WATCH_INTERVAL)
+    gallery_watcher.start()
+    print(f"👀 Recarga automática: revisando {STORE_FILE.parent} cada {GALLERY_WATCH_INTERVAL:g}s")
+
+
+def current_gallery():
+    """
+    Galería del request actual: se toma una sola vez al empezar el request, así
+    todo el request usa la misma versión aunque se publique otra mientras tanto
+    """
+    if has_request_context() and 'gallery' in g:
+        return g.gallery
+    return gallery
+
+
+def gallery_version():
+    snapshot = current_gallery()
+    return snapshot.version if snapshot is not None else None
+
+
+def maybe_compact():
+    """Compacta el store en segundo plano si se acumularon muchos deltas"""
+    if cluster is not None:
+        return  # Con face_server.py compacta el supervisor al preparar cada recarga
+    if gallery is None or gallery.delta_seq - gallery.base_seq < DELTA_COMPACT_THRESHOLD:
+        return
+    if not compaction_lock.acquire(blocking=False):
+        return  # Ya hay una compactación en curso
+
+    def run():
+        try:
+            t0 = time.perf_counter()
+            compact_store(STORE_FILE)
+            print(f"🗜️  Store compactado en {time.perf_counter() - t0:.1f}s")
+        except Exception as e:
+            print(f"⚠️  Error compactando el store: {e}")
+        finally:
+            compaction_lock.release()
+
+    threading.Thread(target=run, name='compaction', daemon=True).start()
+
+
+def decode_image_bytes(buffer):
+    """
+    Decodifica una imagen (JPEG/PNG/...) directamente desde el buffer del request
+    Retorna un array BGR, el mismo orden de canales que usa DeepFace con cv2.imread
+    """
+    with metrics.stage('decode'):
+        img_array = cv2.imdecode(np.frombuffer(buffer, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img_array is None:
+        raise ValueError("Error convirtiendo imagen: formato no soportado o datos corruptos")
+    return img_array
+
+
 def base64_to_image(base64_string):
     """Convierte una imagen base64 a un array numpy"""
+    # Remover el prefijo data:image/...;base64, si existe
+    if ',' in base64_string:
+        base64_string = base64_string.split(',')[1]
+
     try:
-        # Remover el prefijo data:image/...;base64, si existe
-        if ',' in base64_string:
-            base64_string = base64_string.split(',')[1]
+        with metrics.stage('base64_decode'):
+            img_data = base64.b64decode(base64_string)
+    except Exception as e:
+        raise ValueError(f"Error convirtiendo imagen: {e}")
 
-        img_data = base64.b64decode(base64_string)
-        img = Image.open(BytesIO(img_data))
+    return decode_image_bytes(img_data)
 
-        # Convertir a RGB si es necesario
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
 
-        # Convertir a numpy array
-        img_array = np.array(img)
+def parse_image_request(fields):
+    """
+    Lee las imágenes de un request en cualquiera de los formatos soportados:
+    - Cuerpo binario (image/jpeg, image/png, application/octet-stream): una sola imagen,
+      parámetros en el query string
+    - multipart/form-data: un archivo por campo, parámetros en el formulario
+    - JSON con imágenes base64 (formato original)
+
+    Retorna (imágenes por campo, parámetros del request)
+    """
+    mimetype = request.mimetype
+
+    if mimetype in RAW_IMAGE_TYPES:
+        buffer = request.get_data(cache=False)
+        images = {fields[0]: decode_image_bytes(buffer)} if buffer else {}
+        return images, request.args.to_dict()
+
+    if mimetype == 'multipart/form-data':
+        images = {
+            field: decode_image_bytes(request.files[field].read())
+            for field in fields if field in request.files
+        }
+        params = request.args.to_dict()
+        params.update(request.form.to_dict())
+        return images, params
+
+    data = request.get_json(silent=True) or {}
+    images = {field: base64_to_image(data[field]) for field in fields if data.get(field)}
+    return images, data
+
+
+def recognition_result(candidates):
+    """Respuesta de /recognize para un rostro a partir de sus candidatos ordenados"""
+    best = candidates[0]
+    max_similarity = best['similarity']
+
+    # Decidir si es una persona de la galería
+    is_match = max_similarity > THRESHOLD
+
+    confidence = max_similarity * 100  # Convertir a porcentaje
+    snapshot = current_gallery()
+
+    return {
+        'success': True,
+        'face_detected': True,
+        'is_match': is_match,
+        'person_name': best['name'] if is_match else 'Desconocido',
+        'confidence': float(confidence),
+        'max_similarity': float(max_similarity),
+        'avg_similarity': float(best['avg_similarity']),
+        'threshold': THRESHOLD,
+        'candidates': candidates,
+        'details': {
+            'model': MODEL_NAME,
+            'num_comparisons': snapshot.num_embeddings,
+            'num_identities': snapshot.num_identities
+        }
+    }
+
+
+def parse_batch_request():
+    """
+    Lee las imágenes de /recognize_batch como lista de (id, imagen)
+    - JSON: {"images": [{"id": "cam1", "image": "<base64>"}, ...]}
+    - multipart/form-data: un archivo por imagen, el nombre del campo es el id
+
+    Las imágenes que no se pueden decodificar se retornan como la excepción
+    correspondiente para reportarlas sin abortar el lote completo
+    """
+    items = []
+
+    if request.mimetype == 'multipart/form-data':
+        for image_id, file in request.files.items(multi=True):
+            try:
+                items.append((image_id, decode_image_bytes(file.read())))
+            except ValueError as e:
+                items.append((image_id, e))
+        params = request.args.to_dict()
+        params.update(request.form.to_dict())
+        return items, params
+
+    data = request.get_json(silent=True) or {}
+    for i, entry in enumerate(data.get('images', [])):
+        image_id = str(entry.get('id', i))
+        try:
+            items.append((image_id, base64_to_image(entry.get('image', ''))))
+        except ValueError as e:
+            items.append((image_id, e))
+    return items, data
+
+
+def parse_bool(value):
+    """Interpreta un parámetro booleano de JSON, query string o formulario"""
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'si', 'sí')
+    return bool(value)
+
+
+def parse_top_k(data):
+    """Parámetro top_k (entero >= 1); ValueError si no es válido"""
+    value = data.get('top_k', TOP_K)
+    try:
+        top_k = int(value)
+    except (TypeError, ValueError):
+        top_k = 0
+    if top_k < 1 or isinstance(value, bool):
+        raise ValueError(f'top_k inválido: {value} (entero mayor o igual a 1)')
+    return top_k
+
+
+def serialize_facial_area(facial_area):
+    """facial_area de DeepFace en formato JSON (enteros nativos)"""
+    area = {key: int(facial_area[key]) for key in ('x', 'y', 'w', 'h')}
+    for eye in ('left_eye', 'right_eye'):
+        if facial_area.get(eye) is not None:
+            area[eye] = [int(v) for v in facial_area[eye]]
+    return area
+
+
+def select_faces(face_objs, max_faces, min_size):
+    """Rostros de al menos min_size píxeles, los más grandes primero, hasta max_faces"""
+    faces = [
+        obj for obj in face_objs
+        if min(obj['facial_area']['w'], obj['facial_area']['h']) >= min_size
+    ]
+    faces.sort(key=lambda obj: obj['facial_area']['w'] * obj['facial_area']['h'], reverse=True)
+    return faces[:max_faces]
+
+
+def find_faces(img_array, multi_face=False, camera_id=None):
+    """
+    Rostros a reconocer en un frame (formato extract_faces)
+    camera_id selecciona la región de interés de la cámara, si tiene una
+    Si no hay rostros retorna la excepción en lugar de lanzarla
+    """
+    try:
+        # Detección en la copia reducida, alineación y recorte a resolución completa
+        with metrics.stage('detection'):
+            face_objs = preprocessor.detect(img_array, camera_id, align=True)
+    except ValueError as e:
+        return e
+
+    if not multi_face:
+        # Comportamiento original: solo el primer rostro detectado
+        return face_objs[:1]
+
+    faces = select_faces(face_objs, MAX_FACES_PER_FRAME, MIN_FACE_SIZE)
+    if not faces:
+        return ValueError(f'Ningún rostro alcanza el tamaño mínimo de {MIN_FACE_SIZE}px')
+    return faces
+
+
+def parse_boxes(data, img_array):
+    """
+    Cajas de rostro enviadas por el cliente, o None si hay que detectar
+    - "box": {"x", "y", "w", "h"} (o [x, y, w, h]), opcionalmente con "left_eye" y "right_eye"
+    - "boxes": lista de cajas
+    - "face_crop": true si la imagen ya es el recorte del rostro
+    En formularios y query string las cajas van como JSON
+    """
+    boxes = data.get('boxes', data.get('box'))
+    if isinstance(boxes, str):
+        boxes = json.loads(boxes)
+
+    if boxes is None:
+        if not parse_bool(data.get('face_crop', False)):
+            return None
+        height, width = img_array.shape[:2]
+        boxes = [{'x': 0, 'y': 0, 'w': width, 'h': height}]
+
+    if isinstance(boxes, dict) or (boxes and not isinstance(boxes[0], (dict, list))):
+        boxes = [boxes]
+    return [
+        box if isinstance(box, dict) else dict(zip(('x', 'y', 'w', 'h'), box))
+        for box in boxes
+    ]
+
+
+def faces_from_boxes(img_array, boxes, multi_face=False):
+    """
+    Igual que find_faces pero con las cajas del cliente: no se detecta,
+    solo se alinea cada caja (ver face_inference.align_box)
+    """
+    if not multi_face:
+        boxes = boxes[:1]
+    try:
+        with metrics.stage('alignment'):
+            face_objs = [align_box(img_array, box, DETECTOR_BACKEND, align=True) for box in boxes]
+    except (KeyError, TypeError, ValueError) as e:
+        return ValueError(f'Caja de rostro inválida: {e}')
+
+    if not face_objs:
+        return ValueError('No se proporcionaron cajas de rostro')
+    if not multi_face:
+        return face_objs
+
+    faces = select_faces(face_objs, MAX_FACES_PER_FRAME, MIN_FACE_SIZE)
+    if not faces:
+        return ValueError(f'Ningún rostro alcanza el tamaño mínimo de {MIN_FACE_SIZE}px')
+    return faces
+
+
+def image_key(img_array, multi_face, camera_id=None):
+    """Clave de embedding_cache para los rostros detectados en una imagen completa"""
+    if not embedding_cache.enabled:
+        return None
+    with metrics.stage('image_hash'):
+        image_hash = image_digest(img_array)
+    return image_hash, (multi_face, camera_id if camera_id in preprocessor.roi_masks else None)
+
+
+def remember_embeddings(flat, normalized, image_keys=None):
+    """
+    Guarda en embedding_cache los embeddings normalizados de los rostros de flat
+    (pares (frame, face_obj)); retorna el embedding_id de cada rostro
+    image_keys: clave de image_key por frame (o None) para indexar los rostros por imagen
+    """
+    rows_by_frame = {}
+    for row, (frame, _) in enumerate(flat):
+        rows_by_frame.setdefault(frame, []).append(row)
+
+    handles = [None] * len(flat)
+    for frame, rows in rows_by_frame.items():
+        key = image_keys[frame] if image_keys else None
+        image_hash, params = key if key else (None, None)
+        areas = [serialize_facial_area(flat[row][1]['facial_area']) for row in rows]
+        for row, handle in zip(rows, embedding_cache.put(normalized[rows], areas, image_hash, params)):
+            handles[row] = handle
+    return handles
+
+
+def recognize_faces(detections, top_k=TOP_K, multi_face=False, image_keys=None):
+    """
+    Reconoce los rostros de varios frames a la vez
+    detections: resultado de find_faces para cada frame
+    image_keys: clave de image_key de cada frame (o None) para el cache de embeddings
+    Todos los rostros van en un solo lote del modelo y un solo producto
+    matriz-matriz contra la galería. Retorna un resultado por frame
+    """
+    flat = [
+        (frame, face_obj)
+        for frame, faces in enumerate(detections) if not isinstance(faces, Exception)
+        for face_obj in faces
+    ]
+
+    candidates, handles = [], []
+    if flat:
+        with metrics.stage('embedding'):
+            embeddings = get_embedder().embed([face_obj['face'] for _, face_obj in flat])
+        with metrics.stage('matching'):
+            candidates = current_gallery().search_batch(embeddings, top_k=top_k)
+        handles = remember_embeddings(flat, normalize_rows(embeddings), image_keys)
+
+    num_no_face = sum(isinstance(faces, Exception) for faces in detections)
+    metrics.inc('frames_total', len(detections))
+    metrics.inc('faces_detected_total', len(flat))
+    metrics.inc('no_face_frames_total', num_no_face)
+
+    per_frame = [[] for _ in detections]
+    for (frame, face_obj), face_candidates, handle in zip(flat, candidates, handles):
+        result = recognition_result(face_candidates)
+        result['facial_area'] = serialize_facial_area(face_obj['facial_area'])
+        result['face_confidence'] = float(face_obj['confidence'])
+        result['embedding_id'] = handle
+        per_frame[frame].append(result)
+
+    results = []
+    for faces, face_results in zip(detections, per_frame):
+        if isinstance(faces, Exception):
+            # No se detectó rostro
+            results.append({
+                'success': True,
+                'face_detected': False,
+                'message': str(faces)
+            })
+        elif multi_face:
+            # Campos principales del rostro más parecido + la lista de todos los rostros
+            best = max(face_results, key=lambda r: r['max_similarity'])
+            result = dict(best)
+            result['num_faces'] = len(face_results)
+            result['faces'] = face_results
+            results.append(result)
+        else:
+            results.append(face_results[0])
+    return results
+
+
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    g.gallery = gallery  # Versión fija para todo el request (ver current_gallery)
+    metrics.begin_request(collect_timings=parse_bool(request.args.get('timings', False)))
+
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.endpoint or 'unknown'
+    metrics.inc('requests_total', endpoint=endpoint, status=response.status_code)
+    if 'request_start' in g:
+        metrics.observe('request_seconds', time.perf_counter() - g.request_start, endpoint=endpoint)
+    version = gallery_version()
+    if version is not None:
+        response.headers['X-Gallery-Version'] = str(version)
+    if cluster is not None:
+        response.headers['X-Worker'] = str(cluster.worker_id)
+    return response
+
+
+def lookup_frame(img, params):
+    """
+    Busca en el cache un frame casi idéntico
+    Retorna (hash del frame, resultado cacheado o None); el hash es None si el cache está desactivado
+    """
+    if not frame_cache.enabled:
+        return None, None
+    with metrics.stage('frame_hash'):
+        frame_hash = dhash(img)
+    # Los resultados solo valen para la versión de la galería que los produjo
+    cached = frame_cache.get(frame_hash, (gallery_version(), params))
+    metrics.inc('frame_cache_total', result='hit' if cached is not None else 'miss')
+    if cached is None:
+        return frame_hash, None
+    return frame_hash, dict(cached, cached=True)
 
-        return img_array
-    except Exception as e:
-        raise ValueError(f"Error convirtiendo imagen: {e}")
 
+def store_frame(frame_hash, result, params):
+    """Guarda una copia del resultado de un frame (los endpoints luego le agregan campos)"""
+    if frame_hash is not None:
+        frame_cache.put(frame_hash, dict(result), (gallery_version(), params))
 
-def compare_embeddings(embedding1, embedding2):
-    """Calcula la similitud entre dos embeddings usando distancia coseno"""
-    similarity = 1 - cosine(embedding1, embedding2)
-    return similarity
+
+def timed_response(result, data):
+    """
+    jsonify midiendo la serialización; agrega la versión de la galería usada
+    y los tiempos por etapa si se pidieron
+    """
+    result['gallery_version'] = gallery_version()
+    if parse_bool(data.get('timings', False)) or parse_bool(request.args.get('timings', False)):
+        timings = metrics.timings()
+        if timings is not None:
+            result['timings'] = timings
+    with metrics.stage('serialization'):
+        return jsonify(result)
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Métricas en formato de texto Prometheus"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 
 @app.route('/health', methods=['GET'])
 def health():
-    """Endpoint de salud"""
+    """
+    Endpoint de salud
+    status indica que el proceso está vivo; ready, que ya puede reconocer
+    """
+    snapshot = current_gallery()
     return jsonify({
         'status': 'ok',
+        'ready': startup['state'] == 'ready',
+        'state': startup['state'],
+        'startup': startup,
         'model': MODEL_NAME,
         'detector': DETECTOR_BACKEND,
-        'embeddings_loaded': trained_embeddings is not None,
-        'person': person_name if person_name else None
+        'embeddings_loaded': snapshot is not None,
+        'gallery_version': gallery_version(),
+        'person': ', '.join(snapshot.names) if snapshot else None,
+        'num_identities': snapshot.num_identities if snapshot else 0
     })
 
 
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness para supervisores/balanceadores: 200 solo cuando el modelo está listo"""
+    is_ready = startup['state'] == 'ready'
+    return jsonify({'ready': is_ready, 'state': startup['state']}), (200 if is_ready else 503)
+
+
 @app.route('/recognize', methods=['POST'])
+@require_ready
 def recognize():
     """
     Endpoint principal para reconocimiento facial
-    Recibe una imagen en base64 y retorna si es la persona entrenada
+    Recibe una imagen (JPEG binario, multipart o base64 en JSON) y retorna
+    los candidatos más parecidos de la galería.
+    Con multi_face=true reconoce todos los rostros del frame.
+    Con "box"/"boxes" o "face_crop" no se detecta: solo se alinean las cajas dadas.
+    Con "camera_id" se detecta solo dentro de la región de interés de esa cámara
     """
     try:
         # Verificar que hay embeddings cargados
-        if trained_embeddings is None:
+        if current_gallery() is None:
             return jsonify({
                 'success': False,
                 'error': 'No hay embeddings entrenados cargados',
@@ -113,144 +822,540 @@ def recognize():
             }), 400
 
         # Obtener imagen del request
-        data = request.get_json()
+        images, data = parse_image_request(['image'])
 
-        if not data or 'image' not in data:
+        if 'image' not in images:
             return jsonify({
                 'success': False,
                 'error': 'No se proporcionó imagen'
             }), 400
 
-        # Convertir base64 a imagen
-        img_array = base64_to_image(data['image'])
+        try:
+            top_k = parse_top_k(data)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        multi_face = parse_bool(data.get('multi_face', False))
 
-        # Extraer embedding de la imagen
         try:
-            embedding_objs = DeepFace.represent(
-                img_path=img_array,
-                model_name=MODEL_NAME,
-                detector_backend=DETECTOR_BACKEND,
-                enforce_detection=True,
-                align=True
-            )
-
-            if not embedding_objs:
-                return jsonify({
-                    'success': True,
-                    'face_detected': False,
-                    'message': 'No se detectó ningún rostro'
-                })
+            boxes = parse_boxes(data, images['image'])
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': f'Cajas de rostro inválidas: {e}'
+            }), 400
 
-            # Tomar el primer rostro detectado
-            test_embedding = np.array(embedding_objs[0]['embedding'])
+        camera_id = data.get('camera_id')
 
-            # Comparar con todos los embeddings entrenados
-            similarities = []
-            for trained_emb in trained_embeddings:
-                similarity = compare_embeddings(test_embedding, trained_emb)
-                similarities.append(similarity)
+        # Un frame casi idéntico a uno reciente reutiliza su resultado
+        params = (top_k, multi_face, json.dumps(boxes, sort_keys=True) if boxes else None, camera_id)
+        frame_hash, result = lookup_frame(images['image'], params)
+        if result is not None:
+            return timed_response(result, data)
 
-            # Tomar la mejor similitud
-            max_similarity = max(similarities)
-            avg_similarity = np.mean(similarities)
+        # Detectar (o alinear las cajas del cliente), extraer embeddings y comparar contra toda la galería
+        if boxes is None:
+            detection = find_faces(images['image'], multi_face, camera_id)
+            key = image_key(images['image'], multi_face, camera_id)
+        else:
+            detection = faces_from_boxes(images['image'], boxes, multi_face)
+            key = None
+        result = recognize_faces([detection], top_k, multi_face, [key])[0]
+        store_frame(frame_hash, result, params)
 
-            # Decidir si es la persona entrenada
-            is_match = max_similarity > THRESHOLD
+        return timed_response(result, data)
 
-            confidence = max_similarity * 100  # Convertir a porcentaje
+    except Exception as e:
+        metrics.inc('errors_total', endpoint='recognize')
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
 
+
+@app.route('/recognize_batch', methods=['POST'])
+@require_ready
+def recognize_batch():
+    """
+    Reconocimiento de varias imágenes (varios frames o cámaras) en un solo request
+    Detecta en paralelo, calcula todos los embeddings en una sola pasada del modelo
+    y compara contra la galería con un producto matriz-matriz.
+    Retorna un resultado por imagen con el mismo formato que /recognize
+    """
+    try:
+        if current_gallery() is None:
             return jsonify({
-                'success': True,
-                'face_detected': True,
-                'is_match': is_match,
-                'person_name': person_name if is_match else 'Desconocido',
-                'confidence': float(confidence),
-                'max_similarity': float(max_similarity),
-                'avg_similarity': float(avg_similarity),
-                'threshold': THRESHOLD,
-                'details': {
-                    'model': MODEL_NAME,
-                    'num_comparisons': len(similarities)
-                }
-            })
+                'success': False,
+                'error': 'No hay embeddings entrenados cargados',
+                'message': 'Ejecuta train_model_python.py primero'
+            }), 400
 
-        except ValueError as e:
-            # No se detectó rostro
+        items, data = parse_batch_request()
+
+        if not items:
             return jsonify({
-                'success': True,
-                'face_detected': False,
-                'message': str(e)
-            })
+                'success': False,
+                'error': 'No se proporcionaron imágenes'
+            }), 400
+
+        if len(items) > BATCH_MAX_IMAGES:
+            return jsonify({
+                'success': False,
+                'error': f'Máximo {BATCH_MAX_IMAGES} imágenes por request'
+            }), 400
+
+        try:
+            top_k = parse_top_k(data)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        multi_face = parse_bool(data.get('multi_face', False))
+
+        # Frames casi idénticos a uno reciente reutilizan su resultado
+        # (el id es la cámara: las que tienen región de interés no comparten resultados)
+        params = {
+            i: (top_k, multi_face, image_id if image_id in preprocessor.roi_masks else None)
+            for i, (image_id, _) in enumerate(items)
+        }
+        recognized, hashes = {}, {}
+        for i, (_, img) in enumerate(items):
+            if not isinstance(img, Exception):
+                hashes[i], cached = lookup_frame(img, params[i])
+                if cached is not None:
+                    recognized[i] = cached
+        decoded = [i for i in hashes if i not in recognized]
+
+        # Detección de todas las imágenes en el pool (serializada por DETECTOR_LOCK);
+        # metrics.bind suma la etapa a los tiempos de este request
+        detections = list(detection_pool.map(
+            metrics.bind(lambda i: find_faces(items[i][1], multi_face, items[i][0])), decoded
+        ))
+
+        # Un solo lote de embeddings y un solo producto matriz-matriz contra la galería
+        keys = [image_key(items[i][1], multi_face, items[i][0]) for i in decoded]
+        for i, result in zip(decoded, recognize_faces(detections, top_k, multi_face, keys)):
+            store_frame(hashes[i], result, params[i])
+            recognized[i] = result
+
+        results = []
+        for i, (image_id, img) in enumerate(items):
+            if isinstance(img, Exception):
+                result = {'success': False, 'error': str(img)}
+            else:
+                result = recognized[i]
+            result['id'] = image_id
+            results.append(result)
+
+        return timed_response({
+            'success': True,
+            'num_images': len(items),
+            'num_faces': sum(r.get('num_faces', int(r.get('face_detected', False))) for r in results),
+            'results': results
+        }, data)
 
     except Exception as e:
+        metrics.inc('errors_total', endpoint='recognize_batch')
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
 
+def parse_operand(operand):
+    """Operando JSON de /verify N a M: decodifica la imagen base64 si la trae"""
+    if not isinstance(operand, dict):
+        raise ValueError('Cada operando debe ser un objeto con image, embedding_id o identity')
+    if operand.get('image'):
+        return dict(operand, image=base64_to_image(operand['image']))
+    return operand
+
+
+def operand_embeddings(operands):
+    """
+    Resuelve los operandos de /verify a filas normalizadas (una o más por operando)
+    - {"image": array}: todos los rostros de la imagen (desde el cache si ya se procesó)
+    - {"embedding_id": "..."}: un embedding devuelto antes por /recognize o /verify
+    - {"identity": "Nombre", "index": n}: embeddings guardados de la galería (index opcional)
+    Las imágenes nuevas se detectan en el pool y pasan juntas por el modelo en un solo lote.
+    Retorna [(filas (k, d), descripción)] en el orden de operands
+    """
+    resolved = [None] * len(operands)
+    pending = []  # (operando, imagen, clave del cache)
+
+    for i, operand in enumerate(operands):
+        if operand.get('image') is not None:
+            key = image_key(operand['image'], multi_face=True)
+            cached = embedding_cache.get_image(*key) if key else None
+            if key:
+                metrics.inc('embedding_cache_total', result='hit' if cached else 'miss')
+            if cached:
+                resolved[i] = (np.stack([embedding for _, embedding, _ in cached]), {
+                    'source': 'image',
+                    'cached': True,
+                    'embedding_ids': [handle for handle, _, _ in cached],
+                    'facial_areas': [area for _, _, area in cached]
+                })
+            else:
+                pending.append((i, operand['image'], key))
+
+        elif operand.get('embedding_id'):
+            entry = embedding_cache.get(str(operand['embedding_id']))
+            if entry is None:
+                raise KeyError(f"embedding_id desconocido o expirado: {operand['embedding_id']}")
+            resolved[i] = (entry[0][None], {
+                'source': 'embedding_id',
+                'embedding_ids': [str(operand['embedding_id'])],
+                'facial_areas': [entry[1]]
+            })
+
+        elif operand.get('identity'):
+            snapshot = current_gallery()
+            if snapshot is None:
+                raise KeyError('No hay embeddings entrenados cargados')
+            index = operand.get('index')
+            rows = snapshot.identity_embeddings(str(operand['identity']), None if index is None else int(index))
+            resolved[i] = (rows, {
+                'source': 'identity',
+                'identity': str(operand['identity']),
+                'num_embeddings': len(rows)
+            })
+
+        else:
+            raise ValueError('Cada operando necesita image, embedding_id o identity')
+
+    if pending:
+        # Detección de todas las imágenes en el pool (serializada por DETECTOR_LOCK)
+        detections = list(detection_pool.map(
+            metrics.bind(lambda item: find_faces(item[1], multi_face=True)), pending
+        ))
+        for (i, _, _), detection in zip(pending, detections):
+            if isinstance(detection, Exception):
+                raise ValueError(f'Operando {i}: {detection}')
+
+        flat = [(k, face_obj) for k, faces in enumerate(detections) for face_obj in faces]
+        with metrics.stage('embedding'):
+            normalized = normalize_rows(get_embedder().embed([face_obj['face'] for _, face_obj in flat]))
+        handles = remember_embeddings(flat, normalized, [key for _, _, key in pending])
+
+        for k, (i, _, _) in enumerate(pending):
+            rows = [row for row, (frame, _) in enumerate(flat) if frame == k]
+            resolved[i] = (normalized[rows], {
+                'source': 'image',
+                'cached': False,
+                'embedding_ids': [handles[row] for row in rows],
+                'facial_areas': [serialize_facial_area(flat[row][1]['facial_area']) for row in rows]
+            })
+
+    return resolved
+
+
+def similarity_matrix(probes, references):
+    """
+    Similitud coseno entre cada par de operandos resueltos, con un solo producto
+    matriz-matriz; para operandos con varias filas se toma el par más parecido
+    (igual que DeepFace.verify con varios rostros y la galería con varios embeddings)
+    """
+    with metrics.stage('matching'):
+        scores = np.vstack([rows for rows, _ in probes]) @ np.vstack([rows for rows, _ in references]).T
+        probe_offsets = np.cumsum([0] + [len(rows) for rows, _ in probes[:-1]])
+        reference_offsets = np.cumsum([0] + [len(rows) for rows, _ in references[:-1]])
+        scores = np.maximum.reduceat(scores, probe_offsets, axis=0)
+        return np.maximum.reduceat(scores, reference_offsets, axis=1)
+
+
 @app.route('/verify', methods=['POST'])
+@require_ready
 def verify():
     """
-    Verifica dos imágenes si son de la misma persona
-    Útil para testing y comparaciones
+    Verifica si dos rostros son de la misma persona
+    Cada lado puede ser una imagen (image1/image2), un embedding_id devuelto por
+    /recognize (embedding_id1/embedding_id2) o una identidad de la galería
+    (identity1/identity2, con embedding_index1/embedding_index2 opcional).
+    Con "probes" y "references" (JSON) compara N contra M y retorna la matriz completa
     """
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True) if request.mimetype == 'application/json' else None
+        if isinstance(data, dict) and ('probes' in data or 'references' in data):
+            return verify_many(data)
+
+        images, data = parse_image_request(['image1', 'image2'])
+        operands = []
+        for side in ('1', '2'):
+            if f'image{side}' in images:
+                operands.append({'image': images[f'image{side}']})
+            elif data.get(f'embedding_id{side}'):
+                operands.append({'embedding_id': data[f'embedding_id{side}']})
+            elif data.get(f'identity{side}'):
+                operands.append({'identity': data[f'identity{side}'], 'index': data.get(f'embedding_index{side}')})
+            else:
+                return jsonify({
+                    'success': False,
+                    'error': 'Se requieren dos imágenes (o embedding_id / identity para cada lado)'
+                }), 400
+
+        resolved = operand_embeddings(operands)
+        similarity = float(similarity_matrix(resolved[:1], resolved[1:])[0, 0])
+        distance = 1.0 - similarity
+
+        return timed_response({
+            'success': True,
+            'verified': distance <= VERIFY_DISTANCE_THRESHOLD,
+            'distance': distance,
+            'similarity': similarity,
+            'threshold': VERIFY_DISTANCE_THRESHOLD,
+            'model': MODEL_NAME,
+            'operands': [description for _, description in resolved]
+        }, data)
+
+    except KeyError as e:
+        return jsonify({
+            'success': False,
+            'error': e.args[0] if e.args else str(e)
+        }), 404
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        metrics.inc('errors_total', endpoint='verify')
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
+def verify_many(data):
+    """/verify N a M: matriz de similitudes entre probes y references"""
+    probes = [parse_operand(operand) for operand in data.get('probes') or []]
+    references = [parse_operand(operand) for operand in data.get('references') or []]
+    if not probes or not references:
+        raise ValueError('Se requieren probes y references con al menos un operando cada uno')
+    if len(probes) > VERIFY_MAX_OPERANDS or len(references) > VERIFY_MAX_OPERANDS:
+        raise ValueError(f'Máximo {VERIFY_MAX_OPERANDS} operandos por lado')
+
+    resolved = operand_embeddings(probes + references)
+    similarity = similarity_matrix(resolved[:len(probes)], resolved[len(probes):])
+    distance = 1.0 - similarity
+
+    return timed_response({
+        'success': True,
+        'similarity': similarity.tolist(),
+        'distance': distance.tolist(),
+        'verified': (distance <= VERIFY_DISTANCE_THRESHOLD).tolist(),
+        'threshold': VERIFY_DISTANCE_THRESHOLD,
+        'distance_metric': 'cosine',
+        'model': MODEL_NAME,
+        'probes': [description for _, description in resolved[:len(probes)]],
+        'references': [description for _, description in resolved[len(probes):]]
+    }, data)
+
+
+def process_stream_frame(session, img, top_k):
+    """
+    Procesa un frame de una sesión de streaming
+    Detecta todos los rostros, los asocia a los tracks de la sesión y solo
+    calcula embeddings para tracks nuevos o que necesitan confirmación
+    """
+    now = time.monotonic()
+    detection = find_faces(img, multi_face=True, camera_id=session.camera_id)
+    faces = [] if isinstance(detection, Exception) else detection
+    assignments = session.tracker.update([face['facial_area'] for face in faces], now)
+
+    pending = [(track, face) for (track, needs), face in zip(assignments, faces) if needs]
+    if pending:
+        with metrics.stage('embedding'):
+            embeddings = get_embedder().embed([face['face'] for _, face in pending])
+        with metrics.stage('matching'):
+            candidates = current_gallery().search_batch(embeddings, top_k=top_k)
+        for (track, _), track_candidates in zip(pending, candidates):
+            metrics.inc('stream_embeddings_total', reason='new' if track.embeddings == 0 else 'refresh')
+            track.result = recognition_result(track_candidates)
+            track.last_embedded = now
+            track.embeddings += 1
+        session.embeddings += len(pending)
+
+    metrics.inc('frames_total')
+    metrics.inc('faces_detected_total', len(faces))
+    tracks = []
+    for (track, needs), face in zip(assignments, faces):
+        result = dict(track.result)
+        result.pop('details', None)
+        result.update({
+            'track_id': track.id,
+            'facial_area': serialize_facial_area(face['facial_area']),
+            'face_confidence': float(face['confidence']),
+            'embedded': needs,
+            'track_frames': track.frames,
+            'track_seconds': round(now - track.first_seen, 2)
+        })
+        tracks.append(result)
+
+    return {
+        'success': True,
+        'camera_id': session.camera_id,
+        'gallery_version': gallery_version(),
+        'face_detected': bool(tracks),
+        'num_faces': len(tracks),
+        'embedded': len(pending),
+        'tracks': tracks
+    }
+
 
-        if not data or 'image1' not in data or 'image2' not in data:
+@app.route('/stream/<camera_id>/frame', methods=['POST'])
+@require_ready
+def stream_frame(camera_id):
+    """
+    Frame de una sesión de streaming (la sesión se crea con el primer frame)
+    Si la sesión todavía procesa el frame anterior, este se descarta y se
+    responde de inmediato con el último resultado ("dropped": true)
+    """
+    try:
+        if current_gallery() is None:
             return jsonify({
                 'success': False,
-                'error': 'Se requieren dos imágenes'
+                'error': 'No hay embeddings entrenados cargados',
+                'message': 'Ejecuta train_model_python.py primero'
             }), 400
 
-        img1 = base64_to_image(data['image1'])
-        img2 = base64_to_image(data['image2'])
+        try:
+            session = stream_sessions.get(camera_id)
+        except RuntimeError as e:
+            return jsonify({'success': False, 'error': str(e)}), 429
+        session.frames_received += 1
 
-        result = DeepFace.verify(
-            img1_path=img1,
-            img2_path=img2,
-            model_name=MODEL_NAME,
-            detector_backend=DETECTOR_BACKEND,
-            enforce_detection=True
-        )
+        if not session.busy.acquire(blocking=False):
+            session.frames_dropped += 1
+            metrics.inc('stream_frames_total', result='dropped')
+            result = dict(session.last_result or {'success': True, 'camera_id': camera_id, 'tracks': []})
+            result.update({'dropped': True, 'frame': session.sequence})
+            return jsonify(result)
 
-        return jsonify({
-            'success': True,
-            'verified': result['verified'],
-            'distance': result['distance'],
-            'threshold': result['threshold'],
-            'model': result['model']
-        })
+        try:
+            images, data = parse_image_request(['image'])
+            if 'image' not in images:
+                return jsonify({
+                    'success': False,
+                    'error': 'No se proporcionó imagen'
+                }), 400
+            try:
+                top_k = parse_top_k(data)
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
+
+            result = process_stream_frame(session, images['image'], top_k)
+            session.publish(result)
+            metrics.inc('stream_frames_total', result='processed')
+        finally:
+            session.busy.release()
+
+        return timed_response(dict(result, dropped=False, frame=session.sequence), data)
 
     except Exception as e:
+        metrics.inc('errors_total', endpoint='stream_frame')
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
 
+@app.route('/stream/<camera_id>/events', methods=['GET'])
+def stream_events(camera_id):
+    """
+    Resultados de una sesión como NDJSON con transferencia chunked: una línea
+    por frame procesado, hasta que la sesión se cierra o pasa `timeout` segundos
+    """
+    session = stream_sessions.get(camera_id, create=False)
+    if session is None:
+        return jsonify({'success': False, 'error': f'No hay sesión para la cámara {camera_id}'}), 404
+    try:
+        timeout = float(request.args.get('timeout', STREAM_SESSION_TTL))
+        if not np.isfinite(timeout) or timeout < 0:
+            raise ValueError(timeout)
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'error': f"timeout inválido: {request.args.get('timeout')} (segundos, número no negativo)"
+        }), 400
+
+    def generate():
+        deadline = time.monotonic() + timeout
+        sequence = session.sequence
+        while not session.closed and time.monotonic() < deadline:
+            new_sequence, result = session.wait(sequence, min(1.0, deadline - time.monotonic()))
+            if new_sequence > sequence and result is not None:
+                sequence = new_sequence
+                yield json.dumps(dict(result, frame=sequence), ensure_ascii=False) + '\n'
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+
+@app.route('/stream/<camera_id>', methods=['DELETE'])
+def close_stream(camera_id):
+    """Cierra la sesión de streaming de una cámara"""
+    return jsonify({'success': stream_sessions.remove(camera_id)})
+
+
+@app.route('/stream', methods=['GET'])
+def list_streams():
+    """Sesiones de streaming activas con sus contadores"""
+    return jsonify({'sessions': stream_sessions.stats()})
+
+
 @app.route('/reload', methods=['POST'])
 def reload_embeddings():
-    """Recarga los embeddings desde el archivo"""
-    success = load_trained_embeddings()
+    """
+    Recarga los embeddings en segundo plano (responde 202 de inmediato)
+    Por defecto solo aplica los deltas nuevos (enrolamiento incremental);
+    con ?full=true relee la galería completa y con ?wait=true espera a que
+    la nueva versión esté publicada.
+
+    Con face_server.py la recarga es de todos los workers: cada worker aplica
+    los deltas sobre la base compartida (con ?full=true el supervisor los
+    compacta antes y cada worker abre la nueva base con memory-map);
+    ?wait=true espera a que la hayan publicado todos.
+    """
+    full = parse_bool(request.args.get('full', False))
+    if cluster is not None:
+        ticket, wait_for = cluster.request_reload(full), cluster.wait_reload
+    else:
+        ticket, wait_for = schedule_reload(full), wait_reload
+
+    if not parse_bool(request.args.get('wait', False)):
+        return jsonify({
+            'success': True,
+            'message': 'Recarga programada',
+            'gallery_version': gallery_version()
+        }), 202
+
+    done, success = wait_for(ticket, RELOAD_WAIT_TIMEOUT)
+    snapshot = gallery  # La versión recién publicada, no la que tomó este request
+    if not done:
+        return jsonify({
+            'success': True,
+            'message': f'La recarga sigue en curso después de {RELOAD_WAIT_TIMEOUT:g}s',
+            'gallery_version': gallery_version()
+        }), 202
 
     if success:
         return jsonify({
             'success': True,
-            'message': f'Embeddings de {person_name} recargados correctamente'
+            'message': f'Galería recargada: {snapshot.num_identities} identidades',
+            'gallery_version': snapshot.version,
+            'delta_seq': snapshot.delta_seq,
+            'pending_deltas': snapshot.delta_seq - snapshot.base_seq
         })
     else:
         return jsonify({
             'success': False,
-            'error': 'No se pudieron cargar los embeddings'
+            'error': 'No se pudieron cargar los embeddings',
+            'gallery_version': gallery_version()
         }), 500
 
 
 @app.route('/info', methods=['GET'])
 def info():
     """Información sobre el modelo y embeddings cargados"""
-    if trained_embeddings is None:
+    snapshot = current_gallery()
+    if snapshot is None:
         return jsonify({
             'loaded': False,
             'message': 'No hay embeddings cargados'
@@ -258,13 +1363,40 @@ def info():
 
     return jsonify({
         'loaded': True,
-        'person_name': person_name,
-        'num_embeddings': len(trained_embeddings),
-        'embedding_dimension': len(trained_embeddings[0]),
+        'person_name': ', '.join(snapshot.names),
+        'num_identities': snapshot.num_identities,
+        'gallery_version': snapshot.version,
+        'identities': snapshot.describe(),
+        'num_embeddings': snapshot.num_embeddings,
+        'embedding_dimension': snapshot.dimension,
         'model': MODEL_NAME,
+        'inference': {
+            'backend': embedder.embedder.backend.name if embedder is not None else INFERENCE_BACKEND,
+            'configured_backend': INFERENCE_BACKEND,
+            'parity': embedder.embedder.parity if embedder is not None else None,
+            'batch_sizes': list(batch_buckets(BATCH_MAX_SIZE)),
+            'intra_threads': INFERENCE_THREADS,
+            'inter_threads': INFERENCE_INTER_THREADS
+        },
         'detector': DETECTOR_BACKEND,
+        'detection_max_side': DETECTION_MAX_SIDE,
+        'roi_cameras': sorted(preprocessor.roi_masks),
         'threshold': THRESHOLD,
-        'embeddings_file': str(EMBEDDINGS_FILE)
+        'top_k': TOP_K,
+        'index': {'nlist': snapshot.index.nlist, 'nprobe': snapshot.nprobe} if snapshot.index else None,
+        'precision': {
+            'matrix': snapshot.quantized.precision,
+            'matrix_mb': round(snapshot.quantized.nbytes / 2**20, 1),
+            'rerank': snapshot.rerank
+        } if snapshot.quantized else {'matrix': 'float32', 'matrix_mb': round(snapshot.nbytes / 2**20, 1)},
+        'prototypes': dict(snapshot.prototypes.stats(), margin=snapshot.prototype_margin)
+        if snapshot.prototypes else None,
+        'stale_accelerators': stale_accelerators,
+        'overlay_identities': snapshot.num_identities - len(snapshot.live),
+        'frame_cache': frame_cache.stats(),
+        'embedding_cache': embedding_cache.stats(),
+        'workers': cluster.stats() if cluster is not None else None,
+        'embeddings_file': str(STORE_FILE)
     })
 
 
@@ -275,27 +1407,37 @@ if __name__ == '__main__':
     print(f"\nModelo: {MODEL_NAME}")
     print(f"Detector: {DETECTOR_BACKEND}")
     print(f"Umbral de similitud: {THRESHOLD}")
-    print(f"Archivo de embeddings: {EMBEDDINGS_FILE}")
+    print(f"Candidatos por rostro: {TOP_K}")
+    print(f"Micro-batching: hasta {BATCH_MAX_SIZE} rostros / {BATCH_MAX_WAIT_MS} ms")
+    print(f"Backend de inferencia: {INFERENCE_BACKEND} (lotes de {', '.join(map(str, batch_buckets(BATCH_MAX_SIZE)))})")
+    print(f"Archivo de embeddings: {STORE_FILE}")
     print()
 
-    # Cargar embeddings al iniciar
-    load_trained_embeddings()
+    # Cargar galería y preparar el modelo en segundo plano: /health responde
+    # de inmediato y /ready pasa a 200 cuando termina el warm-up
+    threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
 
     print("\n" + "="*70)
     print("✅ Servidor Flask iniciado")
     print("="*70)
     print("\nEndpoints disponibles:")
-    print("  GET  /health     - Estado del servidor")
+    print("  GET  /health     - Estado del servidor (liveness + readiness)")
+    print("  GET  /ready      - 200 cuando el modelo está listo, 503 mientras tanto")
     print("  GET  /info       - Información de embeddings cargados")
+    print("  GET  /metrics    - Métricas por etapa (formato Prometheus)")
     print("  POST /recognize  - Reconocer rostro en imagen")
+    print("  POST /recognize_batch - Reconocer varias imágenes en un request")
     print("  POST /verify     - Verificar dos imágenes")
     print("  POST /reload     - Recargar embeddings")
+    print("  POST /stream/<camara>/frame  - Frame de una sesión con seguimiento de rostros")
+    print("  GET  /stream/<camara>/events - Resultados de la sesión (NDJSON)")
     print("\n" + "="*70)
 
-    # Iniciar servidor
+    # Iniciar servidor (sin el reloader de Flask: duplicaría el proceso y el warm-up)
     app.run(
         host='0.0.0.0',
         port=5000,
         debug=True,
-        threaded=True
+        threaded=True,
+        use_reloader=False
     )
@@ -0,0 +1,524 @@
+#!/usr/bin/env python3
+"""
+Búsqueda offline de la lista de requisitoriados en grabaciones de CCTV
+Recorre videos (y carpetas de imágenes) con el mismo modelo, detector y
+galería que face_recognition_api.py, sin pasar por HTTP. Las etapas corren
+en paralelo conectadas por colas acotadas:
+
+    decodificar → detectar → embeddings → matching → JSONL
+
+- Decodificación: cv2.VideoCapture muestrea --fps frames por segundo de
+  video (los demás solo se avanzan con grab(), sin decodificarlos) y
+  descarta los frames en que la escena no cambió (dHash, ver face_cache.py).
+- Detección: varios hilos (el detector se serializa con DETECTOR_LOCK, en
+  paralelo corren el resize y la alineación).
+- Embeddings: rostros de varios frames en un solo lote de Facenet512.
+- Cada coincidencia se escribe como una línea JSON con el archivo, el
+  frame, el tiempo dentro del video y la caja del rostro.
+
+El progreso se guarda junto al archivo de salida (<salida>.progress.json):
+si se interrumpe, al volver a ejecutar continúa desde el último frame
+completo de cada video sin duplicar coincidencias. Un archivo que cambió
+(tamaño o fecha de modificación) se vuelve a escanear desde el principio y
+sus coincidencias anteriores se descartan; uno que no se pudo abrir queda
+como fallido y se reintenta en la próxima ejecución.
+
+Uso:
+    python face_scan.py grabaciones/ --fps 2 --output coincidencias.jsonl
+    python face_scan.py camara1.mp4 camara2.mp4 --camera-id camara-1 --threshold 0.5
+    python face_scan.py grabaciones/ --no-resume
+"""
+
+import json
+import time
+import queue
+import argparse
+import threading
+import numpy as np
+import cv2
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from face_cache import dhash
+from face_gallery import normalize_rows
+from face_store import atomic_save_json
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mkv', '.mov', '.m4v', '.mpg', '.mpeg', '.ts', '.wmv', '.webm')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+QUEUE_SIZE = 32  # Elementos máximos entre dos etapas (acota la memoria de frames decodificados)
+EMBED_BATCH_FACES = 32  # Rostros por pasada del modelo
+SCENE_HASH_SIZE = 16  # dHash de 16×16 = 256 bits: detecta una persona que entra en un rincón del frame
+CHECKPOINT_INTERVAL = 5.0  # Segundos entre guardados del progreso
+REPORT_INTERVAL = 10.0  # Segundos entre reportes de fps por etapa
+DONE = object()  # Marca de fin de una cola
+
+
+def list_sources(paths: List[Path]) -> List[Path]:
+    """Videos e imágenes de los paths indicados (carpetas recorridas recursivamente, en orden)"""
+    sources = []
+    for path in paths:
+        if path.is_dir():
+            sources.extend(sorted(
+                p for p in path.rglob('*')
+                if p.is_file() and p.suffix.lower() in VIDEO_EXTENSIONS + IMAGE_EXTENSIONS
+            ))
+        elif path.exists():
+            sources.append(path)
+        else:
+            print(f"⚠️  No existe: {path}")
+    return sources
+
+
+def format_time(seconds: Optional[float]) -> Optional[str]:
+    if seconds is None:
+        return None
+    hours, rest = divmod(seconds, 3600)
+    minutes, rest = divmod(rest, 60)
+    return f"{int(hours):02d}:{int(minutes):02d}:{rest:06.3f}"
+
+
+class StageStats:
+    """Frames procesados y tiempo ocupado de una etapa (sumado entre sus hilos)"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.items = 0
+        self.busy = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, items: int, seconds: float) -> None:
+        with self.lock:
+            self.items += items
+            self.busy += seconds
+
+    def report(self, elapsed: float) -> Dict:
+        return {
+            'stage': self.name,
+            'frames': self.items,
+            'busy_s': round(self.busy, 2),
+            'fps': round(self.items / elapsed, 2) if elapsed > 0 else None,  # Throughput del pipeline
+            'fps_busy': round(self.items / self.busy, 2) if self.busy > 0 else None  # Capacidad de la etapa
+        }
+
+
+class ScanProgress:
+    """
+    Progreso por archivo, guardado como JSON junto a la salida
+
+    - size, mtime_ns: identifican la versión del archivo escaneada; si
+      cambian, el progreso del archivo vuelve a cero
+    - status: 'pending' (en curso o interrumpido), 'done' (recorrido
+      completo) o 'failed' (error de lectura, se reintenta)
+    - frame: último frame tal que todos los frames muestreados hasta él ya
+      están escritos (los hilos de detección terminan fuera de orden)
+    """
+
+    def __init__(self, path: Path, resume: bool = True):
+        self.path = path
+        self.sources: Dict[str, Dict] = {}
+        if resume and path.exists():
+            with open(path, 'r', encoding='utf-8') as f:
+                self.sources = json.load(f).get('sources', {})
+        self.pending: Dict[str, Dict] = {}  # En curso: seq → frame terminados fuera de orden
+        self.lock = threading.Lock()
+
+    def check(self, source: Path) -> Dict:
+        """Entrada del archivo; si es nuevo o cambió desde la ejecución anterior, empieza de cero"""
+        stat = source.stat()
+        with self.lock:
+            entry = self.sources.get(str(source))
+            if entry is None or entry.get('size') != stat.st_size or entry.get('mtime_ns') != stat.st_mtime_ns:
+                entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'frame': -1, 'status': 'pending'}
+                self.sources[str(source)] = entry
+            return entry
+
+    def start_frame(self, source: Path) -> Optional[int]:
+        """Primer frame a procesar de un archivo (None si ya está completo)"""
+        entry = self.check(source)
+        return None if entry['status'] == 'done' else entry['frame'] + 1
+
+    def begin(self, source: Path) -> None:
+        with self.lock:
+            self.sources[str(source)]['status'] = 'pending'
+            self.pending[str(source)] = {'next': 0, 'finished': {}, 'total': None, 'failed': False}
+
+    def finish_decoding(self, source: Path, total: int, failed: bool = False) -> None:
+        """La decodificación terminó (failed: por un error): total frames enviados al pipeline"""
+        with self.lock:
+            self.pending[str(source)]['total'] = total
+            self.pending[str(source)]['failed'] = failed
+            self._advance(str(source))
+
+    def complete(self, source: Path, seq: int, frame: int) -> None:
+        """El frame número seq de este recorrido (frame del archivo) ya está escrito"""
+        with self.lock:
+            self.pending[str(source)]['finished'][seq] = frame
+            self._advance(str(source))
+
+    def _advance(self, key: str) -> None:
+        state = self.pending[key]
+        while state['next'] in state['finished']:
+            self.sources[key]['frame'] = state['finished'].pop(state['next'])
+            state['next'] += 1
+        if state['total'] is not None and state['next'] >= state['total']:
+            self.sources[key]['status'] = 'failed' if state['failed'] else 'done'
+            del self.pending[key]
+
+    def hits_to_keep(self, hit: Dict) -> bool:
+        """Una coincidencia de una ejecución anterior sigue valiendo (su frame está confirmado)"""
+        entry = self.sources.get(hit.get('source'))
+        return entry is not None and (entry.get('status') == 'done' or hit['frame'] <= entry['frame'])
+
+    def failed(self) -> List[str]:
+        with self.lock:
+            return [key for key, entry in self.sources.items() if entry.get('status') == 'failed']
+
+    def save(self) -> None:
+        with self.lock:
+            data = {'sources': json.loads(json.dumps(self.sources))}
+        atomic_save_json(self.path, data)
+
+
+class Scanner:
+    """Pipeline de escaneo con una cola acotada entre cada par de etapas"""
+
+    def __init__(self, api, sources: List[Path], output: Path, sample_fps: float = 2.0,
+                 scene_threshold: int = 3, detect_workers: int = 2, threshold: float = None,
+                 camera_id: str = None, top_k: int = 3, resume: bool = True):
+        self.api = api
+        self.gallery = api.gallery
+        self.sources = sources
+        self.output = output
+        self.sample_fps = sample_fps
+        self.scene_threshold = scene_threshold
+        self.detect_workers = detect_workers
+        self.threshold = api.THRESHOLD if threshold is None else threshold
+        self.camera_id = camera_id
+        self.top_k = top_k
+        self.progress = ScanProgress(output.with_name(output.name + '.progress.json'), resume)
+
+        self.frames_queue = queue.Queue(QUEUE_SIZE)
+        self.faces_queue = queue.Queue(QUEUE_SIZE)
+        self.embedded_queue = queue.Queue(QUEUE_SIZE)
+        self.hits_queue = queue.Queue(QUEUE_SIZE)
+        self.stats = {name: StageStats(name) for name in ('decode', 'detect', 'embed', 'match')}
+        self.counters = {'sampled': 0, 'scene_skipped': 0, 'faces': 0, 'hits': 0, 'errors': 0}
+        self.counters_lock = threading.Lock()  # Los actualizan todas las etapas
+
+    def count(self, name: str, n: int = 1) -> None:
+        with self.counters_lock:
+            self.counters[name] += n
+
+    def prepare_embedder(self) -> None:
+        """
+        Antes de iniciar el pipeline: compara el backend de inferencia contra
+        keras como hace el warm-up de la API (si difiere, el escaneo usa keras)
+        """
+        model = self.api.get_embedder().embedder
+        if model.parity is None:
+            model.check_parity()
+
+    # --- Etapa 1: decodificación ---
+
+    def read_video(self, source: Path, start: int) -> Iterator[Tuple[int, Optional[float], np.ndarray]]:
+        """Frames muestreados (frame, segundos, imagen) de un video desde el frame start"""
+        capture = cv2.VideoCapture(str(source))
+        if not capture.isOpened():
+            raise ValueError(f"No se pudo abrir el video {source}")
+        try:
+            fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+            step = max(1, int(round(fps / self.sample_fps))) if self.sample_fps > 0 else 1
+            if start:
+                capture.set(cv2.CAP_PROP_POS_FRAMES, start)
+            frame = start
+            while True:
+                t0 = time.perf_counter()
+                if frame % step:
+                    ok = capture.grab()  # Avanzar sin decodificar la imagen
+                    img = None
+                else:
+                    ok, img = capture.read()
+                self.stats['decode'].add(0, time.perf_counter() - t0)
+                if not ok:
+                    return
+                if img is not None:
+                    yield frame, frame / fps, img
+                frame += 1
+        finally:
+            capture.release()
+
+    def read_image(self, source: Path, start: int) -> Iterator[Tuple[int, Optional[float], np.ndarray]]:
+        if start == 0:
+            t0 = time.perf_counter()
+            img = cv2.imread(str(source))
+            self.stats['decode'].add(0, time.perf_counter() - t0)
+            if img is None:
+                raise ValueError(f"No se pudo leer la imagen {source}")
+            yield 0, None, img
+
+    def decode(self) -> None:
+        try:
+            for source in self.sources:
+                try:
+                    start = self.progress.start_frame(source)
+                except OSError as e:
+                    self.count('errors')
+                    print(f"⚠️  {source}: {e}")
+                    continue
+                if start is None:
+                    print(f"⏭️  {source} (ya escaneado)")
+                    continue
+                if start:
+                    print(f"↪️  {source}: continuando desde el frame {start}")
+
+                self.progress.begin(source)
+                reader = self.read_image if source.suffix.lower() in IMAGE_EXTENSIONS else self.read_video
+                seq, last_hash, failed = 0, None, False
+                try:
+                    for frame, seconds, img in reader(source, start):
+                        t0 = time.perf_counter()
+                        self.count('sampled')
+                        frame_hash = dhash(img, SCENE_HASH_SIZE)
+                        changed = (last_hash is None or self.scene_threshold < 0
+                                   or bin(frame_hash ^ last_hash).count('1') > self.scene_threshold)
+                        self.stats['decode'].add(1, time.perf_counter() - t0)
+                        if not changed:
+                            self.count('scene_skipped')
+                            continue
+                        last_hash = frame_hash
+                        self.frames_queue.put((source, seq, frame, seconds, img))
+                        seq += 1
+                except Exception as e:
+                    self.count('errors')
+                    failed = True
+                    print(f"⚠️  {source}: {e}")
+                self.progress.finish_decoding(source, seq, failed)
+        finally:
+            for _ in range(self.detect_workers):
+                self.frames_queue.put(DONE)
+
+    # --- Etapa 2: detección ---
+
+    def detect(self) -> None:
+        while True:
+            item = self.frames_queue.get()
+            if item is DONE:
+                self.faces_queue.put(DONE)
+                return
+            source, seq, frame, seconds, img = item
+            t0 = time.perf_counter()
+            try:
+                faces = self.api.find_faces(img, multi_face=True, camera_id=self.camera_id)
+            except Exception as e:
+                self.count('errors')
+                print(f"⚠️  {source} frame {frame}: {e}")
+                faces = e
+            if isinstance(faces, Exception):
+                faces = []
+            self.stats['detect'].add(1, time.perf_counter() - t0)
+            self.faces_queue.put((source, seq, frame, seconds, faces))
+
+    # --- Etapa 3: embeddings ---
+
+    def embed(self) -> None:
+        embedder = self.api.get_embedder()
+        remaining = self.detect_workers
+        while remaining:
+            # Juntar frames hasta completar un lote de rostros o vaciar la cola
+            batch = []
+            num_faces = 0
+            while remaining and num_faces < EMBED_BATCH_FACES:
+                try:
+                    item = self.faces_queue.get(timeout=0.05) if batch else self.faces_queue.get()
+                except queue.Empty:
+                    break
+                if item is DONE:
+                    remaining -= 1
+                    continue
+                batch.append(item)
+                num_faces += len(item[4])
+            if not batch:
+                continue
+
+            t0 = time.perf_counter()
+            try:
+                embeddings = embedder.embed([f['face'] for item in batch for f in item[4]])
+            except Exception as e:
+                self.count('errors')
+                print(f"⚠️  Error calculando embeddings: {e}")
+                embeddings = None
+            self.stats['embed'].add(len(batch), time.perf_counter() - t0)
+
+            offset = 0
+            for source, seq, frame, seconds, faces in batch:
+                if embeddings is None:
+                    faces = []
+                frame_embeddings = embeddings[offset:offset + len(faces)] if faces else None
+                offset += len(faces)
+                self.embedded_queue.put((source, seq, frame, seconds, faces, frame_embeddings))
+        self.embedded_queue.put(DONE)
+
+    # --- Etapa 4: matching ---
+
+    def match(self) -> None:
+        while True:
+            item = self.embedded_queue.get()
+            if item is DONE:
+                self.hits_queue.put(DONE)
+                return
+            source, seq, frame, seconds, faces, embeddings = item
+            t0 = time.perf_counter()
+            hits = []
+            if faces:
+                candidates = self.gallery.search_batch(normalize_rows(embeddings), top_k=self.top_k)
+                for face_obj, face_candidates in zip(faces, candidates):
+                    best = face_candidates[0]
+                    if best['similarity'] <= self.threshold:
+                        continue
+                    hits.append({
+                        'source': str(source),
+                        'frame': frame,
+                        'timestamp': round(seconds, 3) if seconds is not None else None,
+                        'time': format_time(seconds),
+                        'person_name': best['name'],
+                        'similarity': best['similarity'],
+                        'avg_similarity': best['avg_similarity'],
+                        'facial_area': self.api.serialize_facial_area(face_obj['facial_area']),
+                        'face_confidence': float(face_obj['confidence']),
+                        'candidates': [{'name': c['name'], 'similarity': c['similarity']}
+                                       for c in face_candidates],
+                        'gallery_version': self.gallery.version
+                    })
+            self.count('faces', len(faces))
+            self.stats['match'].add(1, time.perf_counter() - t0)
+            self.hits_queue.put((source, seq, frame, hits))
+
+    # --- Escritura (hilo principal) ---
+
+    def prepare_output(self) -> None:
+        """Conserva solo las coincidencias de frames confirmados en el progreso (sin duplicados al continuar)"""
+        if not self.output.exists():
+            return
+        kept = []
+        with open(self.output, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    hit = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # Última línea cortada por la interrupción
+                if self.progress.hits_to_keep(hit):
+                    kept.append(line if line.endswith('\n') else line + '\n')
+        tmp = self.output.with_name(self.output.name + '.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.writelines(kept)
+        tmp.replace(self.output)
+
+    def report(self, started: float, final: bool = False) -> List[Dict]:
+        elapsed = time.perf_counter() - started
+        rows = [stats.report(elapsed) for stats in self.stats.values()]
+        c = self.counters
+        print(f"{'📊' if final else '⏱️ '} {elapsed:.0f}s  muestreados={c['sampled']}  "
+              f"sin cambio={c['scene_skipped']}  rostros={c['faces']}  coincidencias={c['hits']}")
+        for row in rows:
+            print(f"     {row['stage']:<7} {row['frames']:>7} frames  {row['fps'] or 0:7.1f} fps  "
+                  f"(ocupada {row['busy_s']:.1f}s → {row['fps_busy'] or 0:.1f} fps)")
+        return rows
+
+    def run(self) -> Dict:
+        if not self.progress.sources:
+            self.output.unlink(missing_ok=True)  # Sin progreso previo: empezar de cero
+        for source in self.sources:
+            try:
+                self.progress.check(source)  # Antes de filtrar: las coincidencias de archivos cambiados se descartan
+            except OSError:
+                pass  # Se reporta al decodificarlo
+        self.prepare_output()
+        self.output.parent.mkdir(parents=True, exist_ok=True)
+        self.prepare_embedder()
+
+        threads = [threading.Thread(target=self.decode, name='scan-decode', daemon=True)]
+        threads += [threading.Thread(target=self.detect, name=f'scan-detect-{i}', daemon=True)
+                    for i in range(self.detect_workers)]
+        threads += [threading.Thread(target=self.embed, name='scan-embed', daemon=True),
+                    threading.Thread(target=self.match, name='scan-match', daemon=True)]
+
+        started = time.perf_counter()
+        last_checkpoint = last_report = started
+        for thread in threads:
+            thread.start()
+
+        try:
+            with open(self.output, 'a', encoding='utf-8') as out:
+                while True:
+                    item = self.hits_queue.get()
+                    if item is DONE:
+                        break
+                    source, seq, frame, hits = item
+                    for hit in hits:
+                        out.write(json.dumps(hit, ensure_ascii=False) + '\n')
+                    self.count('hits', len(hits))
+                    self.progress.complete(source, seq, frame)
+
+                    now = time.perf_counter()
+                    if now - last_checkpoint >= CHECKPOINT_INTERVAL:
+                        # Primero las coincidencias en disco, después el progreso que las confirma
+                        out.flush()
+                        self.progress.save()
+                        last_checkpoint = now
+                    if now - last_report >= REPORT_INTERVAL:
+                        self.report(started)
+                        last_report = now
+        finally:
+            # También al interrumpir (Ctrl+C): el archivo ya se cerró, el progreso no queda adelantado
+            self.progress.save()
+
+        with self.counters_lock:
+            counters = dict(self.counters)
+        return {'stages': self.report(started, final=True), **counters,
+                'failed_sources': self.progress.failed(),
+                'elapsed_s': round(time.perf_counter() - started, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Buscar la lista de requisitoriados en videos e imágenes")
+    parser.add_argument('paths', nargs='+', type=Path, help="Videos, imágenes o carpetas")
+    parser.add_argument('--output', type=Path, default=Path('coincidencias.jsonl'))
+    parser.add_argument('--fps', type=float, default=2.0, help="Frames por segundo de video a analizar (0 = todos)")
+    parser.add_argument('--scene-threshold', type=int, default=3,
+                        help="Bits de dHash (de 256) que deben cambiar respecto del último frame analizado "
+                             "para volver a analizar la escena (-1 = analizar todo)")
+    parser.add_argument('--detect-workers', type=int, default=2)
+    parser.add_argument('--threshold', type=float, default=None, help="Similitud mínima (por defecto THRESHOLD de la API)")
+    parser.add_argument('--camera-id', default=None, help="Región de interés de roi_masks.json a aplicar")
+    parser.add_argument('--top-k', type=int, default=3, help="Candidatos guardados por coincidencia")
+    parser.add_argument('--no-resume', action='store_true', help="Ignorar el progreso guardado y empezar de cero")
+    args = parser.parse_args()
+
+    sources = list_sources(args.paths)
+    if not sources:
+        print("❌ No se encontraron videos ni imágenes")
+        return
+
+    # Mismo modelo, detector y galería que la API
+    import face_recognition_api as api
+    if not api.load_trained_embeddings():
+        print("❌ No hay galería entrenada")
+        return
+
+    scanner = Scanner(api, sources, args.output, sample_fps=args.fps,
+                      scene_threshold=args.scene_threshold, detect_workers=args.detect_workers,
+                      threshold=args.threshold, camera_id=args.camera_id, top_k=args.top_k,
+                      resume=not args.no_resume)
+    print(f"\n🎞️  Escaneando {len(sources)} archivos → {args.output}")
+    try:
+        summary = scanner.run()
+    except KeyboardInterrupt:
+        print("\n⏸️  Interrumpido: el progreso quedó guardado, volver a ejecutar para continuar")
+        return
+    print(f"✅ {summary['hits']} coincidencias en {summary['elapsed_s']:.0f}s → {args.output}")
+    if summary['failed_sources']:
+        print(f"⚠️  {len(summary['failed_sources'])} archivos no se pudieron leer (se reintentan en la próxima ejecución)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+Servidor de producción con varios procesos
+Un solo proceso de Flask no escala con los núcleos: el GIL serializa el
+Python de cada request y TensorFlow carga el modelo una vez por proceso.
+face_server.py abre el puerto una sola vez y lanza N workers (fork) que
+aceptan conexiones del mismo socket, cada uno con su propio modelo, su cola
+de inferencia y sus hilos fijados a un subconjunto de los núcleos.
+
+- La galería se abre con memory-map desde public/trained-faces/: todos los
+  workers comparten las mismas páginas del archivo (y de la copia cuantizada,
+  ver face_quantization.py) en lugar de copiar la matriz cada uno.
+- Las recargas son de todos los workers: el supervisor revisa los archivos
+  del store e inicia una nueva generación; cada worker aplica los deltas
+  nuevos sobre la base compartida y la publica con ese mismo número de
+  versión (X-Gallery-Version igual en todos). El supervisor compacta los
+  deltas en una nueva base solo al pasar DELTA_COMPACT_THRESHOLD o con
+  POST /reload?full=true. POST /reload en cualquier worker hace lo mismo.
+- Si un worker termina inesperadamente, el supervisor lanza otro.
+
+Necesita fork (Linux / macOS); en Windows usar python face_recognition_api.py.
+
+Uso:
+    python face_server.py --workers 8 --threads 4 --port 5000
+"""
+
+import os
+import sys
+import time
+import socket
+import signal
+import argparse
+import threading
+import multiprocessing
+from typing import Dict, List, Tuple
+
+WORKER_POLL_INTERVAL = 0.2  # Segundos entre revisiones de la generación en cada worker
+SUPERVISOR_INTERVAL = 1.0  # Segundos entre revisiones de los workers
+RESTART_BACKOFF = 5.0  # Espera mínima entre reinicios de un mismo worker
+LISTEN_BACKLOG = 1024  # Conexiones pendientes en el socket compartido
+THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS')
+
+
+class Cluster:
+    """
+    Estado compartido entre el supervisor y los workers (memoria compartida)
+
+    - generation: versión de la galería que deben publicar todos los workers
+    - loaded / failed: última generación publicada / fallida por cada worker
+    - alive: workers en ejecución (los caídos no se esperan en wait_reload)
+    - prepared: firma de los archivos del store tras la última preparación
+      (la compactación cambia los archivos y no debe disparar otra recarga)
+    - full_generation: última generación pedida como recarga completa
+      (las demás se aplican como deltas sobre la base que ya tiene cada worker)
+    """
+
+    def __init__(self, workers: int, context, store_file, json_file, compact_threshold: int):
+        self.store_file = store_file
+        self.json_file = json_file
+        self.compact_threshold = compact_threshold
+        self.lock = context.Lock()
+        self.generation = context.Value('q', 1, lock=False)
+        self.loaded = context.Array('q', workers, lock=False)
+        self.failed = context.Array('q', workers, lock=False)
+        self.alive = context.Array('b', workers, lock=False)
+        self.prepared = context.Value('q', 0, lock=False)
+        self.full_generation = context.Value('q', 0, lock=False)
+        self.worker_id = None  # Se asigna dentro de cada worker
+
+    @property
+    def workers(self) -> int:
+        return len(self.alive)
+
+    def current_generation(self) -> int:
+        return self.generation.value
+
+    def prepare_store(self, force_compact: bool = False) -> None:
+        """
+        Convierte el JSON del formato anterior y compacta los deltas pendientes
+        si pasan compact_threshold (o con force_compact); por debajo, cada
+        worker los aplica en memoria sobre la base compartida
+        """
+        from face_store import needs_conversion, convert_json, compact_store, last_delta_seq, read_meta
+
+        if needs_conversion(self.json_file, self.store_file):
+            print(f"🔄 Convirtiendo {self.json_file} → {self.store_file}")
+            convert_json(self.json_file, self.store_file)
+        if not self.store_file.exists():
+            return
+        pending = last_delta_seq(self.store_file) - read_meta(self.store_file).get('applied_seq', 0)
+        if pending > 0 and (force_compact or pending >= self.compact_threshold):
+            t0 = time.perf_counter()
+            compact_store(self.store_file)
+            print(f"🗜️  Store compactado ({pending} deltas) en {time.perf_counter() - t0:.1f}s")
+
+    def signature(self) -> int:
+        from face_store import store_signature
+
+        return hash(tuple(s or (-1, -1) for s in store_signature(self.store_file, self.json_file)))
+
+    def request_reload(self, full: bool = False) -> int:
+        """
+        Prepara el store e inicia una nueva generación; retorna su número (para wait_reload)
+        Con full=True compacta siempre y los workers releen la galería completa
+        """
+        with self.lock:
+            return self._next_generation(full)
+
+    def reload_if_changed(self) -> None:
+        """Para el StoreWatcher del supervisor: ignora los cambios hechos por la propia preparación"""
+        with self.lock:
+            if self.signature() != self.prepared.value:
+                self._next_generation()
+
+    def _next_generation(self, full: bool = False) -> int:
+        try:
+            self.prepare_store(force_compact=full)
+        except Exception as e:
+            print(f"⚠️  Error preparando el store para la recarga: {e}")
+        self.prepared.value = self.signature()
+        self.generation.value += 1
+        if full:
+            self.full_generation.value = self.generation.value
+        return self.generation.value
+
+    def wait_reload(self, generation: int, timeout: float) -> Tuple[bool, bool]:
+        """Espera a que todos los workers vivos publiquen (o fallen) la generación; retorna (terminó, éxito)"""
+        deadline = time.monotonic() + timeout
+        while True:
+            pending = [i for i in range(self.workers) if self.alive[i]
+                       and max(self.loaded[i], self.failed[i]) < generation]
+            if not pending:
+                return True, all(self.loaded[i] >= generation
+                                 for i in range(self.workers) if self.alive[i])
+            if time.monotonic() >= deadline:
+                return False, None
+            time.sleep(0.05)
+
+    def stats(self) -> Dict:
+        return {
+            'worker': self.worker_id,
+            'generation': self.generation.value,
+            'workers': [
+                {'id': i, 'alive': bool(self.alive[i]), 'loaded': self.loaded[i], 'failed': self.failed[i]}
+                for i in range(self.workers)
+            ]
+        }
+
+
+def partition_cpus(workers: int) -> List[List[int]]:
+    """Núcleos disponibles repartidos entre los workers (intercalados)"""
+    try:
+        cpus = sorted(os.sched_getaffinity(0))
+    except AttributeError:  # macOS no permite fijar afinidad
+        cpus = list(range(os.cpu_count() or 1))
+    return [cpus[i::workers] or cpus for i in range(workers)]
+
+
+def follow_generations(api, cluster: Cluster) -> None:
+    """Hilo de cada worker: recarga la galería cuando el supervisor inicia una nueva generación"""
+    worker_id = cluster.worker_id
+    attempted = 0
+    while True:
+        time.sleep(WORKER_POLL_INTERVAL)
+        if 'load_gallery' not in api.startup['phases']:
+            continue  # El warm-up todavía no cargó la primera versión
+
+        target = cluster.current_generation()
+        published = api.gallery.version if api.gallery is not None else 0
+        if published >= target:
+            cluster.loaded[worker_id] = published
+            continue
+        if attempted >= target:
+            continue  # Ya falló esta generación: esperar a la siguiente
+
+        attempted = target
+        # Incremental: solo deltas nuevos sobre la base compartida (si el supervisor
+        # compactó, refresh_gallery detecta la nueva base y la abre completa)
+        full = cluster.full_generation.value > published
+        done, success = api.wait_reload(api.schedule_reload(full=full, version=target), None)
+        if success and api.gallery is not None and api.gallery.version >= target:
+            cluster.loaded[worker_id] = api.gallery.version
+        else:
+            cluster.failed[worker_id] = target
+
+
+def run_worker(worker_id: int, listener: socket.socket, address: Tuple[str, int],
+               cluster: Cluster, cpus: List[int], threads: int) -> None:
+    """Proceso worker: fija núcleos e hilos, prepara el modelo y atiende el socket compartido"""
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+    # TensorFlow lee estas variables al importarse (en el warm-up, después de este punto)
+    os.environ['TF_NUM_INTRAOP_THREADS'] = str(threads)
+    os.environ['TF_NUM_INTEROP_THREADS'] = '1'
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C lo maneja el supervisor
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)  # Un worker reiniciado hereda el handler del supervisor
+
+    import cv2
+    import face_recognition_api as api
+    from werkzeug.serving import make_server
+
+    cv2.setNumThreads(threads)
+    api.INFERENCE_THREADS = threads  # ONNX Runtime no lee las variables de entorno
+    cluster.worker_id = worker_id
+    api.cluster = cluster
+
+    threading.Thread(target=api.warm_up, name='warm-up', daemon=True).start()
+    threading.Thread(target=follow_generations, args=(api, cluster),
+                     name='generation-follower', daemon=True).start()
+
+    server = make_server(address[0], address[1], api.app, threaded=True, fd=listener.fileno())
+    print(f"👷 Worker {worker_id} (pid {os.getpid()}) en núcleos {cpus}, {threads} hilos")
+    server.serve_forever()
+
+
+def serve(host: str, port: int, workers: int, threads: int) -> None:
+    """Supervisor: abre el puerto, lanza los workers, vigila el store y reinicia workers caídos"""
+    import face_recognition_api as api
+    from face_store import StoreWatcher
+
+    context = multiprocessing.get_context('fork')
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(LISTEN_BACKLOG)
+    listener.set_inheritable(True)
+
+    cluster = Cluster(workers, context, api.STORE_FILE, api.EMBEDDINGS_FILE, api.DELTA_COMPACT_THRESHOLD)
+    try:
+        cluster.prepare_store()
+    except Exception as e:
+        print(f"⚠️  Error preparando el store: {e}")
+    cluster.prepared.value = cluster.signature()
+
+    cpu_sets = partition_cpus(workers)
+    processes: Dict[int, multiprocessing.Process] = {}
+    started: Dict[int, float] = {}
+
+    def start(worker_id: int) -> None:
+        process = context.Process(target=run_worker, name=f'face-worker-{worker_id}',
+                                  args=(worker_id, listener, (host, port), cluster,
+                                        cpu_sets[worker_id], threads))
+        cluster.loaded[worker_id] = cluster.failed[worker_id] = 0
+        process.start()
+        cluster.alive[worker_id] = 1
+        processes[worker_id] = process
+        started[worker_id] = time.monotonic()
+
+    for worker_id in range(workers):
+        start(worker_id)
+
+    watcher = None
+    if api.GALLERY_WATCH_INTERVAL > 0:
+        watcher = StoreWatcher(cluster.reload_if_changed, api.STORE_FILE, api.EMBEDDINGS_FILE,
+                               api.GALLERY_WATCH_INTERVAL)
+        watcher.start()
+
+    print(f"🚀 {workers} workers × {threads} hilos en http://{host}:{port} (supervisor pid {os.getpid()})")
+
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    try:
+        while not stopping.wait(SUPERVISOR_INTERVAL):
+            for worker_id, process in processes.items():
+                if process.is_alive():
+                    continue
+                cluster.alive[worker_id] = 0
+                if time.monotonic() - started[worker_id] >= RESTART_BACKOFF:
+                    print(f"⚠️  Worker {worker_id} terminó (código {process.exitcode}), reiniciando")
+                    start(worker_id)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print("\n🛑 Deteniendo workers...")
+        if watcher is not None:
+            watcher.stop()
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            process.join(timeout=10)
+            if process.is_alive():
+                process.kill()
+        listener.close()
+
+
+def main():
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="API de reconocimiento facial con varios procesos")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--threads', type=int, default=2,
+                        help="Hilos de TensorFlow / OpenCV / BLAS por worker")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Procesos worker (por defecto: núcleos / hilos)")
+    args = parser.parse_args()
+
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        print("❌ face_server.py necesita fork (Linux / macOS); usar python face_recognition_api.py")
+        sys.exit(1)
+
+    workers = args.workers or max(1, cpus // args.threads)
+    # Antes de importar NumPy: los workers heredan el tamaño de los pools de BLAS/OpenMP
+    for name in THREAD_ENV_VARS:
+        os.environ.setdefault(name, str(args.threads))
+
+    serve(args.host, args.port, workers, args.threads)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+"""
+Almacenamiento binario de la galería de embeddings
+La matriz se guarda como float32 en un archivo .npy (ya L2-normalizada y
+agrupada por identidad) y los metadatos en un pequeño JSON al lado.
+La API abre la matriz con np.load(mmap_mode='r'): cargar o recargar tarda
+milisegundos y varios procesos del servidor comparten las mismas páginas.
+
+    public/trained-faces/face_embeddings.npy        matriz (n, d) float32
+    public/trained-faces/face_embeddings.meta.json  nombres, conteos, modelo...
+
+Los archivos face_embeddings.json del formato anterior se convierten
+automáticamente la primera vez que se cargan.
+
+Los cambios incrementales (agregar, reemplazar o eliminar una identidad) se
+escriben como deltas append-only sin reescribir la matriz:
+
+    public/trained-faces/face_embeddings.deltas.jsonl   una línea por cambio
+    public/trained-faces/face_embeddings.deltas/        embeddings de cada cambio
+
+Al cargar, los deltas posteriores a la base se aplican en memoria;
+compact_store() los incorpora a una nueva base y borra sus archivos.
+
+StoreWatcher revisa estos archivos (polling con os.stat, sin dependencias)
+para que la API recargue la galería sola después de cada entrenamiento.
+"""
+
+import os
+import json
+import time
+import threading
+import numpy as np
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from face_gallery import FaceGallery, normalize_rows, read_identities
+
+STORE_FORMAT = 1
+DELTA_OPS = ('add', 'replace', 'remove')
+STORE_FILE = Path("public/trained-faces/face_embeddings.npy")
+LEGACY_JSON_FILE = Path("public/trained-faces/face_embeddings.json")
+STORE_READ_RETRIES = 5  # Lecturas de un store que se está reemplazando antes de darse por vencido
+
+
+def meta_path(store_file: Path) -> Path:
+    """Ruta del JSON de metadatos que acompaña a la matriz"""
+    return store_file.with_suffix('.meta.json')
+
+
+def atomic_save_npy(path: Path, matrix: np.ndarray) -> None:
+    """Escribe un .npy en un archivo temporal y lo renombra (los lectores nunca ven un archivo a medias)"""
+    tmp = path.with_name(path.name + '.tmp')
+    with open(tmp, 'wb') as f:
+        np.save(f, matrix)
+    os.replace(tmp, path)
+
+
+def atomic_save_json(path: Path, data: Dict) -> None:
+    """Escribe un JSON de forma atómica"""
+    tmp = path.with_name(path.name + '.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def save_store(identities: List[Dict], store_file: Path = STORE_FILE,
+               model: str = None, detector: str = None, applied_seq: int = None) -> Path:
+    """
+    Guarda una lista de identidades ({"name", "embeddings", ...}) como store binario
+    Los campos extra de cada identidad (valid_photos, failed_photos...) van al sidecar
+    applied_seq: último delta incluido en esta base (por defecto todos los existentes)
+    """
+    if applied_seq is None:
+        applied_seq = last_delta_seq(store_file)
+
+    blocks = [normalize_rows(np.asarray(ident['embeddings'], dtype=np.float32))
+              for ident in identities]
+    matrix = np.ascontiguousarray(np.vstack(blocks)) if blocks else np.empty((0, 0), np.float32)
+
+    meta = {
+        'format': STORE_FORMAT,
+        'model': model,
+        'detector': detector,
+        'embedding_size': int(matrix.shape[1]) if matrix.size else None,
+        'num_embeddings': int(matrix.shape[0]),
+        'timestamp': datetime.now().isoformat(),
+        'applied_seq': applied_seq,
+        'identities': [
+            dict({k: v for k, v in ident.items() if k != 'embeddings'}, count=len(block))
+            for ident, block in zip(identities, blocks)
+        ]
+    }
+
+    store_file.parent.mkdir(parents=True, exist_ok=True)
+    # Primero la matriz y después los metadatos: el sidecar confirma la escritura
+    # y registra qué matriz describe (mtime), para detectar lecturas a mitad de un reemplazo
+    atomic_save_npy(store_file, matrix)
+    meta['matrix_mtime_ns'] = os.stat(store_file).st_mtime_ns
+    atomic_save_json(meta_path(store_file), meta)
+    prune_deltas(store_file, applied_seq)
+    return store_file
+
+
+def read_meta(store_file: Path = STORE_FILE) -> Dict:
+    """Lee el sidecar de metadatos"""
+    with open(meta_path(store_file), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def load_store(store_file: Path = STORE_FILE, mmap: bool = True) -> FaceGallery:
+    """Abre el store binario como FaceGallery (sin copiar la matriz si mmap=True)"""
+    for attempt in range(STORE_READ_RETRIES):
+        meta = read_meta(store_file)
+        before = os.stat(store_file).st_mtime_ns
+        matrix = np.load(store_file, mmap_mode='r' if mmap else None)
+        after = os.stat(store_file).st_mtime_ns
+        # Matriz nueva con metadatos viejos: un entrenamiento está reemplazando el store
+        if before == after == meta.get('matrix_mtime_ns', before):
+            break
+        time.sleep(0.1)
+    else:
+        # Estable pero con otro mtime (p. ej. copiado con cp): se confía en los conteos
+        print(f"⚠️  {store_file} no coincide con el mtime de sus metadatos")
+
+    if matrix.shape[0] != meta['num_embeddings']:
+        raise ValueError(f"{store_file} tiene {matrix.shape[0]} filas, "
+                         f"los metadatos indican {meta['num_embeddings']}")
+
+    gallery = FaceGallery(
+        names=[ident['name'] for ident in meta['identities']],
+        matrix=matrix,
+        counts=[ident['count'] for ident in meta['identities']],
+        model=meta.get('model'),
+        embedding_size=meta.get('embedding_size')
+    )
+    gallery.base_seq = gallery.delta_seq = meta.get('applied_seq', 0)
+    gallery.base_timestamp = meta.get('timestamp')
+    return gallery
+
+
+def convert_json(json_file: Path = LEGACY_JSON_FILE, store_file: Path = STORE_FILE) -> Path:
+    """Convierte un face_embeddings.json (formato anterior) al store binario"""
+    with open(json_file, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    identities = read_identities(data)
+    if 'identities' not in data:
+        # Conservar los datos de entrenamiento del formato de una sola persona
+        identities[0]['failed_photos'] = data.get('failed_photos', [])
+
+    return save_store(identities, store_file,
+                      model=data.get('model'), detector=data.get('detector'))
+
+
+def needs_conversion(json_file: Path, store_file: Path) -> bool:
+    """El JSON existe y es más reciente que el store binario"""
+    if not json_file.exists():
+        return False
+    if not store_file.exists() or not meta_path(store_file).exists():
+        return True
+    return json_file.stat().st_mtime > meta_path(store_file).stat().st_mtime
+
+
+def load_gallery(store_file: Path = STORE_FILE, json_file: Path = LEGACY_JSON_FILE,
+                 mmap: bool = True) -> FaceGallery:
+    """
+    Carga la galería desde el store binario, convirtiendo antes el JSON
+    del formato anterior si existe y es más reciente
+    """
+    if store_file.suffix == '.json':
+        # Se indicó directamente un JSON: su store va al lado con extensión .npy
+        json_file, store_file = store_file, store_file.with_suffix('.npy')
+
+    if needs_conversion(json_file, store_file):
+        print(f"🔄 Convirtiendo {json_file} → {store_file}")
+        convert_json(json_file, store_file)
+
+    if not store_file.exists():
+        raise FileNotFoundError(f"No se encontró {store_file} ni {json_file}")
+
+    gallery = load_store(store_file, mmap=mmap)
+    return apply_deltas(gallery, read_deltas(store_file, after_seq=gallery.delta_seq), store_file)
+
+
+def store_exists(store_file: Path = STORE_FILE, json_file: Path = LEGACY_JSON_FILE) -> bool:
+    """Hay una galería disponible en cualquiera de los dos formatos"""
+    return store_file.exists() or json_file.exists()
+
+
+# --- Deltas incrementales ---
+
+def delta_log_path(store_file: Path = STORE_FILE) -> Path:
+    """Log JSONL de cambios incrementales"""
+    return store_file.with_suffix('.deltas.jsonl')
+
+
+def delta_dir(store_file: Path = STORE_FILE) -> Path:
+    """Directorio con los embeddings de cada delta"""
+    return store_file.with_suffix('.deltas')
+
+
+def read_deltas(store_file: Path = STORE_FILE, after_seq: int = 0) -> List[Dict]:
+    """Entradas del log con seq > after_seq (una última línea incompleta se ignora)"""
+    log = delta_log_path(store_file)
+    if not log.exists():
+        return []
+
+    entries = []
+    with open(log, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if entry['seq'] > after_seq:
+                entries.append(entry)
+    return sorted(entries, key=lambda e: e['seq'])
+
+
+def last_delta_seq(store_file: Path = STORE_FILE) -> int:
+    entries = read_deltas(store_file)
+    return entries[-1]['seq'] if entries else 0
+
+
+def append_delta(op: str, name: str, embeddings: Optional[np.ndarray] = None,
+                 store_file: Path = STORE_FILE, **extra) -> Dict:
+    """
+    Registra un cambio de una identidad sin reescribir la galería
+    - add: agrega embeddings a la identidad (la crea si no existe)
+    - replace: reemplaza todos los embeddings de la identidad
+    - remove: elimina la identidad
+    El costo es proporcional al cambio, no al tamaño de la galería.
+    """
+    if op not in DELTA_OPS:
+        raise ValueError(f"Operación desconocida: {op} (opciones: {', '.join(DELTA_OPS)})")
+    if op != 'remove' and (embeddings is None or not len(embeddings)):
+        raise ValueError(f"La operación {op} requiere embeddings")
+
+    directory = delta_dir(store_file)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    # Reservar el número de secuencia creando su archivo en exclusiva
+    seq = last_delta_seq(store_file) + 1
+    while True:
+        delta_file = directory / f"{seq:08d}.npy"
+        try:
+            with open(delta_file, 'xb') as f:
+                if op != 'remove':
+                    np.save(f, normalize_rows(np.asarray(embeddings, dtype=np.float32)))
+            break
+        except FileExistsError:
+            seq += 1
+
+    entry = dict(extra, seq=seq, op=op, name=name,
+                 count=0 if op == 'remove' else len(embeddings),
+                 timestamp=datetime.now().isoformat())
+    log = delta_log_path(store_file)
+    line = json.dumps(entry, ensure_ascii=False) + '\n'
+    if log.exists() and log.stat().st_size:
+        # Si una escritura anterior quedó cortada, empezar en una línea nueva
+        with open(log, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                line = '\n' + line
+    with open(log, 'a', encoding='utf-8') as f:
+        f.write(line)
+    return entry
+
+
+def load_delta_embeddings(entry: Dict, store_file: Path = STORE_FILE) -> np.ndarray:
+    return np.load(delta_dir(store_file) / f"{entry['seq']:08d}.npy")
+
+
+def apply_deltas(gallery: FaceGallery, entries: List[Dict],
+                 store_file: Path = STORE_FILE) -> FaceGallery:
+    """Aplica deltas del log en memoria; retorna la misma galería si no hay cambios"""
+    if not entries:
+        return gallery
+
+    updates: Dict[str, Optional[np.ndarray]] = {}
+    for entry in entries:
+        name = entry['name']
+        if entry['op'] == 'remove':
+            updates[name] = None
+            continue
+
+        embeddings = load_delta_embeddings(entry, store_file)
+        if entry['op'] == 'add':
+            if name in updates:
+                current = updates[name]
+            elif name in gallery.positions:
+                current = gallery.identity_embeddings(name)
+            else:
+                current = None
+            if current is not None:
+                embeddings = np.vstack([current, embeddings])
+        updates[name] = embeddings
+
+    new_gallery = gallery.with_identities(updates)
+    new_gallery.delta_seq = entries[-1]['seq']
+    return new_gallery
+
+
+def refresh_gallery(gallery: FaceGallery, store_file: Path = STORE_FILE,
+                    json_file: Path = LEGACY_JSON_FILE) -> FaceGallery:
+    """
+    Galería actualizada leyendo solo lo que cambió desde que se cargó `gallery`
+    - sin cambios: la misma galería
+    - solo deltas nuevos: se aplican en memoria sobre la galería actual
+    - nueva base (entrenamiento completo o compactación): recarga completa
+    """
+    if gallery is None or needs_conversion(json_file, store_file):
+        return load_gallery(store_file, json_file)
+    meta = read_meta(store_file)
+    if meta.get('applied_seq', 0) != gallery.base_seq or meta.get('timestamp') != gallery.base_timestamp:
+        return load_gallery(store_file, json_file)
+    return apply_deltas(gallery, read_deltas(store_file, after_seq=gallery.delta_seq), store_file)
+
+
+def prune_deltas(store_file: Path, applied_seq: int) -> None:
+    """Borra los archivos de deltas ya incluidos en la base (el log se conserva)"""
+    directory = delta_dir(store_file)
+    if not directory.exists():
+        return
+    for delta_file in directory.glob('*.npy'):
+        if delta_file.stem.isdigit() and int(delta_file.stem) <= applied_seq:
+            delta_file.unlink(missing_ok=True)
+
+
+def merge_identity_meta(identities: List[Dict], entries: List[Dict]) -> Dict[str, Dict]:
+    """Metadatos por identidad (nombre → dict): los de la base más los campos extra de los deltas"""
+    identity_meta = {ident['name']: dict(ident) for ident in identities}
+    for entry in entries:
+        extra = {k: v for k, v in entry.items() if k not in ('seq', 'op', 'count', 'timestamp')}
+        if entry['op'] == 'remove':
+            identity_meta.pop(entry['name'], None)
+        elif entry['op'] == 'add' and entry['name'] in identity_meta:
+            merged = identity_meta[entry['name']]
+            for key, value in extra.items():
+                merged[key] = merged.get(key, []) + value if isinstance(value, list) else value
+        else:
+            identity_meta[entry['name']] = extra
+    return identity_meta
+
+
+def compact_store(store_file: Path = STORE_FILE) -> Path:
+    """Incorpora los deltas pendientes a una nueva base del store"""
+    meta = read_meta(store_file)
+    entries = read_deltas(store_file, after_seq=meta.get('applied_seq', 0))
+    if not entries:
+        return store_file
+
+    gallery = apply_deltas(load_store(store_file), entries, store_file)
+
+    identity_meta = merge_identity_meta(meta['identities'], entries)
+    identities = [
+        dict(identity_meta.get(name, {'name': name}), embeddings=gallery.identity_embeddings(name))
+        for name in gallery.names
+    ]
+    return save_store(identities, store_file, model=meta.get('model'),
+                      detector=meta.get('detector'), applied_seq=gallery.delta_seq)
+
+
+def store_signature(store_file: Path = STORE_FILE, json_file: Path = LEGACY_JSON_FILE) -> Tuple:
+    """(mtime, tamaño) de los archivos que definen la galería: cambia con cada entrenamiento o delta"""
+    signature = []
+    for path in (meta_path(store_file), delta_log_path(store_file), json_file):
+        try:
+            stat = os.stat(path)
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            signature.append(None)
+    return tuple(signature)
+
+
+class StoreWatcher:
+    """
+    Hilo que revisa los archivos del store cada `interval` segundos y llama a
+    on_change cuando cambian. Espera a que la firma se mantenga igual durante
+    una revisión completa para no disparar a mitad de una escritura.
+    """
+
+    def __init__(self, on_change: Callable[[], None], store_file: Path = STORE_FILE,
+                 json_file: Path = LEGACY_JSON_FILE, interval: float = 2.0):
+        self.on_change = on_change
+        self.store_file = store_file
+        self.json_file = json_file
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='store-watcher', daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+    def _run(self) -> None:
+        loaded = seen = store_signature(self.store_file, self.json_file)
+        while not self.stopped.wait(self.interval):
+            current = store_signature(self.store_file, self.json_file)
+            if current != loaded and current == seen:
+                loaded = current
+                try:
+                    self.on_change()
+                except Exception as e:
+                    print(f"⚠️  Error al recargar tras un cambio en {self.store_file.parent}: {e}")
+            seen = current
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Seguimiento de rostros entre frames para sesiones de streaming por cámara
+Cada rostro detectado se asocia a un track existente por IoU de su
+facial_area. Facenet512 solo se ejecuta para tracks nuevos o, cada cierto
+tiempo, para confirmar la identidad de un track ya reconocido: una persona
+que permanece frente a la cámara un minuto se reconoce unas pocas veces en
+lugar de en cada frame.
+"""
+
+import time
+import threading
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+
+
+def box_array(boxes: List[Dict]) -> np.ndarray:
+    """facial_area de DeepFace → (n, 4) con x1, y1, x2, y2"""
+    return np.array([[b['x'], b['y'], b['x'] + b['w'], b['y'] + b['h']] for b in boxes],
+                    dtype=np.float32).reshape(-1, 4)
+
+
+def iou_matrix(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """IoU entre cada caja de a (n, 4) y cada caja de b (m, 4)"""
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-6)
+
+
+class Track:
+    """Un rostro seguido a través de los frames de una cámara"""
+
+    def __init__(self, track_id: int, box: Dict, now: float):
+        self.id = track_id
+        self.box = box
+        self.first_seen = now
+        self.last_seen = now
+        self.last_embedded = None
+        self.frames = 1
+        self.embeddings = 0
+        self.result = None  # Último resultado de reconocimiento (formato /recognize)
+
+    def needs_embedding(self, now: float, reembed_interval: float) -> bool:
+        return self.last_embedded is None or now - self.last_embedded >= reembed_interval
+
+
+class FaceTracker:
+    """
+    Asociación greedy por IoU entre detecciones y tracks
+
+    - iou_threshold: IoU mínimo para considerar que una detección es el mismo rostro
+    - max_age: segundos sin ver un track antes de descartarlo
+    - reembed_interval: segundos entre embeddings de confirmación de un mismo track
+    """
+
+    def __init__(self, iou_threshold: float = 0.3, max_age: float = 1.5,
+                 reembed_interval: float = 3.0):
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.reembed_interval = reembed_interval
+        self.tracks: List[Track] = []
+        self.next_id = 1
+
+    def update(self, boxes: List[Dict], now: float = None) -> List[Tuple[Track, bool]]:
+        """
+        Asocia las detecciones de un frame a los tracks
+        Retorna, para cada caja en el mismo orden, (track, necesita embedding)
+        """
+        now = time.monotonic() if now is None else now
+        self.tracks = [t for t in self.tracks if now - t.last_seen <= self.max_age]
+
+        assigned: List[Optional[Track]] = [None] * len(boxes)
+        if boxes and self.tracks:
+            ious = iou_matrix(box_array(boxes), box_array([t.box for t in self.tracks]))
+            # Pares de mayor IoU primero; cada detección y cada track se usan una vez
+            used = set()
+            for flat in np.argsort(-ious, axis=None):
+                d, t = np.unravel_index(flat, ious.shape)
+                if ious[d, t] < self.iou_threshold:
+                    break
+                if assigned[d] is None and t not in used:
+                    used.add(t)
+                    track = self.tracks[t]
+                    assigned[d] = track
+                    track.box = boxes[d]
+                    track.last_seen = now
+                    track.frames += 1
+
+        for d, box in enumerate(boxes):
+            if assigned[d] is None:
+                assigned[d] = Track(self.next_id, box, now)
+                self.next_id += 1
+                self.tracks.append(assigned[d])
+
+        return [(track, track.needs_embedding(now, self.reembed_interval)) for track in assigned]
+
+
+class StreamSession:
+    """
+    Sesión de streaming de una cámara
+    busy garantiza un solo frame en proceso: los frames que llegan mientras
+    tanto se descartan en lugar de encolarse, así la latencia no se acumula
+    """
+
+    def __init__(self, camera_id: str, tracker: FaceTracker):
+        self.camera_id = camera_id
+        self.tracker = tracker
+        self.busy = threading.Lock()
+        self.updated = threading.Condition()
+        self.sequence = 0  # Frames procesados
+        self.last_result = None
+        self.frames_received = 0
+        self.frames_dropped = 0
+        self.embeddings = 0
+        self.created = time.monotonic()
+        self.last_activity = self.created
+        self.closed = False
+
+    def publish(self, result: Dict) -> None:
+        """Guarda el resultado de un frame procesado y despierta a los suscriptores"""
+        with self.updated:
+            self.sequence += 1
+            self.last_result = result
+            self.updated.notify_all()
+
+    def wait(self, after: int, timeout: float) -> Tuple[int, Optional[Dict]]:
+        """Espera un resultado posterior a `after` (o el cierre de la sesión)"""
+        with self.updated:
+            self.updated.wait_for(lambda: self.sequence > after or self.closed, timeout)
+            return self.sequence, self.last_result
+
+    def close(self) -> None:
+        with self.updated:
+            self.closed = True
+            self.updated.notify_all()
+
+    def stats(self) -> Dict:
+        now = time.monotonic()
+        return {
+            'camera_id': self.camera_id,
+            'frames_received': self.frames_received,
+            'frames_processed': self.sequence,
+            'frames_dropped': self.frames_dropped,
+            'embeddings': self.embeddings,
+            'active_tracks': len(self.tracker.tracks),
+            'age_seconds': round(now - self.created, 1),
+            'idle_seconds': round(now - self.last_activity, 1)
+        }
+
+
+class SessionRegistry:
+    """Sesiones por ID de cámara; las inactivas por más de `ttl` segundos se cierran"""
+
+    def __init__(self, ttl: float = 60.0, max_sessions: int = 64, **tracker_options):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.tracker_options = tracker_options
+        self.sessions: Dict[str, StreamSession] = {}
+        self.lock = threading.Lock()
+
+    def expire(self) -> None:
+        now = time.monotonic()
+        with self.lock:
+            for camera_id, session in list(self.sessions.items()):
+                if now - session.last_activity > self.ttl:
+                    session.close()
+                    del self.sessions[camera_id]
+
+    def get(self, camera_id: str, create: bool = True) -> Optional[StreamSession]:
+        self.expire()
+        with self.lock:
+            session = self.sessions.get(camera_id)
+            if session is None and create:
+                if len(self.sessions) >= self.max_sessions:
+                    raise RuntimeError(f"Máximo {self.max_sessions} sesiones de streaming")
+                session = StreamSession(camera_id, FaceTracker(**self.tracker_options))
+                self.sessions[camera_id] = session
+            if session is not None:
+                session.last_activity = time.monotonic()
+            return session
+
+    def remove(self, camera_id: str) -> bool:
+        with self.lock:
+            session = self.sessions.pop(camera_id, None)
+        if session is not None:
+            session.close()
+        return session is not None
+
+    def stats(self) -> List[Dict]:
+        self.expire()
+        with self.lock:
+            return [s.stats() for s in self.sessions.values()]
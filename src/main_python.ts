@@ -22,6 +22,13 @@ interface DetectionResult {
   faceName?: string;
 }
 
+interface PythonCandidate {
+  name: string;
+  similarity: number;
+  avg_similarity: number;
+  num_embeddings: number;
+}
+
 interface PythonAPIResponse {
   success: boolean;
   face_detected: boolean;
@@ -30,6 +37,8 @@ interface PythonAPIResponse {
   confidence: number;
   max_similarity: number;
   avg_similarity: number;
+  candidates?: PythonCandidate[];
+  facial_area?: { x: number; y: number; w: number; h: number };
 }
 
 class WebcamDetector {
@@ -115,8 +124,15 @@ class WebcamDetector {
       const response = await fetch(`${this.API_URL}/health`);
       const data = await response.json();
 
+      if (data.status === 'ok' && data.ready === false && data.state !== 'failed') {
+        // El proceso está vivo pero el modelo aún se está preparando
+        this.showNotification('API iniciando, preparando el modelo...', 'info');
+        window.setTimeout(() => this.checkAPIStatus(), 2000);
+        return;
+      }
+
       if (data.status === 'ok') {
-        this.apiReady = data.embeddings_loaded;
+        this.apiReady = data.embeddings_loaded && data.ready !== false;
         this.personName = data.person;
 
         if (this.apiReady) {
@@ -199,7 +215,7 @@ class WebcamDetector {
 
     try {
       // Capturar frame actual
-      const imageData = this.captureFrame();
+      const imageData = await this.captureFrame();
 
       // Enviar a API Python
       const result = await this.recognizeFace(imageData);
@@ -211,28 +227,32 @@ class WebcamDetector {
     }
   }
 
-  private captureFrame(): string {
+  private captureFrame(): Promise<Blob | null> {
     const tempCanvas = document.createElement('canvas');
     tempCanvas.width = this.video.videoWidth;
     tempCanvas.height = this.video.videoHeight;
     const ctx = tempCanvas.getContext('2d');
 
-    if (ctx) {
-      ctx.drawImage(this.video, 0, 0);
-      return tempCanvas.toDataURL('image/jpeg', 0.8);
+    if (!ctx) {
+      return Promise.resolve(null);
     }
 
-    return '';
+    ctx.drawImage(this.video, 0, 0);
+
+    // JPEG binario (sin base64): ~33% menos bytes y sin decodificación extra en la API
+    return new Promise((resolve) => tempCanvas.toBlob(resolve, 'image/jpeg', 0.8));
   }
 
-  private async recognizeFace(imageData: string): Promise<PythonAPIResponse | null> {
+  private async recognizeFace(imageData: Blob | null): Promise<PythonAPIResponse | null> {
+    if (!imageData) return null;
+
     try {
       const response = await fetch(`${this.API_URL}/recognize`, {
         method: 'POST',
         headers: {
-          'Content-Type': 'application/json',
+          'Content-Type': 'image/jpeg',
         },
-        body: JSON.stringify({ image: imageData })
+        body: imageData
       });
 
       if (!response.ok) {
@@ -331,7 +351,7 @@ class WebcamDetector {
     this.showScanningAnimation();
 
     // Capturar frame
-    const imageData = this.captureFrame();
+    const imageData = await this.captureFrame();
 
     // Enviar a API
     const apiResult = await this.recognizeFace(imageData);
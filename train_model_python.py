@@ -7,19 +7,262 @@ Extremadamente resistente a cambios de iluminación, pose, ruido, etc.
 
 import os
 import json
+import time
+import queue
+import hashlib
+import argparse
+import threading
+import multiprocessing
 import cv2
 import numpy as np
+from collections import deque
 from datetime import datetime
+from itertools import islice
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from typing import List, Dict, Tuple
-from deepface import DeepFace
 from tqdm import tqdm
 
+from face_store import (save_store, read_meta, meta_path, atomic_save_npy, atomic_save_json,
+                        append_delta, compact_store, delta_log_path)
+from face_inference import FaceEmbedder
+from face_backends import BACKENDS, batch_buckets
+from face_preprocessing import FacePreprocessor
+from face_gallery import normalize_rows
+from face_quality import identity_statistics, OUTLIER_THRESHOLD
+
 # Configuración
 MODEL_NAME = "Facenet512"  # Opciones: VGG-Face, Facenet, Facenet512, OpenFace, DeepFace, DeepID, ArcFace, Dlib, SFace
 DETECTOR_BACKEND = "opencv"  # Opciones: opencv, ssd, dlib, mtcnn, retinaface, mediapipe
+DETECTION_MAX_SIDE = 960  # Lado mayor (px) de la copia reducida donde se detecta (mismo valor que en face_recognition_api.py)
 OUTPUT_DIR = Path("public/trained-faces")
+STORE_FILE = OUTPUT_DIR / "face_embeddings.npy"
 PHOTOS_DIR = Path("training_photos")
+CACHE_DIR = OUTPUT_DIR / "embedding_cache"  # Embeddings por foto, indexados por hash del contenido
+EXTRACTION_WORKERS = min(4, os.cpu_count() or 1)  # Procesos de lectura + detección (cada uno carga su detector)
+EXTRACTION_BATCH_SIZE = 32  # Rostros por pasada del modelo
+INFERENCE_BACKEND = "tf_function"  # keras (eager), tf_function, savedmodel u onnx (ver face_backends.py)
+CAPTURE_MIN_FACE_SIZE = 80  # Lado mínimo (px) del rostro en una foto capturada con la webcam
+CAPTURE_MIN_SHARPNESS = 40.0  # Nitidez mínima del rostro capturado (varianza del Laplaciano; menos = movida o desenfocada)
+
+
+def file_hash(path: Path) -> str:
+    """SHA-1 del contenido del archivo (no depende del nombre ni de la fecha); None si no se puede leer"""
+    digest = hashlib.sha1()
+    try:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+class PhotoEmbeddingCache:
+    """
+    Cache en disco de resultados por foto, uno por hash de contenido
+    (no confundir con face_cache.EmbeddingCache, el cache en memoria de la API)
+    Se separa por modelo, backend de inferencia, detector y resolución de detección:
+    cambiar cualquiera invalida el cache.
+
+        <hash>.npy   embedding de la foto
+        <hash>.json  error de una foto sin rostro válido
+    """
+
+    def __init__(self, directory: Path = CACHE_DIR, model: str = MODEL_NAME,
+                 backend: str = INFERENCE_BACKEND, detector: str = DETECTOR_BACKEND,
+                 max_side: int = DETECTION_MAX_SIDE):
+        key = f"{model}_{backend}_{detector}"
+        self.directory = directory / (f"{key}_{max_side}" if max_side else key)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def get(self, key: str):
+        """Retorna el embedding, el mensaje de error o None si la foto no está en cache"""
+        embedding_file = self.directory / f"{key}.npy"
+        if embedding_file.exists():
+            return np.load(embedding_file)
+        error_file = self.directory / f"{key}.json"
+        if error_file.exists():
+            with open(error_file, 'r', encoding='utf-8') as f:
+                return json.load(f)['error']
+        return None
+
+    def put(self, key: str, embedding: np.ndarray) -> None:
+        atomic_save_npy(self.directory / f"{key}.npy", np.asarray(embedding, dtype=np.float32))
+
+    def put_error(self, key: str, error: str) -> None:
+        atomic_save_json(self.directory / f"{key}.json", {'error': error})
+
+
+def read_and_detect(item: Tuple[int, Path]) -> Tuple[int, str, object]:
+    """
+    Lee una foto y detecta su rostro (corre en los procesos de extracción)
+    Retorna (índice, estado, valor) con estado:
+      'face'    rostro detectado, pendiente de embedding
+      'no_face' foto sin rostro válido (el error se guarda en el cache)
+      'error'   error de lectura, se reintenta en la próxima ejecución
+    """
+    i, photo_path = item
+    try:
+        img = cv2.imdecode(np.fromfile(str(photo_path), dtype=np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            return i, 'no_face', "No se pudo decodificar la imagen"
+        # Mismo preprocesamiento que la API; si hay varios rostros tomamos el primero
+        preprocessor = FacePreprocessor(DETECTOR_BACKEND, DETECTION_MAX_SIDE)
+        return i, 'face', preprocessor.detect(img, align=True)[0]['face']
+    except ValueError as e:
+        return i, 'no_face', str(e)
+    except Exception as e:
+        return i, 'error', str(e)
+
+
+def capture_problem(img: np.ndarray, faces: List[Dict]) -> str:
+    """Motivo por el que una foto capturada no sirve para entrenar, o None si sirve"""
+    if len(faces) != 1:
+        return f"hay {len(faces)} rostros en la foto, debe haber uno solo"
+    area = faces[0]['facial_area']
+    size = min(area['w'], area['h'])
+    if size < CAPTURE_MIN_FACE_SIZE:
+        return f"rostro muy pequeño ({size}px, mínimo {CAPTURE_MIN_FACE_SIZE}px): acércate a la cámara"
+    # Nitidez sobre el recorte sin alinear (la rotación agrega bordes negros que la inflan)
+    x, y = max(area['x'], 0), max(area['y'], 0)
+    gray = cv2.cvtColor(img[y:y + area['h'], x:x + area['w']], cv2.COLOR_BGR2GRAY)
+    sharpness = cv2.Laplacian(gray, cv2.CV_64F).var()
+    if sharpness < CAPTURE_MIN_SHARPNESS:
+        return f"rostro borroso (nitidez {sharpness:.0f}, mínimo {CAPTURE_MIN_SHARPNESS:.0f}): quédate quieto"
+    return None
+
+
+class LatestFrameDetector:
+    """
+    Detección de rostros para la vista previa, en un hilo aparte
+    Siempre trabaja sobre el último frame recibido (los intermedios se
+    descartan), así la vista previa va a la velocidad de la cámara y dibuja
+    las últimas cajas conocidas
+    """
+
+    def __init__(self, preprocessor: FacePreprocessor):
+        self.preprocessor = preprocessor
+        self.frame = None
+        self.boxes = []
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        self.stopped = False
+        self.thread = threading.Thread(target=self._run, name='preview-detector', daemon=True)
+        self.thread.start()
+
+    def submit(self, frame: np.ndarray) -> None:
+        with self.lock:
+            self.frame = frame
+        self.ready.set()
+
+    def stop(self) -> None:
+        self.stopped = True
+        self.ready.set()
+        self.thread.join()
+
+    def _run(self) -> None:
+        while True:
+            self.ready.wait()
+            self.ready.clear()
+            if self.stopped:
+                return
+            with self.lock:
+                frame, self.frame = self.frame, None
+            if frame is None:
+                continue
+            try:
+                faces = self.preprocessor.detect(frame, align=False)
+            except ValueError:
+                faces = []
+            self.boxes = [face['facial_area'] for face in faces]
+
+
+class CaptureWorker:
+    """
+    Revisa y procesa en segundo plano las fotos capturadas con la webcam
+
+    Por cada foto: la codifica en JPEG, detecta el rostro sobre la imagen ya
+    codificada (lo mismo que leerá extract_embeddings), revisa su calidad y,
+    si sirve, la guarda y calcula su embedding en el cache de embeddings. Al
+    terminar la captura, extract_embeddings encuentra todas las fotos en cache.
+    Sin cache (precompute=False) solo revisa la calidad.
+    """
+
+    def __init__(self, backend: str = INFERENCE_BACKEND, precompute: bool = True):
+        self.backend = backend
+        self.cache = PhotoEmbeddingCache(backend=backend) if precompute else None
+        self.preprocessor = FacePreprocessor(DETECTOR_BACKEND, DETECTION_MAX_SIDE)
+        self.embedder = None
+        self.requests = queue.Queue()
+        self.results = queue.Queue()  # (ruta, motivo de rechazo o None)
+        self.pending = 0
+        self.thread = threading.Thread(target=self._run, name='capture-worker', daemon=True)
+        self.thread.start()
+
+    def submit(self, frame: np.ndarray, photo_path: Path) -> None:
+        self.pending += 1
+        self.requests.put((frame, photo_path))
+
+    def poll(self) -> List[Tuple[Path, str]]:
+        """Fotos ya revisadas desde la última llamada"""
+        done = []
+        while True:
+            try:
+                done.append(self.results.get_nowait())
+            except queue.Empty:
+                break
+        self.pending -= len(done)
+        return done
+
+    def close(self) -> None:
+        self.requests.put(None)
+        self.thread.join()
+
+    def _run(self) -> None:
+        if self.cache is not None:
+            # El modelo se carga mientras el usuario se acomoda frente a la cámara
+            try:
+                self.embedder = FaceEmbedder(MODEL_NAME, backend=self.backend)
+                self.embedder.check_parity()
+                if self.embedder.backend.name != self.backend:
+                    self.cache = None  # Volvió a keras: no guardar sus embeddings en el cache de otro backend
+            except Exception as e:
+                # Sin modelo la captura sigue: solo se revisa la calidad y los
+                # embeddings se calculan después, en extract_embeddings
+                print(f"⚠️  No se pudo cargar el backend {self.backend} durante la captura: {e}")
+                self.embedder = None
+                self.cache = None
+        while True:
+            item = self.requests.get()
+            if item is None:
+                return
+            frame, photo_path = item
+            try:
+                self.results.put((photo_path, self._process(frame, photo_path)))
+            except Exception as e:
+                self.results.put((photo_path, str(e)))
+
+    def _process(self, frame: np.ndarray, photo_path: Path) -> str:
+        ok, encoded = cv2.imencode('.jpg', frame)
+        if not ok:
+            return "no se pudo codificar la foto"
+        img = cv2.imdecode(encoded, cv2.IMREAD_COLOR)
+        try:
+            faces = self.preprocessor.detect(img, align=True)
+        except ValueError:
+            faces = []
+        problem = capture_problem(img, faces)
+        if problem:
+            return problem
+
+        data = encoded.tobytes()
+        photo_path.write_bytes(data)
+        if self.cache is not None:
+            embedding = self.embedder.forward(self.embedder.prepare([faces[0]['face']]))[0]
+            self.cache.put(hashlib.sha1(data).hexdigest(), embedding)  # Misma clave que file_hash
+        return None
+
 
 class FaceTrainer:
     def __init__(self, person_name: str):
@@ -27,14 +270,20 @@ class FaceTrainer:
         self.embeddings = []
         self.valid_photos = []
         self.failed_photos = []
+        self.statistics = None
 
         # Crear directorios
         OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
         PHOTOS_DIR.mkdir(parents=True, exist_ok=True)
 
-    def capture_from_webcam(self, num_photos: int = 20) -> None:
+    def capture_from_webcam(self, num_photos: int = 20, backend: str = INFERENCE_BACKEND,
+                            precompute: bool = True) -> List[Path]:
         """
         Captura fotos desde la webcam con guías visuales
+        La detección de la vista previa y la revisión de cada foto corren en
+        hilos aparte: la ventana sigue a la velocidad de la cámara. Cada foto
+        se revisa (un solo rostro, tamaño y nitidez mínimos) y, con precompute,
+        su embedding queda en el cache antes de terminar la captura.
         """
         print(f"\n🎥 Iniciando captura de {num_photos} fotos desde webcam...")
         print("📸 Instrucciones:")
@@ -47,68 +296,83 @@ class FaceTrainer:
         if not cap.isOpened():
             raise Exception("No se pudo abrir la webcam")
 
+        detector = LatestFrameDetector(FacePreprocessor(DETECTOR_BACKEND, DETECTION_MAX_SIDE))
+        worker = CaptureWorker(backend, precompute)
         captured = 0
+        attempts = 0
         photo_paths = []
+        message, message_until = None, 0.0
+
+        def collect():
+            """Cuenta las fotos ya revisadas por el worker"""
+            nonlocal captured, message, message_until
+            for photo_path, problem in worker.poll():
+                if problem:
+                    print(f"✗ Foto descartada: {problem}")
+                    message = f"Descartada: {problem}"
+                else:
+                    photo_paths.append(photo_path)
+                    captured += 1
+                    print(f"✓ Foto {captured}/{num_photos} capturada")
+                    message = f"Foto {captured}/{num_photos} OK"
+                message_until = time.monotonic() + 2.0
 
         while captured < num_photos:
             ret, frame = cap.read()
             if not ret:
                 continue
+            detector.submit(frame)
+            collect()
 
-            # Detectar rostro en tiempo real
-            try:
-                faces = DeepFace.extract_faces(
-                    img_path=frame,
-                    detector_backend=DETECTOR_BACKEND,
-                    enforce_detection=False
-                )
-
-                # Dibujar rectángulo alrededor del rostro
-                if faces:
-                    for face_obj in faces:
-                        facial_area = face_obj['facial_area']
-                        x, y, w, h = facial_area['x'], facial_area['y'], facial_area['w'], facial_area['h']
-
-                        # Rectángulo verde si detecta rostro
-                        cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
-                        cv2.putText(frame, "Rostro Detectado", (x, y-10),
-                                  cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
-            except:
-                pass
+            # Las anotaciones van sobre una copia: la foto guardada es el frame original
+            preview = frame.copy()
+            for area in detector.boxes:
+                x, y, w, h = area['x'], area['y'], area['w'], area['h']
+
+                # Rectángulo verde si detecta rostro
+                cv2.rectangle(preview, (x, y), (x+w, y+h), (0, 255, 0), 2)
+                cv2.putText(preview, "Rostro Detectado", (x, y-10),
+                          cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
 
             # Mostrar información
-            cv2.putText(frame, f"Fotos: {captured}/{num_photos}", (10, 30),
+            status = f"Fotos: {captured}/{num_photos}" + (f" (+{worker.pending} revisando)" if worker.pending else "")
+            cv2.putText(preview, status, (10, 30),
                        cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-            cv2.putText(frame, "ESPACIO: Capturar | Q: Salir", (10, 70),
+            cv2.putText(preview, "ESPACIO: Capturar | Q: Salir", (10, 70),
                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
+            if message and time.monotonic() < message_until:
+                cv2.putText(preview, message, (10, 110),
+                           cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 200, 255), 2)
 
             # Círculo guía central
-            h, w = frame.shape[:2]
-            cv2.circle(frame, (w//2, h//2), 150, (0, 255, 255), 2)
+            h, w = preview.shape[:2]
+            cv2.circle(preview, (w//2, h//2), 150, (0, 255, 255), 2)
 
-            cv2.imshow('Entrenamiento - Captura de Fotos', frame)
+            cv2.imshow('Entrenamiento - Captura de Fotos', preview)
 
             key = cv2.waitKey(1) & 0xFF
 
-            if key == ord(' '):  # Espacio para capturar
-                # Guardar foto
-                photo_path = PHOTOS_DIR / f"{self.person_name.replace(' ', '_')}_{captured+1}.jpg"
-                cv2.imwrite(str(photo_path), frame)
-                photo_paths.append(photo_path)
-                captured += 1
+            if key == ord(' ') and captured + worker.pending < num_photos:  # Espacio para capturar
+                attempts += 1
+                photo_path = PHOTOS_DIR / f"{self.person_name.replace(' ', '_')}_{attempts}.jpg"
+                worker.submit(frame, photo_path)
 
                 # Efecto flash
                 flash = np.ones_like(frame) * 255
                 cv2.imshow('Entrenamiento - Captura de Fotos', flash)
                 cv2.waitKey(100)
 
-                print(f"✓ Foto {captured}/{num_photos} capturada")
-
             elif key == ord('q'):
                 break
 
         cap.release()
         cv2.destroyAllWindows()
+        detector.stop()
+
+        if worker.pending:
+            print(f"⏳ Revisando {worker.pending} fotos pendientes...")
+        worker.close()
+        collect()
 
         print(f"\n✅ Captura completada: {captured} fotos guardadas en {PHOTOS_DIR}")
         return photo_paths
@@ -129,9 +393,16 @@ class FaceTrainer:
 
         return sorted(photos)
 
-    def extract_embeddings(self, photo_paths: List[Path]) -> None:
+    def extract_embeddings(self, photo_paths: List[Path], workers: int = EXTRACTION_WORKERS,
+                           batch_size: int = EXTRACTION_BATCH_SIZE, use_cache: bool = True,
+                           backend: str = INFERENCE_BACKEND) -> None:
         """
         Extrae embeddings de todas las fotos usando DeepFace
+        La lectura y detección corren en `workers` procesos y el modelo procesa
+        los rostros en lotes de `batch_size` con el backend de inferencia
+        `backend`. Con use_cache, las fotos ya procesadas (mismo contenido,
+        modelo y detector) se leen del cache, así que repetir el entrenamiento
+        solo procesa fotos nuevas o modificadas.
         """
         print(f"\n🧠 Extrayendo embeddings con modelo {MODEL_NAME}...")
         print(f"   Este modelo es extremadamente robusto contra:")
@@ -141,66 +412,136 @@ class FaceTrainer:
         print("   ✓ Ruido y baja calidad de imagen")
         print("   ✓ Oclusiones parciales (lentes, gorras, etc.)\n")
 
-        for photo_path in tqdm(photo_paths, desc="Procesando fotos"):
-            try:
-                # Extraer embedding usando DeepFace
-                embedding_objs = DeepFace.represent(
-                    img_path=str(photo_path),
-                    model_name=MODEL_NAME,
-                    detector_backend=DETECTOR_BACKEND,
-                    enforce_detection=True,
-                    align=True  # Alinear rostro antes de extraer features
-                )
-
-                # DeepFace puede detectar múltiples rostros, tomamos el primero
-                if embedding_objs:
-                    embedding = embedding_objs[0]["embedding"]
-                    self.embeddings.append(embedding)
-                    self.valid_photos.append(str(photo_path))
-
-            except Exception as e:
-                self.failed_photos.append((str(photo_path), str(e)))
-                tqdm.write(f"✗ Error en {photo_path.name}: {str(e)}")
+        results = {}  # índice de la foto → embedding o mensaje de error
+        keys = [None] * len(photo_paths)
+        todo = list(enumerate(photo_paths))
+
+        # Las fotos cuyo contenido ya se procesó se leen del cache
+        cache = PhotoEmbeddingCache(backend=backend) if use_cache else None
+        if cache:
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as hash_pool:
+                keys = list(hash_pool.map(file_hash, photo_paths))
+            for i, key in enumerate(keys):
+                hit = cache.get(key) if key else None
+                if hit is not None:
+                    results[i] = hit
+            todo = [(i, p) for i, p in todo if i not in results]
+        cached = len(results)
+
+        if todo:
+            self._extract_pending(todo, keys, results, cache, workers, batch_size, backend)
+
+        for i, photo_path in enumerate(photo_paths):
+            result = results[i]
+            if isinstance(result, str):
+                self.failed_photos.append((str(photo_path), result))
+                tqdm.write(f"✗ Error en {photo_path.name}: {result}")
+            else:
+                self.embeddings.append(result.tolist())
+                self.valid_photos.append(str(photo_path))
 
         print(f"\n✅ Procesamiento completado:")
         print(f"   ✓ Exitosos: {len(self.valid_photos)}")
+        print(f"   ♻️  Desde cache: {cached}")
         print(f"   ✗ Fallidos: {len(self.failed_photos)}")
 
-    def save_embeddings(self) -> Path:
+    def _extract_pending(self, todo: List[Tuple[int, Path]], keys: List[str], results: Dict,
+                         cache: PhotoEmbeddingCache, workers: int, batch_size: int, backend: str) -> None:
+        """Detecta en `workers` procesos y calcula embeddings por lotes para las fotos sin cache"""
+        embedder = FaceEmbedder(MODEL_NAME, backend=backend, buckets=batch_buckets(batch_size))
+        embedder.check_parity()
+        if embedder.backend.name != backend:
+            cache = None  # Volvió a keras: no guardar sus embeddings en el cache de otro backend
+        pending = []
+
+        def embed():
+            """Una sola pasada del modelo para los rostros pendientes"""
+            if not pending:
+                return
+            embeddings = embedder.forward(embedder.prepare([face for _, face in pending]))
+            for (i, _), embedding in zip(pending, embeddings):
+                results[i] = embedding
+                if cache and keys[i]:
+                    cache.put(keys[i], embedding)
+            pending.clear()
+
+        # Los detectores de DeepFace son singletons no thread-safe: con varios
+        # workers cada uno es un proceso con su propio detector
+        if workers > 1:
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        else:
+            pool = ThreadPoolExecutor(max_workers=1)
+
+        items = iter(todo)
+        window = 2 * max(workers, batch_size)  # Fotos en vuelo: acota la memoria de rostros detectados
+        with pool, tqdm(total=len(todo), desc="Procesando fotos") as progress:
+            # Los workers detectan por adelantado mientras este proceso ejecuta el modelo por lotes
+            inflight = deque(pool.submit(read_and_detect, item) for item in islice(items, window))
+            while inflight:
+                i, status, value = inflight.popleft().result()
+                for item in islice(items, 1):
+                    inflight.append(pool.submit(read_and_detect, item))
+
+                if status == 'face':
+                    pending.append((i, value))
+                    if len(pending) >= batch_size:
+                        embed()
+                else:
+                    results[i] = value
+                    if status == 'no_face' and cache and keys[i]:
+                        cache.put_error(keys[i], value)
+                progress.update(1)
+            embed()
+
+    def save_embeddings(self, mode: str = 'full') -> Path:
         """
-        Guarda los embeddings en formato JSON compatible con el frontend
+        Guarda los embeddings en el store binario (matriz float32 .npy + metadatos JSON)
+        que la API abre con memory-map
+
+        mode:
+          'full'    reescribe la galería solo con esta persona (comportamiento original)
+          'add'     agrega estas fotos a la identidad dentro de la galería existente
+          'replace' reemplaza la identidad dentro de la galería existente
+        add/replace escriben un delta append-only (ver face_store.append_delta)
         """
         if not self.embeddings:
             raise ValueError("No hay embeddings para guardar")
 
-        # Convertir embeddings a formato serializable
-        embeddings_list = [emb if isinstance(emb, list) else emb.tolist()
-                          for emb in self.embeddings]
-
-        output_data = {
+        identity = {
             "name": self.person_name,
-            "model": MODEL_NAME,
-            "detector": DETECTOR_BACKEND,
-            "embeddings": embeddings_list,
-            "embedding_size": len(embeddings_list[0]),
+            "embeddings": np.asarray(self.embeddings, dtype=np.float32),
             "num_photos": len(self.valid_photos),
-            "timestamp": datetime.now().isoformat(),
             "valid_photos": self.valid_photos,
             "failed_photos": [{"path": p, "error": e} for p, e in self.failed_photos]
         }
+        if self.statistics:
+            identity["statistics"] = self.statistics
 
-        # Guardar archivo principal
-        output_file = OUTPUT_DIR / "face_embeddings.json"
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(output_data, f, indent=2, ensure_ascii=False)
-
-        # Guardar backup con timestamp
-        backup_file = OUTPUT_DIR / f"face_embeddings_{self.person_name.replace(' ', '_')}_{int(datetime.now().timestamp())}.json"
-        with open(backup_file, 'w', encoding='utf-8') as f:
-            json.dump(output_data, f, indent=2, ensure_ascii=False)
+        if mode == 'full':
+            # Guardar archivo principal
+            output_file = save_store([identity], STORE_FILE, model=MODEL_NAME, detector=DETECTOR_BACKEND)
+            backup_meta = read_meta(STORE_FILE)
+        else:
+            extra = {k: v for k, v in identity.items() if k not in ('name', 'embeddings')}
+            entry = append_delta(mode, self.person_name, identity["embeddings"], STORE_FILE, **extra)
+            output_file = delta_log_path(STORE_FILE)
+            backup_meta = entry
+
+        # Guardar backup con timestamp (un solo .npz comprimido con matriz y metadatos)
+        backup_file = OUTPUT_DIR / f"face_embeddings_{self.person_name.replace(' ', '_')}_{int(datetime.now().timestamp())}.npz"
+        np.savez_compressed(
+            backup_file,
+            embeddings=identity["embeddings"],
+            meta=json.dumps(backup_meta, ensure_ascii=False)
+        )
 
         print(f"\n💾 Embeddings guardados:")
-        print(f"   📄 Archivo principal: {output_file}")
+        if mode == 'full':
+            print(f"   📄 Archivo principal: {output_file}")
+            print(f"   📄 Metadatos: {meta_path(output_file)}")
+        else:
+            print(f"   📄 Delta #{entry['seq']} ({mode}): {output_file}")
+            print(f"   🔄 La API lo aplica con POST /reload")
         print(f"   📄 Backup: {backup_file}")
 
         return output_file
@@ -208,35 +549,40 @@ class FaceTrainer:
     def compute_statistics(self) -> Dict:
         """
         Calcula estadísticas de calidad del entrenamiento
+        Similitudes por bloques sobre embeddings normalizados (ver face_quality.py),
+        más fotos atípicas y casi duplicadas
         """
         if not self.embeddings:
             return {}
 
-        embeddings_array = np.array(self.embeddings)
-
-        # Calcular similitudes entre embeddings (distancia coseno)
-        from scipy.spatial.distance import cosine
-
-        similarities = []
-        for i in range(len(embeddings_array)):
-            for j in range(i+1, len(embeddings_array)):
-                similarity = 1 - cosine(embeddings_array[i], embeddings_array[j])
-                similarities.append(similarity)
+        embeddings_array = normalize_rows(np.asarray(self.embeddings, dtype=np.float32))
+        photos = self.valid_photos if len(self.valid_photos) == len(embeddings_array) else None
+        quality = identity_statistics(embeddings_array, photos)
+        intra = quality['intra']
 
         stats = {
-            "mean_similarity": float(np.mean(similarities)) if similarities else 0,
-            "std_similarity": float(np.std(similarities)) if similarities else 0,
-            "min_similarity": float(np.min(similarities)) if similarities else 0,
-            "max_similarity": float(np.max(similarities)) if similarities else 0,
-            "embedding_dimension": len(embeddings_array[0]),
-            "num_embeddings": len(embeddings_array)
+            "mean_similarity": intra.get('mean', 0),
+            "std_similarity": intra.get('std', 0),
+            "min_similarity": intra.get('min', 0),
+            "max_similarity": intra.get('max', 0),
+            "embedding_dimension": embeddings_array.shape[1],
+            "num_embeddings": len(embeddings_array),
+            "similarity_percentiles": {k: intra[k] for k in ('p5', 'p50', 'p95') if k in intra},
+            "centroid_similarity": quality['centroid_similarity'],
+            "outliers": quality['outliers'],
+            "near_duplicates": quality['near_duplicates']
         }
+        self.statistics = stats
 
         print(f"\n📊 Estadísticas de Calidad:")
         print(f"   Similitud promedio: {stats['mean_similarity']:.3f} (más cercano a 1.0 es mejor)")
         print(f"   Desviación estándar: {stats['std_similarity']:.3f} (menor es más consistente)")
         print(f"   Dimensión del embedding: {stats['embedding_dimension']}")
         print(f"   Total de embeddings: {stats['num_embeddings']}")
+        print(f"   Fotos atípicas: {len(stats['outliers'])} (similitud con el resto < {OUTLIER_THRESHOLD})")
+        print(f"   Fotos casi duplicadas: {len(stats['near_duplicates'])} pares")
+        for outlier in stats['outliers'][:5]:
+            print(f"      ⚠️  {outlier['photo']}: {outlier['centroid_similarity']:.3f}")
 
         if stats['mean_similarity'] > 0.8:
             print("   ✅ Excelente calidad de entrenamiento!")
@@ -249,6 +595,31 @@ class FaceTrainer:
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Entrenamiento de reconocimiento facial")
+    parser.add_argument('--workers', type=int, default=EXTRACTION_WORKERS,
+                        help="Procesos de lectura y detección de rostros")
+    parser.add_argument('--batch-size', type=int, default=EXTRACTION_BATCH_SIZE,
+                        help="Rostros por pasada del modelo")
+    parser.add_argument('--backend', choices=BACKENDS, default=INFERENCE_BACKEND,
+                        help="Backend de inferencia del modelo (ver face_backends.py)")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Reprocesar todas las fotos ignorando el cache de embeddings")
+    parser.add_argument('--mode', choices=['full', 'add', 'replace'], default='full',
+                        help="full: reescribir la galería | add/replace: cambio incremental de una identidad")
+    parser.add_argument('--remove', metavar='NOMBRE',
+                        help="Eliminar una identidad de la galería (delta incremental) y salir")
+    parser.add_argument('--compact', action='store_true',
+                        help="Incorporar los deltas pendientes a la galería base y salir")
+    args = parser.parse_args()
+
+    if args.remove:
+        entry = append_delta('remove', args.remove, store_file=STORE_FILE)
+        print(f"🗑️  Delta #{entry['seq']}: '{args.remove}' eliminado (POST /reload para aplicarlo)")
+        return
+    if args.compact:
+        print(f"🗜️  Store compactado: {compact_store(STORE_FILE)}")
+        return
+
     print("="*70)
     print("🎯 SISTEMA DE ENTRENAMIENTO DE RECONOCIMIENTO FACIAL ROBUSTO")
     print("="*70)
@@ -281,7 +652,8 @@ def main():
         num_photos = input("\n¿Cuántas fotos deseas capturar? (recomendado: 20-30): ").strip()
         num_photos = int(num_photos) if num_photos.isdigit() else 20
 
-        photo_paths = trainer.capture_from_webcam(num_photos)
+        photo_paths = trainer.capture_from_webcam(num_photos, backend=args.backend,
+                                                  precompute=not args.no_cache)
     else:
         print(f"\n📂 Buscando fotos en {PHOTOS_DIR}...")
         photo_paths = trainer.load_photos_from_directory()
@@ -298,7 +670,8 @@ def main():
         return
 
     # Extraer embeddings
-    trainer.extract_embeddings(photo_paths)
+    trainer.extract_embeddings(photo_paths, workers=args.workers, batch_size=args.batch_size,
+                               use_cache=not args.no_cache, backend=args.backend)
 
     if not trainer.embeddings:
         print("\n❌ No se pudo extraer ningún embedding válido.")
@@ -308,7 +681,7 @@ def main():
     trainer.compute_statistics()
 
     # Guardar embeddings
-    output_file = trainer.save_embeddings()
+    output_file = trainer.save_embeddings(mode=args.mode)
 
     print("\n" + "="*70)
     print("✅ ENTRENAMIENTO COMPLETADO EXITOSAMENTE")